@@ -40,6 +40,7 @@ class DuetRRFAction(MachineAction):
         self.printerSettingsHTTPPasswordChanged.emit()
         self.printerSettingsEmbedThumbnailsChanged.emit()
         self.printerSettingsThumbnailSizesChanged.emit()
+        self.printerSettingsFleetMemberChanged.emit()
 
     def _onContainerAdded(self, container: "ContainerInterface") -> None:
         # Add this action as a supported action to all machine definitions
@@ -57,6 +58,7 @@ class DuetRRFAction(MachineAction):
         self.printerSettingsHTTPPasswordChanged.emit()
         self.printerSettingsEmbedThumbnailsChanged.emit()
         self.printerSettingsThumbnailSizesChanged.emit()
+        self.printerSettingsFleetMemberChanged.emit()
 
 
     printerSettingsUrlChanged = pyqtSignal()
@@ -65,6 +67,7 @@ class DuetRRFAction(MachineAction):
     printerSettingsHTTPPasswordChanged = pyqtSignal()
     printerSettingsEmbedThumbnailsChanged = pyqtSignal()
     printerSettingsThumbnailSizesChanged = pyqtSignal()
+    printerSettingsFleetMemberChanged = pyqtSignal()
 
     @pyqtProperty(str, notify=printerSettingsUrlChanged)
     def printerSettingUrl(self) -> Optional[str]:
@@ -108,13 +111,20 @@ class DuetRRFAction(MachineAction):
             return s["thumbnail_sizes"]
         return DEFAULT_THUMBNAIL_SIZES_STR
 
-    @pyqtSlot(str, str, str, str, bool, str)
-    def saveConfig(self, url, duet_password, http_user, http_password, embed_thumbnails, thumbnail_sizes):
+    @pyqtProperty(bool, notify=printerSettingsFleetMemberChanged)
+    def printerSettingFleetMember(self) -> Optional[bool]:
+        s = get_config()
+        if s:
+            return s["fleet_member"]
+        return False
+
+    @pyqtSlot(str, str, str, str, bool, str, bool)
+    def saveConfig(self, url, duet_password, http_user, http_password, embed_thumbnails, thumbnail_sizes, fleet_member):
         if not url.endswith('/'):
             url += '/'
 
-        Logger.log("d", f"saving config: {url=}, {duet_password=}, {http_user=}, {http_password=}, {embed_thumbnails=}, {thumbnail_sizes=}")
-        save_config(url, duet_password, http_user, http_password, embed_thumbnails, thumbnail_sizes)
+        Logger.log("d", f"saving config: {url=}, {duet_password=}, {http_user=}, {http_password=}, {embed_thumbnails=}, {thumbnail_sizes=}, {fleet_member=}")
+        save_config(url, duet_password, http_user, http_password, embed_thumbnails, thumbnail_sizes, fleet_member)
         Logger.log("d", "config saved")
 
         # trigger a stack change to reload the output devices
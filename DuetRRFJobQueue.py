@@ -0,0 +1,154 @@
+import time
+from collections import deque
+
+try: # Cura 5
+    from PyQt6.QtCore import QTimer
+except: # Cura 4
+    from PyQt5.QtCore import QTimer
+
+from cura.CuraApplication import CuraApplication
+
+from UM.Logger import Logger
+
+
+class DuetRRFJob:
+    """A queued upload/print/simulation, with the gcode serialized at queue time."""
+
+    def __init__(self, device, fileName, stream, message=None, owns_stream=True, metrics=None):
+        self.device = device
+        self.fileName = fileName
+        self.stream = stream
+        self.message = message
+        self.owns_stream = owns_stream
+        # JobMetrics started when the user confirmed the job, before serialization
+        self.metrics = metrics
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        # last request or reply of the running job, see DuetRRFJobQueue.jobAlive()
+        self.alive_at = None
+
+
+# a running job without any request, reply or upload progress for this long is considered hung
+JOB_STALL_TIMEOUT = 120
+
+
+class DuetRRFJobQueue:
+    """Runs the jobs of one printer back-to-back.
+
+    The print, simulate and upload devices of a printer share one queue, so
+    a new job can be submitted while a long upload or simulation is still
+    running, instead of failing with DeviceBusyError.
+    """
+
+    def __init__(self, name, stall_timeout=JOB_STALL_TIMEOUT):
+        self._name = name
+        self._jobs = deque()
+        self._running = None
+        self._stall_timeout = stall_timeout
+
+        # updates the waiting jobs and watches the running one
+        self._timer = QTimer()
+        self._timer.setInterval(1000)
+        self._timer.timeout.connect(self._onTick)
+
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def depth(self) -> int:
+        return len(self._jobs)
+
+    def isBusy(self) -> bool:
+        return self._running is not None
+
+    def stats(self) -> dict:
+        return {
+            "queue": self._name,
+            "depth": self.depth(),
+            "running": self._running.fileName if self._running else None,
+            "completed": self.completed,
+            "average_wait": self.total_wait / self.completed if self.completed else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+    def submit(self, job) -> int:
+        """Queues `job` and returns the number of jobs ahead of it."""
+        ahead = len(self._jobs) + (1 if self._running else 0)
+        self._jobs.append(job)
+        Logger.log("d", f"Queued {job.fileName} on {self._name} with {ahead} jobs ahead")
+        self._startNext()
+        if not self._timer.isActive():
+            self._timer.start()
+        return ahead
+
+    def cancel(self, job) -> bool:
+        """Removes a job which is still waiting, returns False if it already started."""
+        if job not in self._jobs:
+            return False
+        self._jobs.remove(job)
+        Logger.log("d", f"Cancelled {job.fileName} on {self._name} after waiting {time.monotonic() - job.queued_at:.1f} s")
+        self._updateWaiting()
+        return True
+
+    def position(self, job) -> int:
+        """Returns the number of jobs ahead of a waiting job."""
+        return list(self._jobs).index(job) + (1 if self._running else 0)
+
+    def runningJob(self):
+        return self._running
+
+    def jobAlive(self, device):
+        if self._running is not None and self._running.device is device:
+            self._running.alive_at = time.monotonic()
+
+    def jobFinished(self, device):
+        if self._running is None or self._running.device is not device:
+            return
+        job, self._running = self._running, None
+        self.completed += 1
+        Logger.log("d", f"Finished {job.fileName} on {self._name} after {time.monotonic() - job.started_at:.1f} s | {self.stats()}")
+        # don't start the next job from within the finishing job's callbacks
+        CuraApplication.getInstance().callLater(self._startNext)
+
+    def _onTick(self):
+        if self._running is None and not self._jobs:
+            self._timer.stop()
+            return
+
+        job = self._running
+        if job is not None and self._stall_timeout and time.monotonic() - job.alive_at > self._stall_timeout:
+            Logger.log("w", f"{job.fileName} on {self._name} stalled, nothing happened for {self._stall_timeout} s")
+            job.device._onJobStalled(self._stall_timeout)
+            # the device normally finishes the job itself, but a hung job must never block the queue
+            self.jobFinished(job.device)
+            return
+        self._updateWaiting()
+
+    def _updateWaiting(self):
+        for job in list(self._jobs):
+            job.device._onJobWaiting(job)
+
+    def _startNext(self):
+        if self._running is not None or not self._jobs:
+            return
+        job = self._jobs.popleft()
+        job.started_at = time.monotonic()
+        job.alive_at = job.started_at
+        wait = job.started_at - job.queued_at
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self._running = job
+        Logger.log("d", f"Starting {job.fileName} on {self._name} after waiting {wait:.1f} s, {len(self._jobs)} jobs left in queue")
+        job.device._runJob(job)
+        self._updateWaiting()
+
+
+# one queue per printer URL, shared by the print, simulate and upload devices
+_queues = {}
+
+def get_job_queue(key, stall_timeout=JOB_STALL_TIMEOUT) -> DuetRRFJobQueue:
+    queue = _queues.get(key)
+    if queue is None:
+        queue = DuetRRFJobQueue(key, stall_timeout)
+        _queues[key] = queue
+    return queue
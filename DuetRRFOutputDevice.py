@@ -1,18 +1,18 @@
 import sys
 import os.path
 import datetime
-import urllib
 import json
-import base64
+import time
+import urllib.parse
 from enum import Enum
 
 try: # Cura 5
     from PyQt6.QtNetwork import QNetworkReply
-    from PyQt6.QtCore import QUrl, QObject, QByteArray, QTimer
+    from PyQt6.QtCore import QUrl, QObject
     from PyQt6.QtGui import QDesktopServices
 except: # Cura 4
     from PyQt5.QtNetwork import QNetworkReply
-    from PyQt5.QtCore import QUrl, QObject, QByteArray, QTimer
+    from PyQt5.QtCore import QUrl, QObject
     from PyQt5.QtGui import QDesktopServices
 
 from cura.CuraApplication import CuraApplication
@@ -22,11 +22,19 @@ from UM.Application import Application
 from UM.Logger import Logger
 from UM.Message import Message
 from UM.OutputDevice.OutputDevice import OutputDevice
-from UM.OutputDevice import OutputDeviceError
 from UM.i18n import i18nCatalog
 catalog = i18nCatalog("cura")
 
-from .helpers import serializing_scene_to_gcode
+from .DuetRRFJobQueue import DuetRRFJob, get_job_queue
+from .archive import archive_stream
+from .DuetRRFSession import get_session
+from .DuetRRFSettings import FLEET_MAX_CONCURRENCY, delete_api_info, get_api_info, get_uploaded_file, save_api_info, save_uploaded_file
+from .dsf_websocket import DSFObjectModelSubscription, websocket_available
+from .metrics import JobMetrics, take_thumbnail_timings
+from .payload_cache import get_payload, payload_generation, put_payload
+from .speculative import SPECULATIVE_FILE_NAME, is_speculative_file, take_speculative_upload
+from .polling import AdaptivePollInterval, poll_scheduler
+from .helpers import GCodeSerializeJob, GCodeUploadDevice, duet_headers, duet_url
 
 class OutputStage(Enum):
     ready = 0
@@ -37,6 +45,7 @@ class DuetRRFDeviceType(Enum):
     print = 0
     simulate = 1
     upload = 2
+    fleet = 3
 
 
 class DuetRRFConfigureOutputDevice(OutputDevice):
@@ -64,8 +73,10 @@ class DuetRRFConfigureOutputDevice(OutputDevice):
 
 
 class DuetRRFOutputDevice(OutputDevice):
-    def __init__(self, config, device_type):
+    def __init__(self, config, device_type, printer_id=None, printer_name=None, headless=False):
         self._name_id = "duetrrf-{}".format(device_type.name)
+        if headless:
+            self._name_id += "-" + printer_id
         super().__init__(self._name_id)
 
         self._url = config["url"]
@@ -75,7 +86,10 @@ class DuetRRFOutputDevice(OutputDevice):
 
         self.application = CuraApplication.getInstance()
         global_container_stack = self.application.getGlobalContainerStack()
-        self._name = global_container_stack.getName()
+        self._name = printer_name or global_container_stack.getName()
+        self._printer_id = printer_id or global_container_stack.getId()
+        # headless devices are driven by another device (e.g. the fleet upload) and don't show messages
+        self._headless = headless
 
         self._device_type = device_type
         if device_type == DuetRRFDeviceType.print:
@@ -87,6 +101,9 @@ class DuetRRFOutputDevice(OutputDevice):
         elif device_type == DuetRRFDeviceType.upload:
             description = catalog.i18nc("@action:button", "Upload to {0}").format(self._name)
             priority = 10
+        elif device_type == DuetRRFDeviceType.fleet:
+            description = catalog.i18nc("@action:button", "Upload to all {0} printers").format(self._name)
+            priority = 5
         else:
             assert False
 
@@ -97,9 +114,26 @@ class DuetRRFOutputDevice(OutputDevice):
         self._stage = OutputStage.ready
         self._device_type = device_type
         self._stream = None
+        self._ownsStream = True
+        self._postData = None
         self._message = None
 
         self._use_rrf_http_api = True # by default we try to connect to the RRF HTTP API via rr_connect
+        self._api_info = {}
+        self._pollInterval = AdaptivePollInterval()
+        self._subscription = None
+        # fleet members connect with sessions of their own, the fleet device never talks to a printer
+        self._session = get_session(config) if device_type != DuetRRFDeviceType.fleet else None
+        self._session_acquired = False
+        self._jobQueue = get_job_queue(self._url)
+        self._serializeJobs = {}
+        self._queuedMessages = {}
+        # requests of the current job, aborted with it, and a counter that outdates their replies
+        self._requests = []
+        self._requestGeneration = 0
+        self._writeHolds = 0
+        self._heldWrites = []
+        self._metrics = None
 
         Logger.log("d",
             "New {} DuetRRFOutputDevice created | URL: {} | Duet password: {} | HTTP Basic Auth: user:{}, password:{}".format(
@@ -115,64 +149,105 @@ class DuetRRFOutputDevice(OutputDevice):
     def _timestamp(self):
         return ("time", datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'))
 
-    def _send(self, command, query=None, next_stage=None, data=None, on_error=None, method='POST'):
-        url = self._url + command
+    def _send(self, command, query=None, next_stage=None, data=None, on_error=None, method='POST', reauthenticate=True, content_type='application/octet-stream'):
+        url = duet_url(self._url, command, query)
+        headers = duet_headers(self._http_user, self._http_password)
 
-        if not query:
-            query = dict()
-        enc_query = urllib.parse.urlencode(query, quote_via=urllib.parse.quote)
-        if enc_query:
-            url += '?' + enc_query
-
-        headers = {
-            'User-Agent': 'Cura Plugin DuetRRF',
-            'Accept': 'application/json, text/javascript',
-            'Connection': 'keep-alive',
-        }
-
-        if self._http_user and self._http_password:
-            auth = "{}:{}".format(self._http_user, self._http_password).encode()
-            headers['Authorization'] = 'Basic ' + base64.b64encode(auth).decode()
-
-        if data:
-            headers['Content-Type'] = 'application/octet-stream'
+        if self._use_rrf_http_api:
+            headers.update(self._session.headers())
+            self._session.touch()
+
+        if not on_error:
+            on_error = self._onNetworkError
+        if self._use_rrf_http_api and reauthenticate:
+            on_error = self._reauthenticateOnError(command, query, next_stage, data, on_error, method, content_type)
+        next_stage = self._guardReply(next_stage)
+        on_error = self._guardReply(on_error)
+        self._jobQueue.jobAlive(self)
+
+        if method == 'DELETE':
+            request = self.application.getHttpRequestManager().delete(
+                url,
+                headers,
+                callback=next_stage,
+                error_callback=on_error,
+            )
+        elif data is not None:
+            headers['Content-Type'] = content_type
+            if isinstance(data, GCodeUploadDevice):
+                # without a known length Qt would buffer the whole device in memory before sending
+                headers['Content-Length'] = str(data.size())
             if method == 'PUT':
-                self.application.getHttpRequestManager().put(
+                request = self.application.getHttpRequestManager().put(
                     url,
                     headers,
                     data,
                     callback=next_stage,
-                    error_callback=on_error if on_error else self._onNetworkError,
+                    error_callback=on_error,
                     upload_progress_callback=self._onUploadProgress,
                 )
             else:
-                self.application.getHttpRequestManager().post(
+                request = self.application.getHttpRequestManager().post(
                     url,
                     headers,
                     data,
                     callback=next_stage,
-                    error_callback=on_error if on_error else self._onNetworkError,
+                    error_callback=on_error,
                     upload_progress_callback=self._onUploadProgress,
                 )
         else:
-            self.application.getHttpRequestManager().get(
+            request = self.application.getHttpRequestManager().get(
                 url,
                 headers,
                 callback=next_stage,
-                error_callback=on_error if on_error else self._onNetworkError,
+                error_callback=on_error,
             )
+        if self._stage == OutputStage.writing:
+            self._requests.append(request)
+
+    def _guardReply(self, callback):
+        if callback is None:
+            return None
+        generation = self._requestGeneration
+
+        def handler(*args):
+            if generation != self._requestGeneration:
+                # the job was aborted, its replies must not touch the next one
+                return
+            self._jobQueue.jobAlive(self)
+            callback(*args)
+
+        return handler
+
+    def _abortRequests(self):
+        self._requestGeneration += 1
+        requests, self._requests = self._requests, []
+        for request in requests:
+            self.application.getHttpRequestManager().abortRequest(request)
+
+    def _reauthenticateOnError(self, command, query, next_stage, data, on_error, method, content_type):
+        # the board dropped our session (e.g. after a reboot or timeout), reconnect once and repeat the request
+        def handler(reply, error):
+            if error != QNetworkReply.NetworkError.AuthenticationRequiredError or self._stage != OutputStage.writing:
+                on_error(reply, error)
+                return
+
+            def resend(connect_reply):
+                if data is not None and hasattr(data, 'seek'):
+                    data.seek(0)
+                self._send(command, query=query, next_stage=next_stage, data=data, on_error=on_error, method=method, reauthenticate=False, content_type=content_type)
+
+            self._session.reconnect(resend, on_error)
+        return handler
 
     # call on qt thread to get OpenGL to render the snapshot
     @call_on_qt_thread
     def requestWrite(self, node, fileName=None, *args, **kwargs):
-        if self._stage != OutputStage.ready:
-            raise OutputDeviceError.DeviceBusyError()
-
+        # a busy printer does not block new jobs, they are queued after the running one
         if fileName:
             fileName = os.path.splitext(fileName)[0] + '.gcode'
         else:
             fileName = "%s.gcode" % Application.getInstance().getPrintInformation().jobName
-        self._fileName = fileName
 
         extra_path = ""
         if "PyQt5" in sys.modules: # Cura 4
@@ -183,8 +258,8 @@ class DuetRRFOutputDevice(OutputDevice):
         self._dialog.textChanged.connect(self._onFilenameChanged)
         self._dialog.accepted.connect(self._onFilenameAccepted)
         self._dialog.show()
-        self._dialog.findChild(QObject, "nameField").setProperty('text', self._fileName)
-        self._dialog.findChild(QObject, "nameField").select(0, len(self._fileName) - len(".gcode"))
+        self._dialog.findChild(QObject, "nameField").setProperty('text', fileName)
+        self._dialog.findChild(QObject, "nameField").select(0, len(fileName) - len(".gcode"))
         self._dialog.findChild(QObject, "nameField").setProperty('focus', True)
 
     def _onFilenameChanged(self):
@@ -206,36 +281,305 @@ class DuetRRFOutputDevice(OutputDevice):
         self._dialog.setProperty('validationError', 'Filename too short')
 
     def _onFilenameAccepted(self):
-        self._fileName = self._dialog.findChild(QObject, "nameField").property('text').strip()
-        if not self._fileName.endswith('.gcode') and '.' not in self._fileName:
-            self._fileName += '.gcode'
-        Logger.log("d", "Filename set to: " + self._fileName)
+        fileName = self._dialog.findChild(QObject, "nameField").property('text').strip()
+        if not fileName.endswith('.gcode') and '.' not in fileName:
+            fileName += '.gcode'
+        Logger.log("d", "Filename set to: " + fileName)
 
         self._dialog.deleteLater()
 
-        self._stage = OutputStage.writing
+        metrics = JobMetrics(self._name, self._device_type.name, fileName)
+        # thumbnails are rendered by the plugin's writeStarted hook, drop timings from writes to other devices
+        take_thumbnail_timings()
         self.writeStarted.emit(self)
+        if self._writeHolds:
+            # e.g. thumbnails are still being encoded, Cura stays responsive in the meantime
+            self._heldWrites.append((fileName, metrics))
+            return
+        self._serializeWrite(fileName, metrics)
+
+    def holdWrite(self):
+        """Lets a writeStarted handler finish asynchronously, returns the function that releases the hold.
+
+        The gcode is only serialized once all holds are released.
+        """
+        self._writeHolds += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            self._writeHolds -= 1
+            if self._writeHolds == 0:
+                held, self._heldWrites = self._heldWrites, []
+                for fileName, metrics in held:
+                    self._serializeWrite(fileName, metrics)
+
+        return release
+
+    def _serializeWrite(self, fileName, metrics):
+        for stage, duration in take_thumbnail_timings().items():
+            metrics.record(stage, duration)
+
+        # the same slice was already serialized, e.g. for a simulation before printing it
+        stream = get_payload()
+        if stream is not None:
+            Logger.log("d", "Reusing {} bytes of already serialized gcode".format(stream.size()))
+            metrics.record("serialize", 0.0, bytes=stream.size(), payload_cached=True)
+            self._submitSerialized(fileName, stream, metrics, owns_stream=False)
+            self._prepareConnection()
+            return
 
         # show a progress message
-        self._message = Message(
+        message = Message(
             "Serializing gcode...",
             lifetime=0,
             dismissable=False,
+            progress=0,
+            title="DuetRRF: " + self._name,
+        )
+        message.addAction("cancel", catalog.i18nc("@action:button", "Cancel"), "", catalog.i18nc("@info:tooltip", "Stop serializing the gcode."))
+        message.actionTriggered.connect(self._onSerializeMessageActionTriggered)
+        self._showMessage(message)
+
+        # the gcode (including thumbnails) is serialized now, even if the job has to wait in the queue,
+        # but on a background thread to keep Cura responsive for big jobs
+        job = GCodeSerializeJob()
+        metrics.start("serialize")
+        self._serializeJobs[job] = (fileName, message, metrics, payload_generation())
+        job.progress.connect(self._onSerializeProgress)
+        job.finished.connect(self._onSerialized)
+        job.start()
+
+        self._prepareConnection()
+
+    def _prepareConnection(self):
+        """Connects and detects the API of the printer while the gcode is being serialized."""
+        if self._jobQueue.isBusy() or self._device_type == DuetRRFDeviceType.fleet:
+            # the running job already holds a session, fleet members connect on their own
+            return
+        if get_api_info(self._printer_id, self._url).get("api") == "dsf":
+            return
+        Logger.log("d", "Connecting to {} while serializing...".format(self._url))
+        self._use_rrf_http_api = True
+        self._session.connect(self._onPreparedConnection, self._onPrepareConnectionFailed)
+
+    def _onPreparedConnection(self, reply=None):
+        if not get_api_info(self._printer_id, self._url) and not self._jobQueue.isBusy():
+            self._probeRRFFirmware()
+
+    def _onPrepareConnectionFailed(self, reply, error):
+        if error != QNetworkReply.NetworkError.ContentNotFoundError or self._jobQueue.isBusy():
+            # the job itself reports the error once it tries to connect
+            return
+        Logger.log("d", "rr_connect not found, probing DuetSoftwareFramework API while serializing...")
+        self._use_rrf_http_api = False
+        self._send('machine/status',
+            next_stage=self._onPreparedDSFStatus,
+            on_error=lambda reply, error: Logger.log("d", "machine/status probe failed with error " + str(error)),
+        )
+
+    def _onPreparedDSFStatus(self, reply):
+        save_api_info(self._printer_id, self._url, "dsf", firmware_version=self._parseDSFFirmwareVersion(reply))
+
+    def _onSerializeMessageActionTriggered(self, message, action):
+        if action != "cancel":
+            return
+        for job, (_, job_message, metrics, _) in list(self._serializeJobs.items()):
+            if job_message is not message:
+                continue
+            Logger.log("d", "Cancelling gcode serialization")
+            job.cancel()
+            if job.isRunning() or job.isFinished():
+                # the job stops at its next chunk and reports back through _onSerialized
+                message.setText("Cancelling...")
+                continue
+            # a job which hadn't started was dropped from the job queue and never finishes
+            del self._serializeJobs[job]
+            message.hide()
+            metrics.fail("cancelled")
+            metrics.finish()
+            self.writeError.emit(self)
+
+    def _onSerializeProgress(self, job, progress):
+        if job in self._serializeJobs:
+            self._serializeJobs[job][1].setProgress(progress)
+
+    def _onSerialized(self, job):
+        fileName, serialize_message, metrics, generation = self._serializeJobs.pop(job, (None, None, None, None))
+        if serialize_message is None:
+            return
+        serialize_message.hide()
+
+        stream = job.getResult()
+        if job.isCancelled():
+            if stream is not None:
+                stream.close()
+            metrics.fail("cancelled")
+            metrics.finish()
+            self.writeError.emit(self)
+            return
+        if stream is None:
+            metrics.fail("failed to serialize gcode")
+            metrics.finish()
+            message = Message(
+                "Failed to serialize gcode for {}.".format(fileName),
+                lifetime=0,
+                title="DuetRRF: " + self._name,
+            )
+            self._showMessage(message)
+            self.writeError.emit(self)
+            return
+
+        metrics.end("serialize", bytes=stream.size())
+
+        # shared with the other devices until the scene is re-sliced, so none of them closes it
+        cached = put_payload(generation, stream)
+        self._submitSerialized(fileName, stream, metrics, owns_stream=not cached)
+
+    def _submitSerialized(self, fileName, stream, metrics, owns_stream):
+        message = Message(
+            "Uploading {} ...".format(fileName),
+            lifetime=0,
+            dismissable=False,
             progress=-1,
             title="DuetRRF: " + self._name,
         )
-        self._message.show()
+        self._showMessage(message)
+        self._submitJob(DuetRRFJob(self, fileName, stream, message=message, owns_stream=owns_stream, metrics=metrics))
+
+    def resendArchivedJob(self, fileName, stream):
+        """Sends a job from the local archive, without serializing the scene.
+
+        The device takes ownership of the stream and closes it when done.
+        """
+        Logger.log("d", "Re-sending archived job {} ({} bytes)".format(fileName, stream.size()))
+        metrics = JobMetrics(self._name, self._device_type.name, fileName)
+        metrics.record("serialize", 0.0, bytes=stream.size(), archived=True)
+        self._submitSerialized(fileName, stream, metrics, owns_stream=True)
+        self._prepareConnection()
+
+    def startUpload(self, fileName, stream):
+        """Uploads an already serialized gcode stream without asking for a filename.
+
+        The stream is shared with the caller and is not closed by this device.
+        Returns the job, to be handed to cancelUpload().
+        """
+        job = DuetRRFJob(self, fileName, stream, owns_stream=False)
+        self._submitJob(job)
+        return job
+
+    def cancelUpload(self, job):
+        """Cancels a job of startUpload() without a writeSuccess or writeError, deleting what was uploaded of it."""
+        if self._jobQueue.cancel(job):
+            return
+        if self._jobQueue.runningJob() is not job:
+            return
+        Logger.log("d", "Cancelling the upload of {} to {}".format(job.fileName, self._name))
+        self._abortRequests()
+        if self._metrics is not None:
+            self._metrics.fail("cancelled")
+        self._resetState()
+        self.deleteFile(job.fileName)
 
-        self._stream = serializing_scene_to_gcode()
+    def _submitJob(self, job):
+        ahead = self._jobQueue.submit(job)
+        if not ahead or not job.message:
+            return
 
-        # start upload workflow
-        self._message.setText("Uploading {} ...".format(self._fileName))
-        Logger.log("d", "Connecting...")
-        self._send('rr_connect',
-            query=[("password", self._duet_password), self._timestamp()],
-            next_stage=self._onUploadReady,
-            on_error=self._check_duet3_sbc,
+        # replaces the upload message, only a waiting job can be cancelled
+        job.message.hide()
+        job.message = Message(
+            "",
+            lifetime=0,
+            dismissable=False,
+            title="DuetRRF: " + self._name,
         )
+        job.message.addAction("cancel", catalog.i18nc("@action:button", "Cancel"), "", catalog.i18nc("@info:tooltip", "Remove the job from the queue."))
+        job.message.actionTriggered.connect(self._onQueuedMessageActionTriggered)
+        self._queuedMessages[job.message] = job
+        self._onJobWaiting(job)
+        self._showMessage(job.message)
+
+    def _onJobWaiting(self, job):
+        if job.message is None or job.message not in self._queuedMessages:
+            return
+        running = self._jobQueue.runningJob()
+        waited = int(time.monotonic() - job.queued_at)
+        job.message.setText("Queued {} - waiting for {} job(s) on {} to finish...\n\nRunning: {}\nWaiting for {}:{:02d}".format(
+            job.fileName,
+            self._jobQueue.position(job),
+            self._name,
+            running.fileName if running else "-",
+            waited // 60,
+            waited % 60,
+        ))
+
+    def _onQueuedMessageActionTriggered(self, message, action):
+        if action != "cancel":
+            return
+        job = self._queuedMessages.pop(message, None)
+        message.hide()
+        if job is None or not self._jobQueue.cancel(job):
+            return
+        if job.owns_stream:
+            job.stream.close()
+        if job.metrics is not None:
+            job.metrics.fail("cancelled")
+            job.metrics.finish()
+        self.writeError.emit(self)
+
+    def _onJobStalled(self, timeout):
+        if self._stage != OutputStage.writing:
+            return
+        self._abortRequests()
+        self._onNetworkError(None, "no response from the printer for {} s, the job was aborted".format(timeout))
+
+    def _runJob(self, job):
+        if self._queuedMessages.pop(job.message, None) is not None:
+            # the cancel action of the waiting job doesn't apply anymore
+            job.message.hide()
+            job.message = Message(
+                "Uploading {} ...".format(job.fileName),
+                lifetime=0,
+                dismissable=False,
+                progress=-1,
+                title="DuetRRF: " + self._name,
+            )
+            self._showMessage(job.message)
+        self._stage = OutputStage.writing
+        self._fileName = job.fileName
+        self._message = job.message
+        self._metrics = job.metrics or JobMetrics(self._name, self._device_type.name, job.fileName)
+        self._metrics.record("queue", job.started_at - job.queued_at)
+        self._firstByteAt = None
+        self._startUpload(job.stream, owns_stream=job.owns_stream)
+
+    def _startUpload(self, stream, owns_stream=True):
+        self._stream = stream
+        self._ownsStream = owns_stream
+        self._metrics.start("connect")
+
+        # start upload workflow
+        if self._message:
+            self._message.setText("Uploading {} ...".format(self._fileName))
+        self._api_info = get_api_info(self._printer_id, self._url)
+        if self._api_info.get("api") == "dsf":
+            Logger.log("d", "cached API info indicates Duet3+SBC - using the DuetSoftwareFramework API directly")
+            self._use_rrf_http_api = False
+            self._onUploadReady()
+        else:
+            self._use_rrf_http_api = True
+            self._session.acquire()
+            self._session_acquired = True
+            self._session.connect(self._guardReply(self._onConnected), self._guardReply(self._check_duet3_sbc))
+
+    def _onConnected(self, reply=None):
+        if not self._api_info:
+            self._probeRRFFirmware()
+        self._onUploadReady(reply)
 
     def _check_duet3_sbc(self, reply, error):
         Logger.log("d", "rr_connect failed with error " + str(error))
@@ -243,26 +587,124 @@ class DuetRRFOutputDevice(OutputDevice):
             Logger.log("d", "error indicates Duet3+SBC - let's try the DuetSoftwareFramework API instead...")
             self._use_rrf_http_api = False  # let's try the newer DuetSoftwareFramework for Duet3+SBC API instead
             self._send('machine/status',
-                next_stage=self._onUploadReady
+                next_stage=self._onDSFStatusProbed
             )
         else:
             self._onNetworkError(reply, error)
 
-    def _onUploadReady(self, reply):
+    def _probeRRFFirmware(self):
+        # runs alongside the upload, the result is only cached for the next jobs
+        self._send('rr_model',
+            query=[("key", "boards"), ("flags", "d99vn")],
+            next_stage=self._onRRFModelProbed,
+            on_error=self._onRRFModelProbeFailed,
+        )
+
+    def _onRRFModelProbed(self, reply):
+        firmware_version = None
+        try:
+            boards = json.loads(bytes(reply.readAll()).decode())["result"]
+            firmware_version = boards[0]["firmwareVersion"]
+        except Exception as e:
+            Logger.log("d", "failed to parse firmware version from rr_model: " + str(e))
+        save_api_info(self._printer_id, self._url, "rrf",
+            firmware_version=firmware_version,
+            board_type=self._session.board_type,
+            rr_model=True,
+        )
+
+    def _onRRFModelProbeFailed(self, reply, error):
+        if error != QNetworkReply.NetworkError.ContentNotFoundError:
+            Logger.log("d", "rr_model probe failed with error " + str(error))
+            return
+        # RRF 2 does not know rr_model yet
+        self._send('rr_status',
+            query=[("type", "2")],
+            next_stage=self._onRRFStatusProbed,
+            on_error=lambda reply, error: Logger.log("d", "rr_status probe failed with error " + str(error)),
+        )
+
+    def _onRRFStatusProbed(self, reply):
+        firmware_version = None
+        try:
+            firmware_version = json.loads(bytes(reply.readAll()).decode())["firmwareVersion"]
+        except Exception as e:
+            Logger.log("d", "failed to parse firmware version from rr_status: " + str(e))
+        save_api_info(self._printer_id, self._url, "rrf",
+            firmware_version=firmware_version,
+            board_type=self._session.board_type,
+            rr_model=False,
+        )
+
+    def _parseDSFFirmwareVersion(self, reply):
+        try:
+            status = json.loads(bytes(reply.readAll()).decode())
+            return status["boards"][0]["firmwareVersion"]
+        except Exception as e:
+            Logger.log("d", "failed to parse firmware version from machine/status: " + str(e))
+        return None
+
+    def _onDSFStatusProbed(self, reply):
         if self._stage != OutputStage.writing:
             return
-        if reply.error() != QNetworkReply.NetworkError.NoError:
+        self._api_info = save_api_info(self._printer_id, self._url, "dsf", firmware_version=self._parseDSFFirmwareVersion(reply))
+        self._onUploadReady(reply)
+
+    def _onDSFUploadError(self, reply, error):
+        if error == QNetworkReply.NetworkError.ContentNotFoundError:
+            # the cached API flavour might be outdated, e.g. the SBC was removed
+            delete_api_info(self._printer_id)
+        self._onNetworkError(reply, error)
+
+    def _onUploadReady(self, reply=None):
+        if self._stage != OutputStage.writing:
+            return
+        if reply is not None and reply.error() != QNetworkReply.NetworkError.NoError:
             Logger.log("d", "Stopping due to reply error: " + reply.error())
             return
 
-        Logger.log("d", "Uploading...")
+        self._metrics.end("connect")
+        self._uploadedSize = self._stream.size()
+        if take_speculative_upload(self._url, self._stream):
+            self._moveSpeculativeFile()
+            return
+        self._transferFile()
+
+    def _transferFile(self):
+        # the checksum was computed while serializing, rr_upload and the upload index both need it
+        self._uploadedCRC32 = self._stream.crc32()
+        self._recordChecksum()
+
+        known = get_uploaded_file(self._printer_id, self._url, self._fileName)
+        if known.get("size") == self._uploadedSize and known.get("crc32") == self._uploadedCRC32:
+            # we uploaded the same content under this name before, check that it is still there unchanged
+            Logger.log("d", "Identical {} was uploaded before, checking file on printer...".format(self._fileName))
+            self._requestFileInfo(
+                next_stage=self._onExistingFileInfo,
+                on_error=lambda reply, error: self._uploadFile(),
+            )
+            return
 
-        self._postData = QByteArray()
-        self._postData.append(self._stream.getvalue().encode())
+        self._uploadFile()
+
+    def _recordChecksum(self):
+        if "checksum" not in self._metrics.stages:
+            self._metrics.record("checksum", self._stream.checksum_seconds)
+
+    def _uploadFile(self):
+        if self._stage != OutputStage.writing:
+            return
+
+        Logger.log("d", "Uploading {} bytes...".format(self._uploadedSize))
+        self._metrics.start("upload")
+
+        # stream the gcode chunk by chunk, instead of encoding the whole job into memory
+        self._postData = GCodeUploadDevice(self._stream)
 
         if self._use_rrf_http_api:
             self._send('rr_upload',
-                query=[("name", "0:/gcodes/" + self._fileName), self._timestamp()],
+                # the board verifies the received file against the checksum and rejects it on mismatch
+                query=[("name", "0:/gcodes/" + self._fileName), self._timestamp(), ("crc32", "{:08x}".format(self._uploadedCRC32))],
                 next_stage=self._onUploadDone,
                 data=self._postData,
             )
@@ -270,9 +712,130 @@ class DuetRRFOutputDevice(OutputDevice):
             self._send('machine/file/gcodes/' + self._fileName,
                 next_stage=self._onUploadDone,
                 data=self._postData,
+                on_error=self._onDSFUploadError,
                 method='PUT',
             )
 
+    def _requestFileInfo(self, next_stage, on_error=None):
+        if self._use_rrf_http_api:
+            self._send('rr_fileinfo',
+                query=[("name", "0:/gcodes/" + self._fileName)],
+                next_stage=next_stage,
+                on_error=on_error,
+            )
+        else:
+            self._send('machine/fileinfo/gcodes/' + self._fileName,
+                next_stage=next_stage,
+                on_error=on_error,
+            )
+
+    def _parseFileInfo(self, reply):
+        try:
+            info = json.loads(bytes(reply.readAll()).decode())
+        except Exception as e:
+            Logger.log("d", "failed to parse file info: " + str(e))
+            return {}
+        if info.get("err", 0) != 0:
+            # rr_fileinfo reports a missing file with err=1
+            return {}
+        return info
+
+    def _onExistingFileInfo(self, reply):
+        if self._stage != OutputStage.writing:
+            return
+
+        info = self._parseFileInfo(reply)
+        known = get_uploaded_file(self._printer_id, self._url, self._fileName)
+        if info.get("size") != known.get("size") or info.get("lastModified") != known.get("last_modified"):
+            Logger.log("d", "{} on the printer differs from the last upload, uploading again".format(self._fileName))
+            self._uploadFile()
+            return
+
+        Logger.log("d", "{} is already on the printer, skipping upload of {} bytes".format(self._fileName, self._uploadedSize))
+        self._metrics.details["upload_skipped"] = True
+        self.writeProgress.emit(self, 100)
+        if self._message:
+            self._message.setProgress(100)
+        if self._ownsStream:
+            self._stream.close()
+        self._stream = None
+        self._onUploadVerified()
+
+    def _moveSpeculativeFile(self):
+        Logger.log("d", "{} was uploaded right after slicing, moving it into place...".format(self._fileName))
+        self._metrics.details["speculative"] = True
+        self._metrics.start("move")
+        source = "0:/gcodes/" + SPECULATIVE_FILE_NAME
+        target = "0:/gcodes/" + self._fileName
+        if self._use_rrf_http_api:
+            self._send('rr_move',
+                query=[("old", source), ("new", target), ("deleteexisting", "yes")],
+                next_stage=self._onSpeculativeFileMoved,
+                on_error=self._onSpeculativeMoveFailed,
+            )
+        else:
+            self._send('machine/file/move',
+                data=urllib.parse.urlencode({"from": source, "to": target, "force": "true"}).encode(),
+                content_type='application/x-www-form-urlencoded',
+                next_stage=self._onSpeculativeFileMoved,
+                on_error=self._onSpeculativeMoveFailed,
+            )
+
+    def _onSpeculativeFileMoved(self, reply):
+        if self._stage != OutputStage.writing:
+            return
+        if self._use_rrf_http_api:
+            err = None
+            try:
+                err = json.loads(bytes(reply.readAll()).decode())["err"]
+            except Exception as e:
+                Logger.log("d", "failed to parse rr_move reply: " + str(e))
+            if err != 0:
+                self._onSpeculativeMoveFailed(reply, "rr_move failed (err={})".format(err))
+                return
+
+        self._metrics.end("move")
+        Logger.log("d", "Moved speculative upload to {}, skipping upload of {} bytes".format(self._fileName, self._uploadedSize))
+        # moving keeps size and modification time, so the file is known under its new name
+        known = get_uploaded_file(self._printer_id, self._url, SPECULATIVE_FILE_NAME)
+        if known.get("size") == self._uploadedSize:
+            save_uploaded_file(self._printer_id, self._url, self._fileName, known["size"], known["crc32"], known["last_modified"])
+
+        self.writeProgress.emit(self, 100)
+        if self._message:
+            self._message.setProgress(100)
+        archive_stream(self._stream, self._fileName, self._name)
+        if self._ownsStream:
+            self._stream.close()
+        self._stream = None
+        self._onUploadVerified()
+
+    def _onSpeculativeMoveFailed(self, reply, error):
+        if self._stage != OutputStage.writing:
+            return
+        Logger.log("d", "Moving the speculative upload failed ({}), uploading {} instead".format(error, self._fileName))
+        self._metrics.end("move")
+        self._transferFile()
+
+    def deleteFile(self, fileName):
+        """Deletes a file from 0:/gcodes/ outside of a job, e.g. an outdated speculative upload."""
+        use_rrf_http_api = get_api_info(self._printer_id, self._url).get("api") != "dsf"
+        on_error = lambda reply, error: Logger.log("d", "Deleting {} failed with error {}".format(fileName, error))
+        on_deleted = lambda reply: Logger.log("d", "Deleted {} on {}".format(fileName, self._name))
+        if self._stage == OutputStage.writing:
+            # the job holds the connection and decides which API to use
+            use_rrf_http_api = self._use_rrf_http_api
+        else:
+            self._use_rrf_http_api = use_rrf_http_api
+
+        if use_rrf_http_api:
+            self._session.connect(
+                lambda reply: self._send('rr_delete', query=[("name", "0:/gcodes/" + fileName)], next_stage=on_deleted, on_error=on_error),
+                on_error,
+            )
+        else:
+            self._send('machine/file/gcodes/' + fileName, method='DELETE', next_stage=on_deleted, on_error=on_error)
+
     def _onUploadDone(self, reply):
         if self._stage != OutputStage.writing:
             return
@@ -280,13 +843,93 @@ class DuetRRFOutputDevice(OutputDevice):
             Logger.log("d", "Stopping due to reply error: " + reply.error())
             return
 
-        Logger.log("d", "Upload done")
+        if self._use_rrf_http_api:
+            err = None
+            try:
+                err = json.loads(bytes(reply.readAll()).decode())["err"]
+            except Exception as e:
+                Logger.log("d", "failed to parse rr_upload reply: " + str(e))
+            if err:
+                # err=1 is also reported if the CRC32 of the received file does not match
+                self._onNetworkError(reply, "rr_upload failed (err={}), the file might have been corrupted in transit".format(err))
+                return
 
-        self._stream.close()
+        duration = self._metrics.end("upload")
+        self._metrics.details.update({
+            "bytes": self._uploadedSize,
+            "bytes_per_second": round(self._uploadedSize / duration) if duration > 0 else None,
+        })
+        Logger.log("d", "Upload done in {:.2f} s".format(duration))
+
+        self._postData.close()
+        self._postData = None
+        if not is_speculative_file(self._fileName):
+            archive_stream(self._stream, self._fileName, self._name)
+        if self._ownsStream:
+            self._stream.close()
         self._stream = None
 
+        if self._use_rrf_http_api:
+            # rr_upload already checked the CRC32, the file info is only needed for the upload index
+            self._rememberUploadedFile()
+            self._onUploadVerified()
+            return
+
+        # DSF does not check a checksum on upload, so the stored file size is compared,
+        # the file info is also remembered to skip uploading the same content again
+        self._metrics.start("verify")
+        self._requestFileInfo(
+            next_stage=self._onUploadedFileInfo,
+            on_error=self._onUploadedFileInfoError,
+        )
+
+    def _rememberUploadedFile(self):
+        # best effort in the background, without it the next upload of this file is simply not skipped
+        printer_id, url, file_name = self._printer_id, self._url, self._fileName
+        size, crc32 = self._uploadedSize, self._uploadedCRC32
+
+        def on_file_info(reply):
+            info = self._parseFileInfo(reply)
+            if info.get("size") == size and info.get("lastModified") and crc32 is not None:
+                save_uploaded_file(printer_id, url, file_name, size, crc32, info["lastModified"])
+
+        def on_error(reply, error):
+            Logger.log("d", "failed to get file info of uploaded {}: {}".format(file_name, error))
+
+        self._send('rr_fileinfo',
+            query=[("name", "0:/gcodes/" + file_name)],
+            next_stage=on_file_info,
+            on_error=on_error,
+            reauthenticate=False,
+        )
+
+    def _onUploadedFileInfo(self, reply):
+        if self._stage != OutputStage.writing:
+            return
+
+        self._metrics.end("verify")
+        info = self._parseFileInfo(reply)
+        size = info.get("size")
+        if size is not None and size != self._uploadedSize:
+            self._onNetworkError(reply, "uploaded file has {} bytes instead of {}, the file might have been corrupted in transit".format(size, self._uploadedSize))
+            return
+        if size is not None and info.get("lastModified") and self._uploadedCRC32 is not None:
+            save_uploaded_file(self._printer_id, self._url, self._fileName, self._uploadedSize, self._uploadedCRC32, info["lastModified"])
+        self._onUploadVerified()
+
+    def _onUploadedFileInfoError(self, reply, error):
+        if self._stage != OutputStage.writing:
+            return
+
+        # the upload itself succeeded, an unverified file is still printed
+        Logger.log("d", "failed to verify uploaded {}: {}".format(self._fileName, error))
+        self._metrics.end("verify")
+        self._onUploadVerified()
+
+    def _onUploadVerified(self):
         if self._device_type == DuetRRFDeviceType.simulate:
             Logger.log("d", "Simulating...")
+            self._metrics.start("simulation")
             if self._message:
                 self._message.hide()
                 self._message = None
@@ -298,7 +941,7 @@ class DuetRRFOutputDevice(OutputDevice):
                 progress=-1,
                 title="DuetRRF: " + self._name,
             )
-            self._message.show()
+            self._showMessage(self._message)
 
             gcode='M37 P"0:/gcodes/' + self._fileName + '"'
             Logger.log("d", "Sending gcode: " + gcode)
@@ -315,8 +958,6 @@ class DuetRRFOutputDevice(OutputDevice):
         elif self._device_type == DuetRRFDeviceType.print:
             self._onReadyToPrint()
         elif self._device_type == DuetRRFDeviceType.upload:
-            if self._use_rrf_http_api:
-                self._send('rr_disconnect')
             if self._message:
                 self._message.hide()
                 self._message = None
@@ -328,7 +969,7 @@ class DuetRRFOutputDevice(OutputDevice):
             )
             self._message.addAction("open_browser", catalog.i18nc("@action:button", "Open Browser"), "globe", catalog.i18nc("@info:tooltip", "Open browser to DuetWebControl."))
             self._message.actionTriggered.connect(self._onMessageActionTriggered)
-            self._message.show()
+            self._showMessage(self._message)
 
             self.writeSuccess.emit(self)
             self._resetState()
@@ -338,6 +979,7 @@ class DuetRRFOutputDevice(OutputDevice):
             return
 
         Logger.log("d", "Ready to print")
+        self._metrics.start("print_start")
 
         gcode = 'M32 "0:/gcodes/' + self._fileName + '"'
         Logger.log("d", "Sending gcode: " + gcode)
@@ -360,9 +1002,8 @@ class DuetRRFOutputDevice(OutputDevice):
             return
 
         Logger.log("d", "Print started")
+        self._metrics.end("print_start")
 
-        if self._use_rrf_http_api:
-            self._send('rr_disconnect')
         if self._message:
             self._message.hide()
             self._message = None
@@ -374,7 +1015,7 @@ class DuetRRFOutputDevice(OutputDevice):
         )
         self._message.addAction("open_browser", catalog.i18nc("@action:button", "Open Browser"), "globe", catalog.i18nc("@info:tooltip", "Open browser to DuetWebControl."))
         self._message.actionTriggered.connect(self._onMessageActionTriggered)
-        self._message.show()
+        self._showMessage(self._message)
 
         self.writeSuccess.emit(self)
         self._resetState()
@@ -388,16 +1029,83 @@ class DuetRRFOutputDevice(OutputDevice):
 
         Logger.log("d", "Simulation print started for file " + self._fileName)
 
+        self._pollInterval = AdaptivePollInterval()
+        self._simulationStarted = time.monotonic()
+        self._seenSimulating = False
+        if not self._use_rrf_http_api and websocket_available():
+            # DSF pushes object model changes, no need to poll
+            self._subscription = DSFObjectModelSubscription(
+                self._url,
+                self._http_user,
+                self._http_password,
+                on_update=self._onModelUpdate,
+                on_unavailable=self._onSubscriptionUnavailable,
+            )
+            self._subscription.start()
+
         # give it some to start the simulation
-        QTimer.singleShot(2000, self._onCheckStatus)
+        poll_scheduler().schedule(self, self._onCheckStatus, AdaptivePollInterval.INITIAL_INTERVAL)
+
+    def _onModelUpdate(self, model):
+        if self._stage != OutputStage.writing or self._subscription is None:
+            return
+
+        status = model.get("state", {}).get("status", None)
+        if status == 'simulating':
+            self._seenSimulating = True
+        elif not self._seenSimulating and time.monotonic() - self._simulationStarted < AdaptivePollInterval.INITIAL_INTERVAL / 1000:
+            # the simulation might not have started yet
+            return
+
+        busy = status == 'simulating'
+        progress = 0.0
+        try:
+            job = model.get("job", {})
+            progress = int(job["filePosition"]) / int(job["file"]["size"]) * 100.0
+        except:
+            pass
+
+        if not busy:
+            poll_scheduler().cancel(self)
+            self._closeSubscription()
+        self._onSimulationStatus(busy, progress)
+
+    def _onSubscriptionUnavailable(self):
+        if self._subscription is None:
+            return
+        Logger.log("d", "DSF object model subscription unavailable - falling back to polling")
+        self._subscription = None
+        if self._stage == OutputStage.writing:
+            poll_scheduler().schedule(self, self._onCheckStatus, self._pollInterval.INITIAL_INTERVAL)
+
+    def _closeSubscription(self):
+        if self._subscription is not None:
+            Logger.log("d", f"DSF object model subscription received {self._subscription.messages} updates")
+            self._subscription.close()
+            self._subscription = None
 
     def _onCheckStatus(self):
         if self._stage != OutputStage.writing:
             return
+        if self._subscription is not None:
+            if self._subscription.model is not None:
+                # nothing changed since the start, evaluate the pushed model once
+                self._onModelUpdate(self._subscription.model)
+            else:
+                # still waiting for the WebSocket to deliver the initial model
+                poll_scheduler().schedule(self, self._onCheckStatus, AdaptivePollInterval.INITIAL_INTERVAL)
+            return
 
         Logger.log("d", "Checking status...")
 
-        if self._use_rrf_http_api:
+        if self._use_rrf_http_api and self._api_info.get("rr_model", True):
+            # RRF 3: only fetch the live values of the state subtree instead of the whole status document
+            self._send('rr_model',
+                query=[("key", "state"), ("flags", "d99fn")],
+                next_stage=self._onModelStateReceived,
+                on_error=self._onModelError,
+            )
+        elif self._use_rrf_http_api:
             self._send('rr_status',
                 query=[("type", "3")],
                 next_stage=self._onStatusReceived,
@@ -407,6 +1115,52 @@ class DuetRRFOutputDevice(OutputDevice):
                 next_stage=self._onStatusReceived,
             )
 
+    def _onModelError(self, reply, error):
+        if error == QNetworkReply.NetworkError.ContentNotFoundError:
+            Logger.log("d", "rr_model not available - falling back to rr_status")
+            self._api_info["rr_model"] = False
+            self._onCheckStatus()
+        else:
+            self._onNetworkError(reply, error)
+
+    def _onModelStateReceived(self, reply):
+        if self._stage != OutputStage.writing:
+            return
+        if reply.error() != QNetworkReply.NetworkError.NoError:
+            Logger.log("d", "Stopping due to reply error: " + reply.error())
+            return
+
+        reply_body = bytes(reply.readAll()).decode()
+        Logger.log("d", f"State received ({len(reply_body)} bytes) - decoding...")
+        state = json.loads(reply_body).get("result", {})
+        if state.get("status", None) != 'simulating':
+            self._onSimulationStatus(False, 100.0)
+            return
+
+        # the job subtree is only needed for the progress while still simulating
+        self._send('rr_model',
+            query=[("key", "job"), ("flags", "d99fn")],
+            next_stage=self._onModelJobReceived,
+        )
+
+    def _onModelJobReceived(self, reply):
+        if self._stage != OutputStage.writing:
+            return
+        if reply.error() != QNetworkReply.NetworkError.NoError:
+            Logger.log("d", "Stopping due to reply error: " + reply.error())
+            return
+
+        reply_body = bytes(reply.readAll()).decode()
+        Logger.log("d", f"Job received ({len(reply_body)} bytes) - decoding...")
+        progress = 0.0
+        try:
+            # the file size is a non-live value, but we know it from the upload
+            file_position = json.loads(reply_body)["result"]["filePosition"]
+            progress = int(file_position) / self._uploadedSize * 100.0
+        except:
+            pass
+        self._onSimulationStatus(True, progress)
+
     def _onStatusReceived(self, reply):
         if self._stage != OutputStage.writing:
             return
@@ -442,11 +1196,19 @@ class DuetRRFOutputDevice(OutputDevice):
         except:
             pass
 
+        self._onSimulationStatus(busy, progress)
+
+    def _onSimulationStatus(self, busy, progress):
         if busy:
             # still simulating
             if self._message:
                 self._message.setProgress(progress)
-            QTimer.singleShot(2000, self._onCheckStatus)
+            if self._subscription is not None:
+                # the next update is pushed by DSF
+                return
+            interval = self._pollInterval.next_interval(progress)
+            Logger.log("d", f"Simulation at {progress:.1f}%, checking again in {interval} ms")
+            poll_scheduler().schedule(self, self._onCheckStatus, interval)
         else:
             Logger.log("d", "Simulation print finished")
 
@@ -486,6 +1248,7 @@ class DuetRRFOutputDevice(OutputDevice):
             return
 
         Logger.log("d", "Simulation status received - decoding...")
+        self._metrics.end("simulation")
         reply_body = bytes(reply.readAll()).decode().strip()
         Logger.log("d", "Reported | " + reply_body)
 
@@ -500,20 +1263,39 @@ class DuetRRFOutputDevice(OutputDevice):
         )
         self._message.addAction("open_browser", catalog.i18nc("@action:button", "Open Browser"), "globe", catalog.i18nc("@info:tooltip", "Open browser to DuetWebControl."))
         self._message.actionTriggered.connect(self._onMessageActionTriggered)
-        self._message.show()
+        self._showMessage(self._message)
 
-        if self._use_rrf_http_api:
-            self._send('rr_disconnect')
         self.writeSuccess.emit(self)
         self._resetState()
 
     def _resetState(self):
         Logger.log("d", "called")
-        if self._stream:
+        poll_scheduler().cancel(self)
+        self._closeSubscription()
+        if self._session_acquired:
+            # keep the session alive for the next job instead of rr_disconnect
+            self._session.release()
+            self._session_acquired = False
+        if self._postData is not None:
+            self._postData.close()
+        self._postData = None
+        if self._stream and self._ownsStream:
             self._stream.close()
         self._stream = None
         self._stage = OutputStage.ready
         self._fileName = None
+        self._uploadedSize = 0
+        self._uploadedCRC32 = None
+        self._firstByteAt = None
+        self._requests = []
+        if self._metrics is not None:
+            self._metrics.finish()
+            self._metrics = None
+        self._jobQueue.jobFinished(self)
+
+    def _showMessage(self, message):
+        if not self._headless:
+            message.show()
 
     def _onMessageActionTriggered(self, message, action):
         if action == "open_browser":
@@ -523,6 +1305,11 @@ class DuetRRFOutputDevice(OutputDevice):
                 self._message = None
 
     def _onUploadProgress(self, bytesSent, bytesTotal):
+        self._jobQueue.jobAlive(self)
+        if bytesSent > 0 and self._firstByteAt is None and self._stage == OutputStage.writing:
+            self._firstByteAt = time.monotonic()
+            self._metrics.details["time_to_first_byte"] = round(self._firstByteAt - self._metrics.created_at, 3)
+            Logger.log("d", "First bytes of {} sent {:.2f} s after the job was confirmed".format(self._fileName, self._metrics.details["time_to_first_byte"]))
         if bytesTotal > 0:
             progress = int(bytesSent * 100 / bytesTotal)
             if self._message:
@@ -532,6 +1319,8 @@ class DuetRRFOutputDevice(OutputDevice):
     def _onNetworkError(self, reply, error):
         # https://doc.qt.io/qt-6/qnetworkreply.html#NetworkError-enum
         Logger.log("e", repr(error))
+        if self._metrics is not None:
+            self._metrics.fail(error)
         if self._message:
             self._message.hide()
             self._message = None
@@ -545,7 +1334,137 @@ class DuetRRFOutputDevice(OutputDevice):
             lifetime=0,
             title="DuetRRF: " + self._name,
         )
-        message.show()
+        self._showMessage(message)
 
         self.writeError.emit(self)
         self._resetState()
+
+
+class DuetRRFFleetOutputDevice(DuetRRFOutputDevice):
+    """Serializes a job once and uploads it to a group of identical printers.
+
+    Every member printer gets its own headless upload device, reading from the
+    same serialized gcode stream. At most `concurrency` uploads, capped at
+    FLEET_MAX_CONCURRENCY, run at the same time, a slow or failing printer only
+    occupies its own slot.
+    """
+
+    def __init__(self, config, members, concurrency):
+        super().__init__(config, DuetRRFDeviceType.fleet)
+        # fleet jobs span several printers, they don't wait for the active printer's queue,
+        # the member uploads are watched by the queues of their printers
+        self._jobQueue = get_job_queue(self._name_id, stall_timeout=None)
+        self._members = members
+        # the uploads share Cura's HttpRequestManager with everything else
+        self._concurrency = max(1, min(concurrency, FLEET_MAX_CONCURRENCY))
+
+        description = catalog.i18nc("@action:button", "Upload to {0} {1} printers").format(len(members), self._name)
+        self.setShortDescription(description)
+        self.setDescription(description)
+
+        self._fleetQueue = []
+        self._fleetActive = {}
+        self._fleetProgress = {}
+        self._fleetResults = {}
+        self._fleetStarted = 0
+
+    def _startUpload(self, stream, owns_stream=True):
+        self._stream = stream
+        self._ownsStream = owns_stream
+        self._fleetStarted = time.monotonic()
+        self._fleetQueue = list(self._members)
+        self._fleetActive = {}
+        self._fleetProgress = {printer_id: 0 for printer_id, _, _ in self._members}
+        self._fleetResults = {}
+        self._metrics.start("upload")
+
+        Logger.log("d", f"Uploading {self._fileName} ({stream.size()} bytes) to {len(self._members)} printers, {self._concurrency} at a time")
+        self._startFleetUploads()
+        self._updateFleetMessage()
+
+    def _startFleetUploads(self):
+        while self._fleetQueue and len(self._fleetActive) < self._concurrency:
+            printer_id, printer_name, config = self._fleetQueue.pop(0)
+            device = DuetRRFOutputDevice(config, DuetRRFDeviceType.upload, printer_id=printer_id, printer_name=printer_name, headless=True)
+            # UM signals only keep weak references to plain functions, so connect bound methods
+            device.writeProgress.connect(self._onMemberProgress)
+            device.writeSuccess.connect(self._onMemberSucceeded)
+            device.writeError.connect(self._onMemberFailed)
+            self._fleetActive[printer_id] = device
+            device.startUpload(self._fileName, self._stream)
+
+        if not self._fleetActive and not self._fleetQueue and self._stage == OutputStage.writing:
+            self._onFleetDone()
+
+    def _onMemberProgress(self, device, progress):
+        self._fleetProgress[device._printer_id] = progress
+        self._updateFleetMessage()
+
+    def _onMemberSucceeded(self, device):
+        self._onMemberFinished(device._printer_id, True)
+
+    def _onMemberFailed(self, device):
+        self._onMemberFinished(device._printer_id, False)
+
+    def _onMemberFinished(self, printer_id, success):
+        Logger.log("d", f"Fleet upload to {printer_id} {'succeeded' if success else 'failed'}")
+        self._fleetResults[printer_id] = success
+        self._fleetProgress[printer_id] = 100
+        self._fleetActive.pop(printer_id, None)
+        self._updateFleetMessage()
+        self._startFleetUploads()
+
+    def _fleetThroughput(self):
+        elapsed = time.monotonic() - self._fleetStarted
+        sent = sum(self._fleetProgress.values()) / 100 * self._stream.size()
+        return sent / elapsed if elapsed > 0 else 0
+
+    def _updateFleetMessage(self):
+        if not self._message or self._stream is None:
+            return
+
+        lines = []
+        for printer_id, printer_name, _ in self._members:
+            if printer_id in self._fleetResults:
+                state = "done" if self._fleetResults[printer_id] else "FAILED"
+            elif printer_id in self._fleetActive:
+                state = "{}%".format(int(self._fleetProgress[printer_id]))
+            else:
+                state = "queued"
+            lines.append("{}: {}".format(printer_name, state))
+        lines.append("")
+        lines.append("Throughput: {:.2f} MB/s".format(self._fleetThroughput() / 1e6))
+
+        self._message.setText("Uploading {} ...\n{}".format(self._fileName, "\n".join(lines)))
+        self._message.setProgress(sum(self._fleetProgress.values()) / len(self._members))
+        self.writeProgress.emit(self, int(sum(self._fleetProgress.values()) / len(self._members)))
+
+    def _onFleetDone(self):
+        succeeded = [name for printer_id, name, _ in self._members if self._fleetResults.get(printer_id)]
+        failed = [name for printer_id, name, _ in self._members if not self._fleetResults.get(printer_id)]
+        throughput = self._fleetThroughput()
+        Logger.log("d", f"Fleet upload done | succeeded: {succeeded}, failed: {failed}, throughput: {throughput:.0f} B/s")
+        # every member logs its own metrics, these are the totals of the fleet
+        self._metrics.end("upload", bytes=self._stream.size(), bytes_per_second=round(throughput), printers=len(self._members))
+        if failed:
+            self._metrics.fail("failed: {}".format(", ".join(failed)))
+
+        if self._message:
+            self._message.hide()
+            self._message = None
+
+        text = "Uploaded file {} to {} of {} printers ({:.2f} MB/s).".format(self._fileName, len(succeeded), len(self._members), throughput / 1e6)
+        if failed:
+            text += "\n\nFailed: {}".format(", ".join(failed))
+        self._message = Message(
+            text,
+            lifetime=0 if failed else 15,
+            title="DuetRRF: " + self._name,
+        )
+        self._showMessage(self._message)
+
+        if failed:
+            self.writeError.emit(self)
+        else:
+            self.writeSuccess.emit(self)
+        self._resetState()
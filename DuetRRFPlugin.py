@@ -1,4 +1,4 @@
-from io import StringIO
+import datetime
 import json
 
 try: # Cura 5
@@ -10,6 +10,7 @@ from cura.CuraApplication import CuraApplication
 from cura.Settings.CuraContainerRegistry import CuraContainerRegistry
 
 from UM.Application import Application
+from UM.Backend.Backend import BackendState
 from UM.Message import Message
 from UM.Logger import Logger
 from UM.Extension import Extension
@@ -18,9 +19,14 @@ from UM.i18n import i18nCatalog
 
 catalog = i18nCatalog("cura")
 
-from .DuetRRFOutputDevice import DuetRRFConfigureOutputDevice, DuetRRFOutputDevice, DuetRRFDeviceType
-from .DuetRRFSettings import get_plugin_version, delete_config, get_config, init_settings, DUETRRF_SETTINGS
-from .thumbnails import generate_thumbnail
+from .DuetRRFOutputDevice import DuetRRFConfigureOutputDevice, DuetRRFOutputDevice, DuetRRFFleetOutputDevice, DuetRRFDeviceType
+from .DuetRRFSession import close_sessions
+from .archive import archived_jobs, open_archived_job
+from .metrics import printer_totals, recent_jobs
+from .payload_cache import invalidate_payloads
+from .speculative import discard_speculative_uploads, start_speculative_upload
+from .DuetRRFSettings import get_plugin_version, delete_config, embed_thumbnails_enabled, get_all_configs, get_config, get_preference, init_settings, DUETRRF_FLEET_CONCURRENCY, DUETRRF_SETTINGS, DUETRRF_SPECULATIVE_UPLOAD
+from .thumbnails import discard_precomputed_thumbnails, generate_thumbnail, generate_thumbnail_async, precompute_thumbnails, precomputed_thumbnails
 
 class DuetRRFPlugin(Extension, OutputDevicePlugin):
     def __init__(self):
@@ -28,11 +34,14 @@ class DuetRRFPlugin(Extension, OutputDevicePlugin):
         self._application = CuraApplication.getInstance()
         self._application.globalContainerStackChanged.connect(self._checkDuetRRFOutputDevices)
         self._application.initializationFinished.connect(self._delay_check_unmapped_settings)
+        self._application.initializationFinished.connect(self._connect_backend)
         self._application.getOutputDeviceManager().writeStarted.connect(self._embed_thumbnails)
 
         init_settings()
 
         self.addMenuItem(catalog.i18n("(moved to Preferences→Printer)"), self._showUnmappedSettingsMessage)
+        self.addMenuItem(catalog.i18n("Re-send recent job..."), self._showArchivedJobsMessage)
+        self.addMenuItem(catalog.i18n("Job timings..."), self._showJobMetricsMessage)
 
         self._found_unmapped = {}
 
@@ -40,10 +49,10 @@ class DuetRRFPlugin(Extension, OutputDevicePlugin):
         pass
 
     def stop(self, store_data: bool = True):
-        pass
+        close_sessions()
 
     def _embed_thumbnails(self, output_device) -> None:
-        if not get_config().get("embed_thumbnails", False):
+        if not embed_thumbnails_enabled(get_config()):
             Logger.log("d", f"Skipping disabled thumbnail embedding or not a Duet-RRF printer.")
             return
 
@@ -57,20 +66,81 @@ class DuetRRFPlugin(Extension, OutputDevicePlugin):
         if not gcode_list:
             return
 
-        if ";Exported with Cura-DuetRRF" not in gcode_list[0]:
-            # assemble everything and inject custom data
-            Logger.log("i", "Assembling final gcode file...")
+        if ";Exported with Cura-DuetRRF" in gcode_list[0]:
+            Logger.log("e", "Already embedded thumbnails")
+            return
+
+        thumbnail_block = precomputed_thumbnails(gcode_list)
+        if thumbnail_block is None and isinstance(output_device, DuetRRFOutputDevice):
+            # e.g. the thumbnail sizes changed since slicing, the device waits with serializing
+            # until they are encoded, without blocking Cura
+            release = output_device.holdWrite()
+
+            def on_thumbnails(thumbnail_stream):
+                try:
+                    self._assemble_gcode(gcode_list, thumbnail_stream.getvalue() if thumbnail_stream else "")
+                finally:
+                    release()
 
-            version = get_plugin_version()
+            if not generate_thumbnail_async(on_thumbnails):
+                on_thumbnails(None)
+            return
+
+        if thumbnail_block is None:
+            # other devices serialize right after writeStarted
             thumbnail_stream = generate_thumbnail()
-            gcode_list[0] += f";Exported with Cura-DuetRRF v{version} plugin by Thomas Kriechbaumer\n"
-            gcode_list[0] += thumbnail_stream.getvalue()
+            thumbnail_block = thumbnail_stream.getvalue() if thumbnail_stream else ""
+        self._assemble_gcode(gcode_list, thumbnail_block)
+
+    def _assemble_gcode(self, gcode_list, thumbnail_block):
+        if ";Exported with Cura-DuetRRF" in gcode_list[0]:
+            # another write embedded them while these thumbnails were encoded
+            return
+
+        # assemble everything and inject custom data
+        Logger.log("i", "Assembling final gcode file...")
+        version = get_plugin_version()
+        gcode_list[0] += f";Exported with Cura-DuetRRF v{version} plugin by Thomas Kriechbaumer\n"
+        gcode_list[0] += thumbnail_block
+
+    def _connect_backend(self):
+        # rendering thumbnails or serializing inside the backend's signal would hold up Cura's own handlers
+        self._slice_done_timer = QTimer()
+        self._slice_done_timer.setInterval(0)
+        self._slice_done_timer.setSingleShot(True)
+        self._slice_done_timer.timeout.connect(self._on_slice_done)
+
+        backend = self._application.getBackend()
+        if backend:
+            backend.backendStateChange.connect(self._on_backend_state_changed)
+
+    def _on_backend_state_changed(self, state):
+        # anything but a finished slice means the scene changed or is being re-sliced
+        if state != BackendState.Done:
+            self._slice_done_timer.stop()
+            invalidate_payloads()
+            discard_speculative_uploads()
+            discard_precomputed_thumbnails()
+            return
 
-            # store new gcode back into scene and active build plate
-            gcode_dict[active_build_plate_id] = gcode_list
-            setattr(scene, "gcode_dict", gcode_dict)
+        self._slice_done_timer.start()
+
+    def _on_slice_done(self):
+        # the timer is stopped as soon as the backend leaves the Done state, so this is still the same slice
+        if embed_thumbnails_enabled(get_config()):
+            active_build_plate_id = self._application.getMultiBuildPlateModel().activeBuildPlate
+            gcode_dict = getattr(self._application.getController().getScene(), "gcode_dict", None) or {}
+            # not called back if the scene is re-sliced while the thumbnails are encoded
+            precompute_thumbnails(gcode_dict.get(active_build_plate_id), self._on_thumbnails_precomputed)
         else:
-            Logger.log("e", "Already embedded thumbnails")
+            self._on_thumbnails_precomputed()
+
+    def _on_thumbnails_precomputed(self):
+        config = get_config()
+        if config and get_preference(DUETRRF_SPECULATIVE_UPLOAD):
+            # the uploaded file has to match what "Print on ..." would send, including thumbnails
+            self._embed_thumbnails(None)
+            start_speculative_upload(config)
 
     def _delay_check_unmapped_settings(self):
         self._change_timer = QTimer()
@@ -171,6 +241,101 @@ class DuetRRFPlugin(Extension, OutputDevicePlugin):
         message.show()
         self._found_unmapped = {}
 
+    def _showArchivedJobsMessage(self):
+        jobs = archived_jobs()
+        if not jobs:
+            Message(
+                "No recently uploaded jobs in the archive.\n\nThe archive is off unless the duetrrf/archive_size preference (in MB) is set in cura.cfg.",
+                lifetime=10,
+                title="DuetRRF: Re-send recent job",
+            ).show()
+            return
+
+        msg = "Print one of the recently uploaded jobs on the active printer, without slicing it again:\n"
+        for i, (digest, entry) in enumerate(jobs, start=1):
+            msg += "\n{}. {} ({:.1f} MB, sent to {} on {})".format(
+                i,
+                entry["name"],
+                entry["size"] / 1e6,
+                entry["printer"],
+                datetime.datetime.fromtimestamp(entry["archived_at"]).strftime("%Y-%m-%d %H:%M"),
+            )
+
+        message = Message(
+            msg,
+            lifetime=0,
+            title="DuetRRF: Re-send recent job",
+        )
+        for i, (digest, entry) in enumerate(jobs, start=1):
+            message.addAction(
+                action_id=digest,
+                name=catalog.i18nc("@action:button", "Print #{}").format(i),
+                icon="",
+                description=entry["name"],
+            )
+        message.actionTriggered.connect(self._onActionTriggeredArchivedJob)
+        message.show()
+
+    def _showJobMetricsMessage(self):
+        totals = printer_totals()
+        if not totals:
+            Message(
+                "No jobs were sent since Cura was started.",
+                lifetime=10,
+                title="DuetRRF: Job timings",
+            ).show()
+            return
+
+        msg = "Average time per job in each stage since Cura was started:\n"
+        for printer, printer_total in sorted(totals.items()):
+            jobs = printer_total.pop("jobs")
+            failed = printer_total.pop("failed")
+            uploaded = printer_total.pop("bytes")
+            msg += "\n{}: {} jobs ({} failed), {:.1f} MB uploaded".format(printer, jobs, failed, uploaded / 1e6)
+            if printer_total.get("upload"):
+                msg += ", {:.1f} MB/s".format(uploaded / printer_total["upload"] / 1e6)
+            msg += "\n" + ", ".join("{} {:.2f} s".format(stage, duration / jobs) for stage, duration in sorted(printer_total.items()))
+
+        msg += "\n\nLast jobs:"
+        for job in reversed(recent_jobs()[-5:]):
+            msg += "\n{} on {} ({}): {:.2f} s{}".format(
+                job["file"],
+                job["printer"],
+                job["device"],
+                job["total"],
+                "" if job["success"] else ", failed: " + job["error"],
+            )
+
+        Message(
+            msg,
+            lifetime=0,
+            title="DuetRRF: Job timings",
+        ).show()
+
+    def _onActionTriggeredArchivedJob(self, message, action):
+        Logger.log("d", "called: {}".format(action))
+        message.hide()
+
+        device = self.getOutputDeviceManager().getOutputDevice("duetrrf-print")
+        if not device:
+            Message(
+                "The active printer is not configured for DuetRRF.",
+                lifetime=10,
+                title="DuetRRF: Re-send recent job",
+            ).show()
+            return
+
+        entry = dict(archived_jobs(limit=None)).get(action)
+        stream = open_archived_job(action) if entry else None
+        if stream is None:
+            Message(
+                "The job is no longer in the archive.",
+                lifetime=10,
+                title="DuetRRF: Re-send recent job",
+            ).show()
+            return
+        device.resendArchivedJob(entry["name"], stream)
+
     def _checkDuetRRFOutputDevices(self):
         global_container_stack = self._application.getGlobalContainerStack()
         if not global_container_stack:
@@ -183,6 +348,7 @@ class DuetRRFPlugin(Extension, OutputDevicePlugin):
         manager.removeOutputDevice("duetrrf-print")
         manager.removeOutputDevice("duetrrf-simulate")
         manager.removeOutputDevice("duetrrf-upload")
+        manager.removeOutputDevice("duetrrf-fleet")
 
         # check and load new output devices
         config = get_config()
@@ -191,9 +357,27 @@ class DuetRRFPlugin(Extension, OutputDevicePlugin):
             manager.addOutputDevice(DuetRRFOutputDevice(config, DuetRRFDeviceType.print))
             manager.addOutputDevice(DuetRRFOutputDevice(config, DuetRRFDeviceType.simulate))
             manager.addOutputDevice(DuetRRFOutputDevice(config, DuetRRFDeviceType.upload))
+
+            members = self._fleetMembers(global_container_stack)
+            if len(members) > 1:
+                Logger.log("d", f"DuetRRF fleet upload available for {len(members)} printers: {[name for _, name, _ in members]}")
+                concurrency = int(get_preference(DUETRRF_FLEET_CONCURRENCY))
+                manager.addOutputDevice(DuetRRFFleetOutputDevice(config, members, concurrency))
         else:
             manager.addOutputDevice(DuetRRFConfigureOutputDevice())
             Logger.log("d", "DuetRRF is not available for printer: id:{}, name:{}".format(
                 global_container_stack.getId(),
                 global_container_stack.getName(),
             ))
+
+    def _fleetMembers(self, global_container_stack):
+        # the printers opted into fleet uploads with the same machine definition as the active one form its fleet
+        configs = {printer_id: config for printer_id, config in get_all_configs().items() if config["fleet_member"]}
+        if global_container_stack.getId() not in configs:
+            return []
+        definition_id = global_container_stack.definition.getId()
+        members = []
+        for stack in CuraContainerRegistry.getInstance().findContainerStacks(type='machine'):
+            if stack.getId() in configs and stack.definition.getId() == definition_id:
+                members.append((stack.getId(), stack.getName(), configs[stack.getId()]))
+        return sorted(members, key=lambda member: member[1])
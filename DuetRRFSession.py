@@ -0,0 +1,217 @@
+import json
+import time
+
+try: # Cura 5
+    from PyQt6.QtNetwork import QNetworkReply
+    from PyQt6.QtCore import QTimer
+except: # Cura 4
+    from PyQt5.QtNetwork import QNetworkReply
+    from PyQt5.QtCore import QTimer
+
+from cura.CuraApplication import CuraApplication
+
+from UM.Logger import Logger
+
+from .helpers import duet_headers, duet_url
+
+
+class DuetRRFSession:
+    """A persistent RRF HTTP session (rr_connect) shared by all jobs of one printer.
+
+    Instead of rr_connect/rr_disconnect around every job, the session is kept
+    alive with lightweight keepalive requests while jobs are running and for a
+    while after the last job finished. An expired session is re-established
+    transparently by the output device through `reconnect()`.
+    """
+
+    # keep an unused session alive for this long after the last job, in seconds
+    IDLE_TIMEOUT = 120
+
+    def __init__(self, url, duet_password, http_user, http_password):
+        self._url = url
+        self._duet_password = duet_password
+        self._http_user = http_user
+        self._http_password = http_password
+
+        self._connected = False
+        self._connecting = False
+        self._pending = []
+        self._session_key = None
+        self._session_timeout = 8000
+        self._users = 0
+        self._last_used = time.monotonic()
+        self._last_request = time.monotonic()
+
+        # rr_model is RRF 3 only, RRF 2 falls back to rr_status
+        self._keepalive_command = ('rr_model', [("key", "seqs"), ("flags", "d99fn")])
+
+        self._keepalive_timer = QTimer()
+        self._keepalive_timer.setSingleShot(False)
+        self._keepalive_timer.timeout.connect(self._onKeepalive)
+
+        self.connects = 0
+        self.round_trips_saved = 0
+        self.board_type = None
+        self.api_level = None
+
+    def matches(self, config) -> bool:
+        return (
+            self._url == config["url"] and
+            self._duet_password == config["duet_password"] and
+            self._http_user == config["http_user"] and
+            self._http_password == config["http_password"]
+        )
+
+    def isConnected(self) -> bool:
+        return self._connected
+
+    def headers(self) -> dict:
+        if self._session_key is not None:
+            # RRF 3.5+ requires the session key on every request
+            return {'X-Session-Key': str(self._session_key)}
+        return {}
+
+    def touch(self):
+        # any request refreshes the session on the board, no keepalive needed for a while
+        self._last_request = time.monotonic()
+
+    def acquire(self):
+        self._users += 1
+
+    def release(self):
+        if self._users > 0:
+            self._users -= 1
+        self._last_used = time.monotonic()
+        if self._connected:
+            # the rr_disconnect we skip is a round-trip saved
+            self.round_trips_saved += 1
+
+    def connect(self, on_connected, on_error):
+        """Calls `on_connected(reply)` once a session exists, with `reply=None` if an existing session was reused."""
+        if self._connected:
+            self.round_trips_saved += 1
+            Logger.log("d", f"Reusing RRF session for {self._url} | connects: {self.connects}, round-trips saved: {self.round_trips_saved}")
+            on_connected(None)
+            return
+
+        self._pending.append((on_connected, on_error))
+        if self._connecting:
+            return
+
+        Logger.log("d", "Connecting...")
+        self._connecting = True
+        self._send('rr_connect',
+            query=[("password", self._duet_password), ("time", time.strftime('%Y-%m-%dT%H:%M:%S'))],
+            next_stage=self._onConnected,
+            on_error=self._onConnectError,
+        )
+
+    def reconnect(self, on_connected, on_error):
+        Logger.log("d", f"RRF session for {self._url} expired, reconnecting...")
+        self.invalidate()
+        self.connect(on_connected, on_error)
+
+    def invalidate(self):
+        self._connected = False
+        self._session_key = None
+        self._keepalive_timer.stop()
+
+    def disconnect(self):
+        if self._connected:
+            Logger.log("d", f"Closing RRF session for {self._url}")
+            self._send('rr_disconnect', on_error=lambda reply, error: None)
+        self.invalidate()
+
+    def _onConnected(self, reply):
+        self._connecting = False
+        pending, self._pending = self._pending, []
+
+        try:
+            response = json.loads(bytes(reply.readAll()).decode())
+        except Exception:
+            response = {}
+
+        err = response.get("err", 0)
+        if err != 0:
+            # 1: wrong password, 2: no more free sessions on the board
+            Logger.log("e", f"rr_connect rejected with err={err}")
+            for _, on_error in pending:
+                on_error(reply, QNetworkReply.NetworkError.AuthenticationRequiredError)
+            return
+
+        self._connected = True
+        self.connects += 1
+        self._session_key = response.get("sessionKey", None)
+        self._session_timeout = int(response.get("sessionTimeout", 8000))
+        self.board_type = response.get("boardType", None)
+        self.api_level = response.get("apiLevel", None)
+        self.touch()
+        self._keepalive_timer.setInterval(max(1000, self._session_timeout // 2))
+        self._keepalive_timer.start()
+        Logger.log("d", f"RRF session established for {self._url} | timeout: {self._session_timeout} ms")
+
+        for on_connected, _ in pending:
+            on_connected(reply)
+
+    def _onConnectError(self, reply, error):
+        self._connecting = False
+        pending, self._pending = self._pending, []
+        for _, on_error in pending:
+            on_error(reply, error)
+
+    def _onKeepalive(self):
+        if not self._connected:
+            self._keepalive_timer.stop()
+            return
+
+        now = time.monotonic()
+        if self._users == 0 and now - self._last_used > self.IDLE_TIMEOUT:
+            self.disconnect()
+            return
+
+        if (now - self._last_request) * 1000 < self._keepalive_timer.interval():
+            return
+
+        command, query = self._keepalive_command
+        self._send(command,
+            query=query,
+            next_stage=lambda reply: None,
+            on_error=self._onKeepaliveError,
+        )
+
+    def _onKeepaliveError(self, reply, error):
+        if error == QNetworkReply.NetworkError.ContentNotFoundError and self._keepalive_command[0] == 'rr_model':
+            Logger.log("d", "rr_model not available, using rr_status for keepalives")
+            self._keepalive_command = ('rr_status', [("type", "1")])
+            return
+        Logger.log("d", f"RRF session keepalive failed with error {error}")
+        self.invalidate()
+
+    def _send(self, command, query=None, next_stage=None, on_error=None):
+        headers = duet_headers(self._http_user, self._http_password)
+        headers.update(self.headers())
+        self.touch()
+        CuraApplication.getInstance().getHttpRequestManager().get(
+            duet_url(self._url, command, query),
+            headers,
+            callback=next_stage,
+            error_callback=on_error,
+        )
+
+
+# one session per printer URL, shared by the print, simulate and upload devices
+_sessions = {}
+
+def get_session(config) -> DuetRRFSession:
+    session = _sessions.get(config["url"])
+    if session is None or not session.matches(config):
+        if session is not None:
+            session.disconnect()
+        session = DuetRRFSession(config["url"], config["duet_password"], config["http_user"], config["http_password"])
+        _sessions[config["url"]] = session
+    return session
+
+def close_sessions():
+    for session in _sessions.values():
+        session.disconnect()
+    _sessions.clear()
@@ -1,11 +1,29 @@
 import json
 import os
+import time
 
 from UM.Logger import Logger
 
 from cura.CuraApplication import CuraApplication
 
 DUETRRF_SETTINGS = "duetrrf/instances"
+DUETRRF_THUMBNAIL_RENDER_ONCE = "duetrrf/thumbnail_render_once"
+DUETRRF_THUMBNAIL_SUPERSAMPLE = "duetrrf/thumbnail_supersample"
+DUETRRF_API_CACHE = "duetrrf/api_cache"
+DUETRRF_FLEET_CONCURRENCY = "duetrrf/fleet_concurrency"
+DUETRRF_UPLOAD_INDEX = "duetrrf/upload_index"
+DUETRRF_ARCHIVE_SIZE = "duetrrf/archive_size"
+DUETRRF_SPECULATIVE_UPLOAD = "duetrrf/speculative_upload"
+
+# re-probe the API flavour and firmware version of a printer after this many seconds
+API_CACHE_TTL = 24 * 60 * 60
+
+# remember this many recently uploaded files per printer
+UPLOAD_INDEX_SIZE = 50
+
+# Cura's HttpRequestManager runs at most 4 requests at once, for all plugins and printers,
+# fleet uploads leave at least one of them to polling, session keepalives and everything else
+FLEET_MAX_CONCURRENCY = 3
 
 # PanelDue firmware v3.5.0:
 # ref https://forum.duet3d.com/post/270550 and https://forum.duet3d.com/post/270553
@@ -30,6 +48,10 @@ DEFAULT_THUMBNAIL_SIZES = [
 ]
 DEFAULT_THUMBNAIL_SIZES_STR = ",".join([f"{w}x{h}" for w, h in DEFAULT_THUMBNAIL_SIZES])
 
+# parsed and migrated DUETRRF_SETTINGS, keyed by printer id
+# reads are served from here, preferences are only written on explicit saves and deletes
+_config_cache = None
+
 def _load_prefs():
     application = CuraApplication.getInstance()
     global_container_stack = application.getGlobalContainerStack()
@@ -40,30 +62,74 @@ def _load_prefs():
     s = json.loads(p.getValue(DUETRRF_SETTINGS))
     return s, printer_id
 
+def _migrate_config(config: dict) -> dict:
+    # migrate to the latest default values
+    return {
+        "url": config.get("url", ""),
+        "duet_password": config.get("duet_password", ""),
+        "http_user": config.get("http_user", ""),
+        "http_password": config.get("http_password", ""),
+        "embed_thumbnails": config.get("embed_thumbnails", True),
+        "thumbnail_sizes": config.get("thumbnail_sizes", DEFAULT_THUMBNAIL_SIZES_STR),
+        "fleet_member": config.get("fleet_member", False),
+    }
+
+def _load_config_cache() -> dict:
+    global _config_cache
+    if _config_cache is None:
+        application = CuraApplication.getInstance()
+        s = json.loads(application.getPreferences().getValue(DUETRRF_SETTINGS))
+        _config_cache = {printer_id: _migrate_config(config) for printer_id, config in s.items()}
+        Logger.log("d", f"Loaded DuetRRF config for {len(_config_cache)} printers.")
+    return _config_cache
+
+def invalidate_config_cache():
+    global _config_cache
+    _config_cache = None
+
+def _onPreferenceChanged(key: str):
+    if key == DUETRRF_SETTINGS:
+        invalidate_config_cache()
+
 def init_settings():
     application = CuraApplication.getInstance()
     p = application.getPreferences()
     p.addPreference(DUETRRF_SETTINGS, json.dumps({}))
+    p.addPreference(DUETRRF_THUMBNAIL_RENDER_ONCE, True)
+    p.addPreference(DUETRRF_THUMBNAIL_SUPERSAMPLE, 1.0)
+    p.addPreference(DUETRRF_API_CACHE, json.dumps({}))
+    p.addPreference(DUETRRF_FLEET_CONCURRENCY, 2) # capped at FLEET_MAX_CONCURRENCY
+    p.addPreference(DUETRRF_UPLOAD_INDEX, json.dumps({}))
+    p.addPreference(DUETRRF_ARCHIVE_SIZE, 0) # MB, 0 disables the archive, which writes every upload to disk once more
+    p.addPreference(DUETRRF_SPECULATIVE_UPLOAD, False)
+    p.preferenceChanged.connect(_onPreferenceChanged)
+    application.globalContainerStackChanged.connect(invalidate_config_cache)
+
+def get_preference(key: str):
+    application = CuraApplication.getInstance()
+    return application.getPreferences().getValue(key)
 
 def get_config() -> dict:
-    s, printer_id = _load_prefs()
-    if printer_id in s:
-        config = s[printer_id]
-
-        # migrate to the latest default values
-        return save_config(
-            url=config.get("url", ""),
-            duet_password=config.get("duet_password", ""),
-            http_user=config.get("http_user", ""),
-            http_password=config.get("http_password", ""),
-            embed_thumbnails=config.get("embed_thumbnails", True),
-            thumbnail_sizes=config.get("thumbnail_sizes", DEFAULT_THUMBNAIL_SIZES_STR),
-        )
+    global_container_stack = CuraApplication.getInstance().getGlobalContainerStack()
+    if not global_container_stack:
+        return {}
+    config = _load_config_cache().get(global_container_stack.getId())
+    if config:
+        # hand out a copy, so callers can't modify the cache
+        return dict(config)
 
     return {}
 
-def save_config(url: str, duet_password: str, http_user: str, http_password: str, embed_thumbnails: bool, thumbnail_sizes: str):
+def embed_thumbnails_enabled(config: dict) -> bool:
+    # saved configs always carry the setting, a printer without one is not a Duet-RRF printer
+    return config.get("embed_thumbnails", False)
+
+def get_all_configs() -> dict:
+    return {printer_id: dict(config) for printer_id, config in _load_config_cache().items()}
+
+def save_config(url: str, duet_password: str, http_user: str, http_password: str, embed_thumbnails: bool, thumbnail_sizes: str, fleet_member: bool):
     s, printer_id = _load_prefs()
+    previous_url = s.get(printer_id, {}).get("url")
     s[printer_id] = {
             "url": url,
             "duet_password": duet_password,
@@ -71,10 +137,18 @@ def save_config(url: str, duet_password: str, http_user: str, http_password: str
             "http_password": http_password,
             "embed_thumbnails": embed_thumbnails,
             "thumbnail_sizes": thumbnail_sizes,
+            "fleet_member": fleet_member,
         }
     application = CuraApplication.getInstance()
     p = application.getPreferences()
     p.setValue(DUETRRF_SETTINGS, json.dumps(s))
+    invalidate_config_cache()
+    if _load_api_cache().get(printer_id, {}).get("url") != url:
+        # the API flavour needs to be detected again for a new URL
+        delete_api_info(printer_id)
+    if previous_url != url:
+        # files uploaded to another printer tell nothing about this one
+        delete_upload_index(printer_id)
     return s[printer_id]
 
 def delete_config(printer_id=None):
@@ -86,9 +160,91 @@ def delete_config(printer_id=None):
         application = CuraApplication.getInstance()
         p = application.getPreferences()
         p.setValue(DUETRRF_SETTINGS, json.dumps(s))
+        invalidate_config_cache()
+        delete_api_info(printer_id)
+        delete_upload_index(printer_id)
         return True
     return False
 
+def _load_api_cache() -> dict:
+    application = CuraApplication.getInstance()
+    return json.loads(application.getPreferences().getValue(DUETRRF_API_CACHE))
+
+def get_api_info(printer_id: str, url: str) -> dict:
+    """Returns the cached API probe of a printer: `api` ("rrf" or "dsf"), `firmware_version`, `board_type`, `rr_model`.
+
+    Entries are only valid for the URL they were probed with and expire after API_CACHE_TTL.
+    """
+    info = _load_api_cache().get(printer_id)
+    if not info or info.get("url") != url or time.time() - info.get("probed_at", 0) > API_CACHE_TTL:
+        return {}
+    return info
+
+def save_api_info(printer_id: str, url: str, api: str, **details):
+    s = _load_api_cache()
+    info = s.get(printer_id, {})
+    if info.get("url") != url or info.get("api") != api:
+        info = {}
+    info.update(details)
+    info.update({
+        "url": url,
+        "api": api,
+        "probed_at": time.time(),
+    })
+    s[printer_id] = info
+    application = CuraApplication.getInstance()
+    application.getPreferences().setValue(DUETRRF_API_CACHE, json.dumps(s))
+    Logger.log("d", f"Cached API info for {printer_id}: {info}")
+    return info
+
+def delete_api_info(printer_id: str):
+    s = _load_api_cache()
+    if printer_id in s:
+        del s[printer_id]
+        application = CuraApplication.getInstance()
+        application.getPreferences().setValue(DUETRRF_API_CACHE, json.dumps(s))
+
+def _load_upload_index() -> dict:
+    application = CuraApplication.getInstance()
+    return json.loads(application.getPreferences().getValue(DUETRRF_UPLOAD_INDEX))
+
+def get_uploaded_file(printer_id: str, url: str, file_name: str) -> dict:
+    """Returns what is known about a file previously uploaded to a printer: `size`, `crc32`, `last_modified`, `uploaded_at`.
+
+    Entries are only valid for the URL they were uploaded to.
+    """
+    index = _load_upload_index().get(printer_id)
+    if not index or index.get("url") != url:
+        return {}
+    return index["files"].get(file_name, {})
+
+def save_uploaded_file(printer_id: str, url: str, file_name: str, size: int, crc32: int, last_modified):
+    s = _load_upload_index()
+    index = s.get(printer_id, {})
+    if index.get("url") != url:
+        index = {"url": url, "files": {}}
+    files = index["files"]
+    files.pop(file_name, None)
+    files[file_name] = {
+        "size": size,
+        "crc32": crc32,
+        "last_modified": last_modified,
+        "uploaded_at": time.time(),
+    }
+    # dicts keep insertion order, the oldest uploads are dropped first
+    for old_name in list(files)[:-UPLOAD_INDEX_SIZE]:
+        del files[old_name]
+    s[printer_id] = index
+    application = CuraApplication.getInstance()
+    application.getPreferences().setValue(DUETRRF_UPLOAD_INDEX, json.dumps(s))
+
+def delete_upload_index(printer_id: str):
+    s = _load_upload_index()
+    if printer_id in s:
+        del s[printer_id]
+        application = CuraApplication.getInstance()
+        application.getPreferences().setValue(DUETRRF_UPLOAD_INDEX, json.dumps(s))
+
 def get_plugin_version():
     plugin_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plugin.json")
     try:
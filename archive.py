@@ -0,0 +1,219 @@
+import hashlib
+import json
+import mmap
+import os
+import time
+import weakref
+import zlib
+
+from UM.Job import Job
+from UM.Logger import Logger
+from UM.Resources import Resources
+
+from .DuetRRFSettings import DUETRRF_ARCHIVE_SIZE, get_preference
+from .helpers import GCodeChunkStream
+
+
+# archived jobs are read in slices of this size while uploading
+ARCHIVE_READ_SIZE = 1024 * 1024
+
+# streams which are already archived or being archived, e.g. by an earlier upload of a cached payload
+_archiving = weakref.WeakSet()
+# leftovers of spool jobs interrupted by a crash or exit are removed before the first one of this session
+_spool_cleaned = False
+
+
+def _archive_dir() -> str:
+    path = os.path.join(Resources.getCacheStoragePath(), "duetrrf_archive")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _archive_path(digest: str) -> str:
+    return os.path.join(_archive_dir(), digest + ".gcode")
+
+def _load_index() -> dict:
+    try:
+        with open(os.path.join(_archive_dir(), "index.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_index(index: dict):
+    path = os.path.join(_archive_dir(), "index.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(path + ".tmp", path)
+
+def _remove_stale_spool_files():
+    global _spool_cleaned
+    if _spool_cleaned:
+        return
+    _spool_cleaned = True
+    path = _archive_dir()
+    for name in os.listdir(path):
+        if name.startswith("spool-") and name.endswith(".tmp"):
+            Logger.log("d", "Removing stale {} from the job archive".format(name))
+            try:
+                os.remove(os.path.join(path, name))
+            except OSError:
+                pass
+
+def _archive_limit() -> int:
+    return int(get_preference(DUETRRF_ARCHIVE_SIZE)) * 1024 * 1024
+
+def archived_jobs(limit: int = 5) -> list:
+    """Returns (digest, entry) of the most recently used archived jobs, newest first.
+
+    Every entry has `name`, `size`, `crc32`, `printer`, `archived_at` and `used_at`.
+    """
+    index = _load_index()
+    jobs = sorted(index.items(), key=lambda item: item[1]["used_at"], reverse=True)
+    return [(digest, entry) for digest, entry in jobs if os.path.exists(_archive_path(digest))][:limit]
+
+def open_archived_job(digest: str):
+    """Returns an ArchivedGCodeStream of an archived job, or None if it is gone."""
+    index = _load_index()
+    entry = index.get(digest)
+    if entry is None:
+        return None
+    try:
+        stream = ArchivedGCodeStream(_archive_path(digest), entry["crc32"])
+    except OSError as e:
+        Logger.log("w", "Failed to open archived job {}: {}".format(entry["name"], e))
+        del index[digest]
+        _save_index(index)
+        return None
+    entry["used_at"] = time.time()
+    _save_index(index)
+    return stream
+
+def archive_stream(stream, file_name: str, printer: str):
+    """Spools an uploaded GCodeChunkStream into the archive on a background thread.
+
+    The stream may be closed right afterwards, the job keeps its own references
+    to the gcode chunks until they are written.
+    """
+    if not isinstance(stream, GCodeChunkStream) or stream in _archiving or _archive_limit() <= 0:
+        return
+    # no spool job of this session is running yet the first time
+    _remove_stale_spool_files()
+    _archiving.add(stream)
+    job = GCodeArchiveJob(stream, file_name, printer)
+    job.finished.connect(_onArchived)
+    job.start()
+
+def _onArchived(job):
+    result = job.getResult()
+    if result is None:
+        return
+    digest, size, crc32 = result
+
+    index = _load_index()
+    now = time.time()
+    entry = index.get(digest, {"archived_at": now})
+    entry.update({
+        "name": job.file_name,
+        "size": size,
+        "crc32": crc32,
+        "printer": job.printer,
+        "used_at": now,
+    })
+    index[digest] = entry
+
+    # least recently used jobs are evicted first, the new one is always kept
+    limit = _archive_limit()
+    total = sum(e["size"] for e in index.values())
+    for old_digest, old_entry in sorted(index.items(), key=lambda item: item[1]["used_at"]):
+        if total <= limit or old_digest == digest:
+            break
+        Logger.log("d", "Evicting {} ({} bytes) from the job archive".format(old_entry["name"], old_entry["size"]))
+        try:
+            os.remove(_archive_path(old_digest))
+        except OSError:
+            pass
+        del index[old_digest]
+        total -= old_entry["size"]
+    _save_index(index)
+
+
+class GCodeArchiveJob(Job):
+    """Writes the encoded gcode of a stream to the archive, named by its SHA-256.
+
+    The result is (digest, size, crc32), or None if writing failed.
+    """
+
+    def __init__(self, stream: GCodeChunkStream, file_name: str, printer: str):
+        super().__init__()
+        self._chunks = stream.chunks()
+        self.file_name = file_name
+        self.printer = printer
+
+    def run(self):
+        start = time.monotonic()
+        sha256 = hashlib.sha256()
+        crc = 0
+        size = 0
+        tmp_path = os.path.join(_archive_dir(), "spool-{}.tmp".format(id(self)))
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in self._chunks:
+                    data = chunk.encode()
+                    sha256.update(data)
+                    crc = zlib.crc32(data, crc)
+                    size += len(data)
+                    f.write(data)
+            digest = sha256.hexdigest()
+            # the same content is only stored once
+            os.replace(tmp_path, _archive_path(digest))
+        except OSError as e:
+            Logger.log("w", "Failed to archive {}: {}".format(self.file_name, e))
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            self.setResult(None)
+            return
+        finally:
+            self._chunks = None
+
+        Logger.log("d", "Archived {} ({} bytes) in {:.3f} s".format(self.file_name, size, time.monotonic() - start))
+        self.setResult((digest, size, crc))
+
+
+class ArchivedGCodeStream:
+    """Read-only gcode stream backed by a memory-mapped archive file.
+
+    Serves the same chunk interface as GCodeChunkStream to GCodeUploadDevice,
+    in slices of ARCHIVE_READ_SIZE bytes read straight from the mapping. The
+    CRC32 is known from the archive index, no checksum pass is needed.
+    """
+
+    def __init__(self, path: str, crc32: int):
+        self._file = open(path, "rb")
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._size else None
+        self._offsets = list(range(0, self._size, ARCHIVE_READ_SIZE))
+        self._crc32 = crc32
+        self.closed = False
+        self.checksum_seconds = 0.0
+
+    def size(self) -> int:
+        return self._size
+
+    def crc32(self):
+        return self._crc32
+
+    def chunk_offsets(self) -> list:
+        return self._offsets
+
+    def encoded_chunk(self, index: int) -> bytes:
+        offset = self._offsets[index]
+        return self._mmap[offset:offset + ARCHIVE_READ_SIZE]
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Measure the cost of the incremental CRC32 in GCodeChunkStream.write.
+
+Usage: python3 benchmarks/bench_crc.py [megabytes] [repeat]
+
+Synthetic gcode is written in layer-sized chunks into the plugin's own
+GCodeChunkStream, the way GCodeWriter writes the scene's gcode_list. The
+plugin is imported unchanged, with UM and cura replaced by the stubs in
+uranium_stubs.py, like in bench_pipeline.py. Requires PyQt6.
+
+write() encodes each chunk once and updates the running CRC32, the time
+spent on that is summed up in the stream's checksum_seconds and reported
+as the checksum share of the write path. The final checksum is compared
+to zlib.crc32 over the whole file.
+"""
+
+import importlib
+import os
+import random
+import sys
+import time
+import types
+import zlib
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, BENCHMARKS)
+
+from PyQt6.QtCore import QCoreApplication
+
+import uranium_stubs
+
+PLUGIN_PACKAGE = "duetrrf_benchmark"
+
+
+def load_helpers():
+    # import the plugin module without running __init__.py, which registers the plugin with Cura
+    package = types.ModuleType(PLUGIN_PACKAGE)
+    package.__path__ = [REPO]
+    sys.modules[PLUGIN_PACKAGE] = package
+    return importlib.import_module(PLUGIN_PACKAGE + ".helpers")
+
+
+def synthetic_gcode(megabytes, seed=42):
+    rnd = random.Random(seed)
+    chunks = []
+    size = 0
+    layer = 0
+    while size < megabytes * 1024 * 1024:
+        lines = [";LAYER:{}".format(layer)]
+        for _ in range(2000):
+            lines.append("G1 X{:.3f} Y{:.3f} E{:.5f}".format(rnd.uniform(0, 300), rnd.uniform(0, 300), rnd.uniform(0, 2)))
+        chunk = "\n".join(lines) + "\n"
+        chunks.append(chunk)
+        size += len(chunk)
+        layer += 1
+    return chunks
+
+
+def write_all(helpers, chunks):
+    stream = helpers.GCodeChunkStream()
+    for s in chunks:
+        stream.write(s)
+    return stream
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    app = QCoreApplication(sys.argv[:1])
+    uranium_stubs.install()
+    helpers = load_helpers()
+
+    chunks = synthetic_gcode(megabytes)
+    best_write = float("inf")
+    best_checksum = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stream = write_all(helpers, chunks)
+        best_write = min(best_write, time.perf_counter() - start)
+        best_checksum = min(best_checksum, stream.checksum_seconds)
+    if stream.size() != len("".join(chunks).encode()) or stream.crc32() != zlib.crc32("".join(chunks).encode()):
+        raise SystemExit("checksum mismatch")
+
+    mb = stream.size() / (1024 * 1024)
+    print(f"{mb:.1f} MB in {len(chunks)} chunks, CRC32 {stream.crc32():08x}")
+    print(f"{'':>14} {'total ms':>9} {'ms/MB':>7}")
+    print(f"{'write':>14} {best_write * 1000:>9.1f} {best_write * 1000 / mb:>7.3f}")
+    print(f"{'of it crc32':>14} {best_checksum * 1000:>9.1f} {best_checksum * 1000 / mb:>7.3f}")
+    print(f"checksum overhead: {best_checksum * 1000 / mb:.3f} ms/MB, {best_checksum / best_write * 100:.0f}% of write")
+    del app
+
+
+if __name__ == "__main__":
+    main()
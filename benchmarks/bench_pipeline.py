@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""End-to-end benchmark of the upload pipeline against the mock Duet server.
+
+Usage: python3 benchmarks/bench_pipeline.py [--sizes 1,10,100] [--flavours rrf,dsf]
+           [--modes print,simulate,upload,resend] [--same-slice] [--speculative [--reslice-after s]] [--precompute-thumbnails] [--latency ms] [--bandwidth KiB/s] [--json results.json]
+
+Requires PyQt6, as shipped with Cura 5. The plugin modules are imported
+unchanged, with UM and cura replaced by the stubs in uranium_stubs.py, and
+run on a real Qt event loop against benchmarks/mock_duet.py over HTTP.
+
+Every job goes through the same path as a click on "Print on ...":
+writeStarted (thumbnails are rendered and embedded, like the plugin's
+writeStarted hook), gcode serialization with its checksum, connect and API
+detection, upload, then M32, or M37 and the simulation polling loop.
+With --same-slice all modes of one size and flavour send the same slice,
+like "Simulate" followed by "Print", and reuse the serialized payload.
+With --precompute-thumbnails the thumbnails are rendered before the job
+is confirmed, like the plugin does when slicing is done.
+With --speculative every job is uploaded in the background first, like
+after slicing with the duetrrf/speculative_upload preference, and the
+times are measured from the confirmation of the already uploaded job.
+With --reslice-after the scene is re-sliced that many seconds into the
+speculative upload, which discards it, and the new slice is confirmed
+right away, so it must not wait for the old one. The aborted upload still
+shows up in recv MB with whatever the kernel had already buffered for it.
+The resend mode prints the most recently archived job from the on-disk
+archive instead of the scene, it needs an earlier mode to archive a job
+and turns the archive on for all jobs.
+
+Per job it reports the time spent in each stage, the time to first byte,
+upload throughput, the peak of Python memory allocations (tracemalloc) and
+the number of requests. A second table compares thumbnail rendering and
+encoding for different sets of thumbnail sizes.
+"""
+
+import argparse
+import gc
+import importlib
+import json
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+import types
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, BENCHMARKS)
+
+from PyQt6.QtCore import QEventLoop, QTimer
+from PyQt6.QtGui import QGuiApplication
+
+import uranium_stubs
+from mock_duet import MockDuet
+
+PLUGIN_PACKAGE = "duetrrf_benchmark"
+
+THUMBNAIL_SETS = [
+    "48x48,240x240,320x320",
+    "48x48,240x240,320x320,480x480,800x800",
+]
+
+
+def load_plugin():
+    # import the plugin modules without running __init__.py, which registers the plugin with Cura
+    package = types.ModuleType(PLUGIN_PACKAGE)
+    package.__path__ = [REPO]
+    sys.modules[PLUGIN_PACKAGE] = package
+    return types.SimpleNamespace(
+        output_device=importlib.import_module(PLUGIN_PACKAGE + ".DuetRRFOutputDevice"),
+        archive=importlib.import_module(PLUGIN_PACKAGE + ".archive"),
+        speculative=importlib.import_module(PLUGIN_PACKAGE + ".speculative"),
+        payload_cache=importlib.import_module(PLUGIN_PACKAGE + ".payload_cache"),
+        session=importlib.import_module(PLUGIN_PACKAGE + ".DuetRRFSession"),
+        settings=importlib.import_module(PLUGIN_PACKAGE + ".DuetRRFSettings"),
+        thumbnails=importlib.import_module(PLUGIN_PACKAGE + ".thumbnails"),
+    )
+
+
+def synthetic_gcode(megabytes, seed=42):
+    """Returns a gcode_list of about `megabytes` MB, one chunk per layer, as produced by CuraEngine."""
+    rnd = random.Random(seed)
+    moves = "\n".join(
+        "G1 X{:.3f} Y{:.3f} E{:.5f}".format(rnd.uniform(0, 300), rnd.uniform(0, 300), rnd.uniform(0, 2))
+        for _ in range(2000)
+    ) + "\n"
+    gcode_list = [";FLAVOR:RepRap\n;TIME:3600\n;Filament used: 1.5m\n;Layer height: 0.2\n;Generated with Cura_SteamEngine 5.7.0\n"]
+    size = len(gcode_list[0])
+    layer = 0
+    while size < megabytes * 1024 * 1024:
+        chunk = ";LAYER:{}\nG0 Z{:.1f}\n".format(layer, 0.2 * (layer + 1)) + moves
+        gcode_list.append(chunk)
+        size += len(chunk)
+        layer += 1
+    gcode_list.append(";End of Gcode\nM84\n")
+    return gcode_list
+
+
+class FakeDialog:
+    """Stands in for UploadFilename.qml, already confirmed with the given name."""
+
+    class _Field:
+        def __init__(self, text):
+            self._text = text
+
+        def property(self, name):
+            return self._text
+
+    def __init__(self, file_name):
+        self._field = FakeDialog._Field(file_name)
+
+    def findChild(self, type, name):
+        return self._field
+
+    def deleteLater(self):
+        pass
+
+
+class JobProbe:
+    """Records when a device reaches each stage of a job."""
+
+    def __init__(self, plugin, device, loop, gcode_list):
+        self._plugin = plugin
+        self._device = device
+        self._loop = loop
+        self._gcode_list = gcode_list
+        self.marks = {}
+        self.thumbnails = 0.0
+        self.thumbnails_blocked = 0.0
+        self.thumbnail_render = 0.0
+        self.checksum = None
+        self.success = None
+
+        self._wrap("serialized", "_submitSerialized", self._onSerialized)
+        self._wrap("connected", "_onUploadReady")
+        self._wrap("uploaded", "_onUploadDone")
+        self._wrap("started", "_onPrintStarted")
+        self._wrap("started", "_onSimulationPrintStarted")
+        self._wrap("first_byte", "_onUploadProgress", condition=lambda sent, total: sent > 0)
+
+        device.writeStarted.connect(self._onWriteStarted)
+        device.writeSuccess.connect(self._onSuccess)
+        device.writeError.connect(self._onError)
+
+    def _wrap(self, mark, name, after=None, condition=None):
+        original = getattr(self._device, name)
+        def wrapper(*args, **kwargs):
+            if condition is None or condition(*args):
+                self.marks.setdefault(mark, time.perf_counter())
+            result = original(*args, **kwargs)
+            if after is not None:
+                after(*args, **kwargs)
+            return result
+        # an instance attribute shadows the method for all lookups by the device itself
+        setattr(self._device, name, wrapper)
+
+    def _onSerialized(self, fileName, stream, metrics, owns_stream):
+        # computed while serializing, and already part of the serialize time
+        self.checksum = stream.checksum_seconds
+
+    def _onWriteStarted(self, device):
+        # what DuetRRFPlugin._embed_thumbnails does for every output device,
+        # the confirmed job's device waits for the thumbnails while the event loop keeps running
+        start = time.perf_counter()
+        if ";Exported with Cura-DuetRRF" in self._gcode_list[0]:
+            return
+        render_before = uranium_stubs.Snapshot.render_seconds
+        block = self._plugin.thumbnails.precomputed_thumbnails(self._gcode_list)
+        if block is not None or device is None:
+            if block is None:
+                thumbnail_stream = self._plugin.thumbnails.generate_thumbnail()
+                block = thumbnail_stream.getvalue() if thumbnail_stream is not None else ""
+            self._onThumbnails(start, render_before, block)
+            self.thumbnails_blocked = self.thumbnails
+            return
+
+        release = device.holdWrite()
+
+        def on_thumbnails(thumbnail_stream):
+            self._onThumbnails(start, render_before, thumbnail_stream.getvalue() if thumbnail_stream is not None else "")
+            release()
+
+        if not self._plugin.thumbnails.generate_thumbnail_async(on_thumbnails):
+            on_thumbnails(None)
+        self.thumbnails_blocked = time.perf_counter() - start
+
+    def _onThumbnails(self, start, render_before, block):
+        self._gcode_list[0] += ";Exported with Cura-DuetRRF benchmark\n" + block
+        self.thumbnails = time.perf_counter() - start
+        self.thumbnail_render = uranium_stubs.Snapshot.render_seconds - render_before
+
+    def _onSuccess(self, device):
+        self.marks["finished"] = time.perf_counter()
+        self.success = True
+        self._loop.quit()
+
+    def _onError(self, device):
+        self.marks["finished"] = time.perf_counter()
+        self.success = False
+        self._loop.quit()
+
+
+def process_events(seconds):
+    loop = QEventLoop()
+    QTimer.singleShot(int(seconds * 1000), loop.quit)
+    loop.exec()
+
+
+def run_job(plugin, application, args, flavour, mode, megabytes, measure_memory, gcode_list=None):
+    if gcode_list is None:
+        gcode_list = synthetic_gcode(megabytes)
+    size = sum(len(chunk) for chunk in gcode_list)
+    application.getController().getScene().gcode_dict = {0: gcode_list}
+
+    with MockDuet(
+        flavour=flavour,
+        latency=args.latency / 1000,
+        bandwidth=args.bandwidth * 1024,
+        simulation_time=args.simulation_time,
+    ) as duet:
+        config = {
+            "url": duet.url,
+            "duet_password": "",
+            "http_user": "",
+            "http_password": "",
+            "embed_thumbnails": True,
+            "thumbnail_sizes": args.thumbnails,
+        }
+        uranium_stubs.set_printer_config(config)
+        device_type = getattr(plugin.output_device.DuetRRFDeviceType, "print" if mode == "resend" else mode)
+        device = plugin.output_device.DuetRRFOutputDevice(config, device_type)
+        loop = QEventLoop()
+        probe = JobProbe(plugin, device, loop, gcode_list)
+        if not args.thumbnail_cache:
+            plugin.thumbnails._thumbnail_cache.clear()
+        if args.precompute_thumbnails:
+            precomputed = []
+            plugin.thumbnails.precompute_thumbnails(gcode_list, lambda: precomputed.append(True))
+            while not precomputed:
+                process_events(0.01)
+        speculative = None
+        if args.speculative and mode in ("print", "simulate"):
+            # what DuetRRFPlugin does once slicing is done
+            speculative_start = time.perf_counter()
+            probe._onWriteStarted(None)
+            plugin.speculative.start_speculative_upload(config)
+            upload = plugin.speculative._uploads[duet.url]
+            deadline = args.reslice_after if args.reslice_after is not None else args.timeout
+            while not upload.done and time.perf_counter() - speculative_start < deadline:
+                process_events(0.01)
+            speculative = time.perf_counter() - speculative_start
+            if args.reslice_after is not None:
+                # what DuetRRFPlugin does when the backend starts slicing again
+                plugin.payload_cache.invalidate_payloads()
+                plugin.speculative.discard_speculative_uploads()
+                gcode_list = synthetic_gcode(megabytes, seed=43)
+                application.getController().getScene().gcode_dict = {0: gcode_list}
+            probe.thumbnails = 0.0
+            probe.thumbnails_blocked = 0.0
+        requests_before = application.getHttpRequestManager().requests
+
+        gc.collect()
+        if measure_memory:
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+
+        QTimer.singleShot(args.timeout * 1000, loop.quit)
+        start = time.perf_counter()
+        if mode == "resend":
+            digest, entry = plugin.archive.archived_jobs(limit=1)[0]
+            device.resendArchivedJob(entry["name"], plugin.archive.open_archived_job(digest))
+        else:
+            device._dialog = FakeDialog("benchmark-{}MB.gcode".format(megabytes))
+            device._onFilenameAccepted()
+        if probe.success is None:
+            loop.exec()
+
+        peak = tracemalloc.get_traced_memory()[1] - memory_before if measure_memory else None
+        requests = application.getHttpRequestManager().requests - requests_before
+        stats = duet.board.stats()
+
+        # drop the session of this mock board before it goes away
+        plugin.session.close_sessions()
+        process_events(0.05)
+        # uploads are archived in the background
+        while not plugin.archive.archived_jobs(limit=1) and mode != "resend" and probe.success and plugin.archive._archive_limit() > 0:
+            process_events(0.05)
+
+    marks = {name: t - start for name, t in probe.marks.items()}
+
+    def between(a, b):
+        if a in marks and b in marks:
+            return marks[b] - marks[a]
+        return None
+
+    upload = between("first_byte", "uploaded")
+    return {
+        "flavour": flavour,
+        "mode": mode,
+        "megabytes": size / (1024 * 1024),
+        "success": probe.success,
+        "total": marks.get("finished"),
+        "thumbnails": probe.thumbnails,
+        "thumbnails_blocked": probe.thumbnails_blocked,
+        "thumbnail_render": probe.thumbnail_render,
+        "serialize": marks["serialized"] - probe.thumbnails if "serialized" in marks else None,
+        "checksum": probe.checksum,
+        "connected": marks.get("connected"),
+        "time_to_first_byte": marks.get("first_byte"),
+        "upload": upload,
+        "throughput": size / upload / (1024 * 1024) if upload else None,
+        "start": between("uploaded", "started"),
+        "peak_memory": peak / (1024 * 1024) if peak is not None else None,
+        "requests": requests,
+        "server_requests": stats["requests"],
+        "received": stats["bytes_received"] / (1024 * 1024),
+        "speculative": speculative,
+    }
+
+
+def run_thumbnails(plugin, args):
+    application = uranium_stubs.CuraApplication.getInstance()
+    results = []
+    for sizes in args.thumbnail_sets:
+        for render_once in (True, False):
+            uranium_stubs.set_printer_config({
+                "url": "http://127.0.0.1/",
+                "duet_password": "",
+                "http_user": "",
+                "http_password": "",
+                "embed_thumbnails": True,
+                "thumbnail_sizes": sizes,
+            })
+            application.getPreferences().setValue(plugin.settings.DUETRRF_THUMBNAIL_RENDER_ONCE, render_once)
+
+            best = None
+            for _ in range(args.repeat):
+                plugin.thumbnails._thumbnail_cache.clear()
+                render_before = uranium_stubs.Snapshot.render_seconds
+                renders_before = uranium_stubs.Snapshot.renders
+                start = time.perf_counter()
+                block = plugin.thumbnails.generate_thumbnail().getvalue()
+                total = time.perf_counter() - start
+                render = uranium_stubs.Snapshot.render_seconds - render_before
+                if best is None or total < best["total"]:
+                    best = {
+                        "sizes": sizes,
+                        "render_once": render_once,
+                        "total": total,
+                        "render": render,
+                        "renders": uranium_stubs.Snapshot.renders - renders_before,
+                        "encode": total - render,
+                        "block_size": len(block),
+                    }
+            # the scene didn't change, so this is served from the thumbnail cache
+            start = time.perf_counter()
+            cached = plugin.thumbnails.generate_thumbnail().getvalue()
+            best["cached"] = time.perf_counter() - start
+            assert cached == block
+            results.append(best)
+    application.getPreferences().setValue(plugin.settings.DUETRRF_THUMBNAIL_RENDER_ONCE, True)
+    return results
+
+
+def ms(value):
+    return "{:>9.1f}".format(value * 1000) if value is not None else "{:>9}".format("-")
+
+
+def print_jobs(results):
+    print("{:<4} {:<8} {:>7} {:>7} {:>8} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>7} {:>9} {:>8} {:>7} {:>5}".format(
+        "api", "mode", "MB", "spec s", "total s", "thumbs", "blocked", "serialize", "checksum", "connected", "ttfb", "upload s", "MB/s", "start", "peak MB", "recv MB", "reqs"))
+    for r in results:
+        print("{:<4} {:<8} {:>7.1f} {:>7} {:>8} {} {} {} {} {} {} {:>9} {:>7} {} {:>8} {:>7.1f} {:>5}{}".format(
+            r["flavour"], r["mode"], r["megabytes"],
+            "{:.2f}".format(r["speculative"]) if r["speculative"] is not None else "-",
+            "{:.2f}".format(r["total"]) if r["total"] is not None else "-",
+            ms(r["thumbnails"]), ms(r["thumbnails_blocked"]), ms(r["serialize"]), ms(r["checksum"]), ms(r["connected"]), ms(r["time_to_first_byte"]),
+            "{:.2f}".format(r["upload"]) if r["upload"] is not None else "-",
+            "{:.1f}".format(r["throughput"]) if r["throughput"] is not None else "-",
+            ms(r["start"]),
+            "{:.1f}".format(r["peak_memory"]) if r["peak_memory"] is not None else "-",
+            r["received"],
+            r["requests"],
+            "" if r["success"] else "  FAILED",
+        ))
+    print("all times in ms since the job was confirmed, unless noted; connected: ready to upload, ttfb: first byte sent")
+    print("blocked: part of thumbs the Qt thread was busy with, the rest is encoded in the background")
+    print("spec: speculative upload after slicing, before the job was confirmed; recv MB: uploaded to the board, speculative uploads included")
+
+
+def print_thumbnails(results):
+    print("{:<40} {:>6} {:>8} {:>10} {:>10} {:>10} {:>10} {:>9}".format("thumbnail sizes", "once", "renders", "render ms", "encode ms", "total ms", "cached ms", "block KB"))
+    for r in results:
+        print("{:<40} {:>6} {:>8} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.2f} {:>9.1f}".format(
+            r["sizes"], "yes" if r["render_once"] else "no", r["renders"], r["render"] * 1000, r["encode"] * 1000, r["total"] * 1000, r["cached"] * 1000, r["block_size"] / 1024))
+    print("rendering is a QPainter stand-in for Snapshot.snapshot, only the encode column reflects the plugin")
+    print("cached: the same scene again, served from the thumbnail cache")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="1,10,100", help="comma separated gcode sizes in MB, up to 500")
+    parser.add_argument("--flavours", default="rrf,dsf")
+    parser.add_argument("--modes", default="print,simulate", help="comma separated: print, simulate, upload, resend")
+    parser.add_argument("--thumbnail-cache", action="store_true", help="keep thumbnails of the unchanged scene between jobs, like re-slicing with other print settings")
+    parser.add_argument("--precompute-thumbnails", action="store_true", help="render the thumbnails before confirming each job")
+    parser.add_argument("--speculative", action="store_true", help="upload every print and simulate job speculatively before confirming it")
+    parser.add_argument("--reslice-after", type=float, help="with --speculative, re-slice this many s into the speculative upload and confirm the new slice")
+    parser.add_argument("--same-slice", action="store_true", help="send the same slice in all modes, instead of a new one per job")
+    parser.add_argument("--thumbnails", default="48x48,240x240,320x320", help="thumbnail sizes embedded into each job")
+    parser.add_argument("--thumbnail-sets", default=";".join(THUMBNAIL_SETS), help="semicolon separated thumbnail size lists for the thumbnail table")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions of each thumbnail measurement, the best is reported")
+    parser.add_argument("--latency", type=float, default=2.0, help="added by the mock board to every request, in ms")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="upload bandwidth cap of the mock board in KiB/s, 0 for unlimited")
+    parser.add_argument("--simulation-time", type=float, default=3.0, help="duration of a simulated M37 job, in s")
+    parser.add_argument("--timeout", type=int, default=900, help="per job, in s")
+    parser.add_argument("--no-memory", action="store_true", help="don't trace Python allocations, tracemalloc slows down the pipeline")
+    parser.add_argument("--verbose", action="store_true", help="print the plugin's log messages")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    args.thumbnail_sets = [s for s in args.thumbnail_sets.split(";") if s]
+
+    app = QGuiApplication(sys.argv[:1])
+    uranium_stubs.Logger.verbose = args.verbose
+    application = uranium_stubs.install()
+    plugin = load_plugin()
+    plugin.settings.init_settings()
+    if "resend" in args.modes.split(","):
+        # the archive is off by default, resend needs the earlier jobs archived
+        application.getPreferences().setValue(plugin.settings.DUETRRF_ARCHIVE_SIZE, 1024)
+
+    measure_memory = not args.no_memory
+    if measure_memory:
+        tracemalloc.start()
+
+    jobs = []
+    for flavour in args.flavours.split(","):
+        for megabytes in [float(s) for s in args.sizes.split(",")]:
+            gcode_list = synthetic_gcode(megabytes) if args.same_slice else None
+            for mode in args.modes.split(","):
+                jobs.append(run_job(plugin, application, args, flavour, mode, megabytes, measure_memory, gcode_list))
+                gc.collect()
+    print_jobs(jobs)
+    print()
+
+    if measure_memory:
+        tracemalloc.stop()
+    thumbnails = run_thumbnails(plugin, args)
+    print_thumbnails(thumbnails)
+    print()
+    print("max RSS: {:.0f} MB".format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"jobs": jobs, "thumbnails": thumbnails}, f, indent=2)
+
+    plugin.thumbnails._get_encoder_pool().shutdown()
+    del app
+    if not all(job["success"] for job in jobs):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
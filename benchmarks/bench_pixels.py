@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Compare per-pixel QImage.pixel() extraction with reading the raw ARGB32 buffer.
+
+Usage: python3 benchmarks/bench_pixels.py [repeat]
+
+Requires PyQt6 (or PyQt5), as shipped with Cura. Both methods must yield the
+same signed 0xAARRGGBB values that are fed into the QOI encoder, also for
+semi-transparent images in the premultiplied formats Snapshot renders to.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try: # Cura 5
+    from PyQt6.QtGui import QImage, QColor
+except: # Cura 4
+    from PyQt5.QtGui import QImage, QColor
+
+from qimage_pixels import argb32_pixels
+
+SIZES = [(320, 320), (480, 480), (800, 800), (1024, 1024)]
+
+
+FORMATS = [
+    QImage.Format.Format_ARGB32,
+    QImage.Format.Format_ARGB32_Premultiplied,
+    QImage.Format.Format_RGBA8888_Premultiplied,
+    QImage.Format.Format_RGB32,
+]
+
+
+def synthetic_image(width, height):
+    image = QImage(width, height, QImage.Format.Format_ARGB32)
+    image.fill(QColor(0, 0, 0, 0))
+    for y in range(height // 4, height * 3 // 4):
+        for x in range(width // 4, width * 3 // 4):
+            # semi-transparent towards the edges, so premultiplication changes the values
+            alpha = 0xff - (x * 0xc0 // width)
+            image.setPixel(x, y, (alpha << 24) | ((x * 255 // width) << 16) | ((y * 255 // height) << 8) | 0x40)
+    return image
+
+
+def per_pixel(image):
+    # the previous implementation in thumbnails.encode_as_qoi
+    pixels = [image.pixel(x, y) for y in range(image.height()) for x in range(image.width())]
+    return [(unsigned_p ^ (1 << 31)) - (1 << 31) for unsigned_p in pixels]
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print(f"{'size':>11} {'pixel() ms':>11} {'buffer ms':>10} {'speedup':>8}")
+    for width, height in SIZES:
+        image = synthetic_image(width, height)
+        t_old, old = timed(lambda: per_pixel(image), repeat)
+        t_new, new = timed(lambda: argb32_pixels(image), repeat)
+        if old != new.tolist():
+            raise SystemExit(f"pixel mismatch for {width}x{height}")
+        for image_format in FORMATS:
+            converted = image.convertToFormat(image_format)
+            if per_pixel(converted) != argb32_pixels(converted).tolist():
+                raise SystemExit(f"pixel mismatch for {width}x{height} in {image_format.name}")
+        print(f"{width:>5}x{height:<5} {t_old * 1000:>11.2f} {t_new * 1000:>10.3f} {t_old / t_new:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Compare the transpiled pure-Python QOIEncoder with the NumPy-vectorized one.
+
+Usage: python3 benchmarks/bench_qoi.py [repeat]
+
+Both encoders are fed the same synthetic thumbnail-like images (flat background,
+gradients and noise) in the default and some larger sizes. The output of both
+encoders is checked to be byte-identical.
+"""
+
+import array
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qoi import QOIEncoder
+from qoi_numpy import NumpyQOIEncoder
+
+SIZES = [(48, 48), (240, 240), (320, 320), (480, 480), (800, 800)]
+
+
+def synthetic_thumbnail(width, height, seed=42):
+    # transparent background with a shaded "model" in the center, similar to a rendered snapshot
+    rnd = random.Random(seed)
+    pixels = array.array("i", [0]) * (width * height)
+    for y in range(height // 4, height * 3 // 4):
+        for x in range(width // 4, width * 3 // 4):
+            shade = (x * 255 // width + y * 64 // height + rnd.randint(0, 3)) & 255
+            p = 0xff000000 | (shade << 16) | ((shade // 2) << 8) | 0x40
+            pixels[y * width + x] = (p ^ (1 << 31)) - (1 << 31)
+    return pixels
+
+
+def encode(encoder_class, width, height, pixels):
+    encoder = encoder_class()
+    assert encoder.encode(width, height, pixels, True, False)
+    return bytes(encoder.get_encoded()[:encoder.get_encoded_size()])
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print(f"{'size':>9} {'python ms':>10} {'numpy ms':>10} {'speedup':>8} {'bytes':>8}")
+    for width, height in SIZES:
+        pixels = synthetic_thumbnail(width, height)
+        t_py, ref = timed(lambda: encode(QOIEncoder, width, height, pixels), repeat)
+        t_np, vec = timed(lambda: encode(NumpyQOIEncoder, width, height, pixels), repeat)
+        if ref != vec:
+            raise SystemExit(f"output mismatch for {width}x{height}")
+        print(f"{width:>4}x{height:<4} {t_py * 1000:>10.2f} {t_np * 1000:>10.2f} {t_py / t_np:>7.1f}x {len(ref):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+"""A local stand-in for a Duet board, to exercise the plugin without a printer.
+
+Usage: python3 benchmarks/mock_duet.py [--flavour rrf|dsf] [--port 8080] [options]
+
+Then configure a printer in Cura with the URL http://127.0.0.1:8080/.
+
+Two flavours are served:
+
+* rrf: a standalone board with the RepRapFirmware HTTP API (rr_connect,
+  rr_upload with crc32 check, rr_gcode, rr_reply, rr_status, rr_model,
+  rr_fileinfo, rr_move, rr_delete, rr_disconnect). Sessions are limited and expire like on a
+  real board, requests without a session are answered with 401.
+* dsf: a Duet3 with SBC running DuetSoftwareFramework (machine/status,
+  machine/code, machine/file, machine/file/move, machine/fileinfo). rr_* requests are answered
+  with 404, like DSF without the RRF compatibility layer. The /machine
+  WebSocket is not served, so the plugin falls back to HTTP polling.
+
+M37 P"file" runs a simulated simulation for --simulation-time seconds, with
+the job's file position advancing linearly. A latency can be added to every
+request and upload bodies can be read at a capped bandwidth, so throughput
+and round-trips can be measured reproducibly.
+
+Request counters, uploaded bytes and upload throughput are served as JSON on
+/mock/stats and printed on exit. The server can also be started from Python,
+see MockDuet.
+"""
+
+import argparse
+import datetime
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class MockDuetState:
+    """The board: sessions, stored files, the simulated job and the request statistics."""
+
+    def __init__(self, flavour="rrf", password="", latency=0.0, bandwidth=0, max_sessions=8,
+                 session_timeout=8000, simulation_time=5.0, firmware_version=None):
+        self.flavour = flavour
+        self.password = password
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.max_sessions = max_sessions
+        self.session_timeout = session_timeout
+        self.simulation_time = simulation_time
+        self.firmware_version = firmware_version or ("3.5.1" if flavour == "dsf" else "3.4.6")
+
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.files = {}
+        self.job = None
+        self.last_reply = ""
+        self.seq = 0
+
+        self.requests = Counter()
+        self.bytes_received = 0
+        self.upload_seconds = 0.0
+        self.uploads = 0
+        self.crc_errors = 0
+        self.rejected_sessions = 0
+        self.unauthorized = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "flavour": self.flavour,
+                "requests": dict(self.requests),
+                "total_requests": sum(self.requests.values()),
+                "uploads": self.uploads,
+                "bytes_received": self.bytes_received,
+                "upload_throughput": self.bytes_received / self.upload_seconds if self.upload_seconds else 0.0,
+                "crc_errors": self.crc_errors,
+                "sessions": len(self.sessions),
+                "rejected_sessions": self.rejected_sessions,
+                "unauthorized": self.unauthorized,
+                "files": {name: f["size"] for name, f in self.files.items()},
+            }
+
+    # sessions
+
+    def _expire_sessions(self, now):
+        timeout = self.session_timeout / 1000
+        for key, last_seen in list(self.sessions.items()):
+            if now - last_seen > timeout:
+                del self.sessions[key]
+
+    def connect(self, password):
+        with self.lock:
+            now = time.monotonic()
+            self._expire_sessions(now)
+            if self.password and password != self.password:
+                return {"err": 1}
+            if len(self.sessions) >= self.max_sessions:
+                self.rejected_sessions += 1
+                return {"err": 2}
+            key = random.randint(1, 2 ** 31 - 1)
+            self.sessions[key] = now
+            return {
+                "err": 0,
+                "sessionTimeout": self.session_timeout,
+                "boardType": "duetwifi102",
+                "apiLevel": 1,
+                "sessionKey": key,
+            }
+
+    def touch_session(self, key) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self._expire_sessions(now)
+            if key is None or key not in self.sessions:
+                self.unauthorized += 1
+                return False
+            self.sessions[key] = now
+            return True
+
+    def disconnect(self, key):
+        with self.lock:
+            self.sessions.pop(key, None)
+
+    # files
+
+    def store(self, name, size, crc32, timestamp=None):
+        with self.lock:
+            self.files[name] = {
+                "size": size,
+                "crc32": crc32,
+                "lastModified": timestamp or datetime.datetime.now().strftime(TIME_FORMAT),
+            }
+
+    def move(self, old, new, overwrite):
+        with self.lock:
+            if old not in self.files or (new in self.files and not overwrite):
+                return False
+            self.files[new] = self.files.pop(old)
+            return True
+
+    def delete(self, name):
+        with self.lock:
+            return self.files.pop(name, None) is not None
+
+    def fileinfo(self, name):
+        with self.lock:
+            f = self.files.get(name)
+            if f is None:
+                return None
+            return {"fileName": "0:/" + name, "size": f["size"], "lastModified": f["lastModified"]}
+
+    # job and simulation
+
+    def _job_progress(self, now):
+        job = self.job
+        if job is None:
+            return None
+        fraction = min(1.0, (now - job["started"]) / job["duration"]) if job["duration"] > 0 else 1.0
+        if fraction >= 1.0:
+            if job["simulating"]:
+                self.last_reply = "Simulated print time was {:.0f}s, estimated print time was {:.0f}s".format(
+                    job["duration"], job["duration"] * 1.1)
+            self.job = None
+            self.seq += 1
+            return None
+        return fraction
+
+    def run_gcode(self, gcode) -> str:
+        gcode = gcode.strip()
+        with self.lock:
+            match = re.match(r'^M3([27])\s+P?"?0?:?/?([^"]*)"?', gcode)
+            if match:
+                name = match.group(2)
+                if not name.startswith("gcodes/"):
+                    name = "gcodes/" + name
+                f = self.files.get(name)
+                if f is None:
+                    self.last_reply = "Error: file {} not found".format(name)
+                    return self.last_reply
+                self.job = {
+                    "file": name,
+                    "size": f["size"],
+                    "started": time.monotonic(),
+                    "duration": self.simulation_time,
+                    "simulating": match.group(1) == "7",
+                }
+                self.seq += 1
+                self.last_reply = ""
+                return ""
+            if gcode == "M37":
+                # report the result of the last simulation
+                self._job_progress(time.monotonic())
+                return self.last_reply
+            self.last_reply = ""
+            return ""
+
+    def state(self) -> dict:
+        with self.lock:
+            fraction = self._job_progress(time.monotonic())
+            if fraction is None:
+                status = "idle"
+                job = {"file": {"fileName": None, "size": None}, "filePosition": None}
+            else:
+                status = "simulating" if self.job["simulating"] else "processing"
+                job = {
+                    "file": {"fileName": "0:/" + self.job["file"], "size": self.job["size"]},
+                    "filePosition": int(self.job["size"] * fraction),
+                }
+            return {
+                "boards": [{"firmwareName": "RepRapFirmware", "firmwareVersion": self.firmware_version, "shortName": "2WiFi"}],
+                "state": {"status": status},
+                "job": job,
+                "seqs": {"state": self.seq, "job": self.seq, "reply": self.seq},
+                "fraction": fraction,
+            }
+
+
+class MockDuetHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockDuet/1.0"
+
+    @property
+    def board(self) -> MockDuetState:
+        return self.server.board
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    # helpers
+
+    def _reply(self, code, body=b"", content_type="application/json"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        elif isinstance(body, str):
+            body = body.encode()
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _consume_body(self, on_data):
+        """Reads the request body at the capped bandwidth, returns its length or None without a Content-Length."""
+        length = self.headers.get("Content-Length")
+        if length is None:
+            return None
+        remaining = int(length)
+        start = time.monotonic()
+        received = 0
+        while remaining > 0:
+            data = self.rfile.read(min(65536, remaining))
+            if not data:
+                break
+            on_data(data)
+            remaining -= len(data)
+            received += len(data)
+            if self.board.bandwidth:
+                # sleep until the capped rate catches up with what was received
+                ahead = received / self.board.bandwidth - (time.monotonic() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+        elapsed = time.monotonic() - start
+        with self.board.lock:
+            self.board.bytes_received += received
+            self.board.upload_seconds += elapsed
+        return received
+
+    def _read_body(self):
+        chunks = []
+        if self._consume_body(chunks.append) is None:
+            return None
+        return b"".join(chunks)
+
+    def _receive_file(self):
+        """Returns size and CRC32 of an uploaded file, or None without a Content-Length.
+
+        Uploads are only checksummed, not kept, so big benchmark jobs don't fill up the memory.
+        """
+        crc = 0
+        def update(data):
+            nonlocal crc
+            crc = zlib.crc32(data, crc)
+        size = self._consume_body(update)
+        return None if size is None else (size, crc)
+
+    def _session_key(self):
+        key = self.headers.get("X-Session-Key")
+        try:
+            return int(key) if key is not None else self.server.client_sessions.get(self.client_address[0])
+        except ValueError:
+            return None
+
+    def _dispatch(self, method):
+        url = urllib.parse.urlsplit(self.path)
+        path = urllib.parse.unquote(url.path).lstrip("/")
+        query = dict(urllib.parse.parse_qsl(url.query))
+        command = path.split("/")[0] if not path.startswith("machine/") else "/".join(path.split("/")[:2])
+
+        with self.board.lock:
+            self.board.requests["{} {}".format(method, command or "/")] += 1
+        if self.board.latency:
+            time.sleep(self.board.latency)
+
+        if path == "mock/stats":
+            self._reply(200, self.board.stats())
+            return
+
+        if path.startswith("rr_"):
+            if self.board.flavour != "rrf":
+                self._read_body()
+                self._reply(404, "Not found", "text/plain")
+                return
+            self._handle_rrf(method, path, query)
+        elif path.startswith("machine/"):
+            if self.board.flavour != "dsf":
+                self._read_body()
+                self._reply(404, "Not found", "text/plain")
+                return
+            self._handle_dsf(method, path)
+        else:
+            self._read_body()
+            self._reply(404, "Not found", "text/plain")
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    # RepRapFirmware HTTP API
+
+    def _handle_rrf(self, method, path, query):
+        board = self.board
+
+        if path == "rr_connect":
+            response = board.connect(query.get("password", ""))
+            if response["err"] == 0:
+                self.server.client_sessions[self.client_address[0]] = response["sessionKey"]
+            self._reply(200, response)
+            return
+
+        key = self._session_key()
+        if not board.touch_session(key):
+            self._read_body()
+            self._reply(401, "Unauthorized", "text/plain")
+            return
+
+        if path == "rr_disconnect":
+            board.disconnect(key)
+            self.server.client_sessions.pop(self.client_address[0], None)
+            self._reply(200, {"err": 0})
+        elif path == "rr_upload":
+            received = self._receive_file()
+            if received is None:
+                # RRF needs to know the length of the upload up front
+                self._reply(200, {"err": 1})
+                return
+            size, crc = received
+            name = query.get("name", "").replace("0:/", "", 1)
+            expected = query.get("crc32")
+            if expected is not None and int(expected, 16) != crc:
+                with board.lock:
+                    board.crc_errors += 1
+                self._reply(200, {"err": 1})
+                return
+            board.store(name, size, crc, query.get("time"))
+            with board.lock:
+                board.uploads += 1
+            self._reply(200, {"err": 0})
+        elif path == "rr_gcode":
+            board.run_gcode(query.get("gcode", ""))
+            self._reply(200, {"buff": 255})
+        elif path == "rr_reply":
+            with board.lock:
+                reply, board.last_reply = board.last_reply, ""
+            self._reply(200, reply, "text/plain")
+        elif path == "rr_fileinfo":
+            info = board.fileinfo(query.get("name", "").replace("0:/", "", 1))
+            self._reply(200, dict(info, err=0) if info else {"err": 1})
+        elif path == "rr_move":
+            moved = board.move(
+                query.get("old", "").replace("0:/", "", 1),
+                query.get("new", "").replace("0:/", "", 1),
+                query.get("deleteexisting") == "yes",
+            )
+            self._reply(200, {"err": 0 if moved else 1})
+        elif path == "rr_delete":
+            deleted = board.delete(query.get("name", "").replace("0:/", "", 1))
+            self._reply(200, {"err": 0 if deleted else 1})
+        elif path == "rr_status":
+            state = board.state()
+            status = {"idle": "I", "simulating": "M", "processing": "P"}[state["state"]["status"]]
+            response = {"status": status, "seq": state["seqs"]["reply"]}
+            if query.get("type") == "2":
+                response["firmwareVersion"] = board.firmware_version
+            if query.get("type") == "3":
+                response["fractionPrinted"] = round((state["fraction"] or 0.0) * 100, 1)
+            self._reply(200, response)
+        elif path == "rr_model":
+            state = board.state()
+            key = query.get("key", "")
+            result = {k: v for k, v in state.items() if k != "fraction"}
+            for part in key.split(".") if key else []:
+                result = result.get(part) if isinstance(result, dict) else None
+            self._reply(200, {"key": key, "flags": query.get("flags", ""), "result": result})
+        else:
+            self._read_body()
+            self._reply(404, "Not found", "text/plain")
+
+    # DuetSoftwareFramework HTTP API
+
+    def _handle_dsf(self, method, path):
+        board = self.board
+
+        if path == "machine/status" and method == "GET":
+            state = board.state()
+            del state["fraction"]
+            self._reply(200, state)
+        elif path == "machine/code" and method == "POST":
+            data = self._read_body() or b""
+            self._reply(200, board.run_gcode(data.decode()), "text/plain")
+        elif path == "machine/file/move" and method == "POST":
+            form = dict(urllib.parse.parse_qsl((self._read_body() or b"").decode()))
+            moved = board.move(
+                form.get("from", "").replace("0:/", "", 1),
+                form.get("to", "").replace("0:/", "", 1),
+                form.get("force") == "true",
+            )
+            self._reply(204 if moved else 500, b"" if moved else "Move failed", "text/plain")
+        elif path.startswith("machine/file/") and method == "DELETE":
+            if board.delete(path[len("machine/file/"):]):
+                self._reply(204, b"", "text/plain")
+            else:
+                self._reply(404, "Not found", "text/plain")
+        elif path.startswith("machine/file/") and method == "PUT":
+            received = self._receive_file()
+            if received is None:
+                self._reply(411, "Length Required", "text/plain")
+                return
+            board.store(path[len("machine/file/"):], *received)
+            with board.lock:
+                board.uploads += 1
+            self._reply(201)
+        elif path.startswith("machine/fileinfo/") and method == "GET":
+            info = board.fileinfo(path[len("machine/fileinfo/"):])
+            if info is None:
+                self._reply(404, "Not found", "text/plain")
+            else:
+                self._reply(200, info)
+        else:
+            self._read_body()
+            self._reply(404, "Not found", "text/plain")
+
+
+class MockDuetServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients dropping keep-alive connections are not worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockDuet:
+    """Runs a mock board on a background thread, e.g. for benchmarks.
+
+        with MockDuet(flavour="dsf", latency=0.005) as duet:
+            url = duet.url
+            ...
+            print(duet.board.stats())
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, verbose=False, **options):
+        self.board = MockDuetState(**options)
+        self._server = MockDuetServer((host, port), MockDuetHandler)
+        self._server.board = self.board
+        self._server.verbose = verbose
+        self._server.client_sessions = {}
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}/".format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for a Duet board running RepRapFirmware or DuetSoftwareFramework.")
+    parser.add_argument("--flavour", choices=["rrf", "dsf"], default="rrf")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--password", default="", help="password expected by rr_connect")
+    parser.add_argument("--latency", type=float, default=0.0, help="added to every request, in ms")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="upload bandwidth cap in KiB/s, 0 for unlimited")
+    parser.add_argument("--max-sessions", type=int, default=8)
+    parser.add_argument("--session-timeout", type=int, default=8000, help="in ms")
+    parser.add_argument("--simulation-time", type=float, default=5.0, help="duration of a simulated M37 or M32 job, in s")
+    parser.add_argument("--firmware-version", default=None)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    duet = MockDuet(
+        host=args.host,
+        port=args.port,
+        verbose=args.verbose,
+        flavour=args.flavour,
+        password=args.password,
+        latency=args.latency / 1000,
+        bandwidth=args.bandwidth * 1024,
+        max_sessions=args.max_sessions,
+        session_timeout=args.session_timeout,
+        simulation_time=args.simulation_time,
+        firmware_version=args.firmware_version,
+    )
+    print("Mock {} board listening on {}".format(args.flavour.upper(), duet.url))
+    try:
+        duet._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        duet._server.server_close()
+        print(json.dumps(duet.board.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
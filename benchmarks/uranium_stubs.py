@@ -0,0 +1,556 @@
+"""Minimal stand-ins for the Uranium (UM) and Cura (cura) modules used by the plugin.
+
+Only meant for benchmarks/bench_pipeline.py: the plugin modules are imported
+as they are, against these stubs, and run on a real Qt event loop with real
+network requests. The stubs mimic the behaviour the plugin relies on:
+
+* UM.Signal: bound methods are held weakly, signals emitted from a worker
+  thread are delivered on the Qt thread, like Signal.Auto in Uranium.
+* UM.Job: start() runs the job on a worker thread, `finished` is emitted
+  afterwards.
+* HttpRequestManager: a QNetworkAccessManager with the callback and
+  error_callback semantics of UM.TaskManagement.HttpRequestManager.
+* GCodeWriter: writes the scene's gcode_list chunk by chunk, followed by a
+  settings block, like Cura's GCodeWriter.
+
+Call `install()` before importing any plugin module.
+"""
+
+import json
+import sys
+import tempfile
+import threading
+import time
+import types
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from PyQt6.QtCore import QObject, QUrl, pyqtSignal
+from PyQt6.QtGui import QColor, QImage, QLinearGradient, QPainter
+from PyQt6.QtNetwork import QNetworkAccessManager, QNetworkReply, QNetworkRequest
+
+
+class Logger:
+    verbose = False
+
+    @classmethod
+    def log(cls, level, message, *args):
+        if cls.verbose:
+            print("[{}] {}".format(level, message))
+
+    @classmethod
+    def logException(cls, level, message, *args):
+        cls.log(level, message)
+
+
+class _Dispatcher(QObject):
+    """Moves calls from worker threads to the Qt thread through a queued signal."""
+
+    call = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.call.connect(self._onCall)
+
+    def _onCall(self, function):
+        function()
+
+
+_dispatcher = None
+
+
+def call_later(function, *args, **kwargs):
+    _dispatcher.call.emit(lambda: function(*args, **kwargs))
+
+
+class Signal:
+    def __init__(self, *args, **kwargs):
+        self._receivers = []
+
+    def connect(self, receiver):
+        if hasattr(receiver, "__self__") and hasattr(receiver, "__func__"):
+            ref = weakref.WeakMethod(receiver)
+        else:
+            ref = weakref.ref(receiver)
+        self._receivers.append(ref)
+
+    def disconnect(self, receiver):
+        self._receivers = [ref for ref in self._receivers if ref() is not None and ref() != receiver]
+
+    def emit(self, *args):
+        if threading.current_thread() is not threading.main_thread():
+            call_later(self._emit, *args)
+        else:
+            self._emit(*args)
+
+    def _emit(self, *args):
+        for ref in list(self._receivers):
+            receiver = ref()
+            if receiver is not None:
+                receiver(*args)
+
+
+_job_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="JobQueueWorker")
+
+
+class Job:
+    def __init__(self):
+        self._result = None
+        self._error = None
+        self._running = False
+        self._finished = False
+        self.finished = Signal()
+        self.progress = Signal()
+
+    def run(self):
+        raise NotImplementedError()
+
+    def start(self):
+        _job_pool.submit(self._execute)
+
+    def _execute(self):
+        self._running = True
+        try:
+            self.run()
+        except Exception as e:
+            self._error = e
+            Logger.log("e", "Job {} failed: {}".format(type(self).__name__, e))
+        self._running = False
+        self._finished = True
+        self.finished.emit(self)
+
+    def cancel(self):
+        pass
+
+    def setResult(self, result):
+        self._result = result
+
+    def getResult(self):
+        return self._result
+
+    def isRunning(self):
+        return self._running
+
+    def isFinished(self):
+        return self._finished
+
+    def hasError(self):
+        return self._error is not None
+
+    def getError(self):
+        return self._error
+
+
+class Message:
+    def __init__(self, text="", lifetime=30, dismissable=True, progress=None, title="", **kwargs):
+        self._text = text
+        self._title = title
+        self._progress = progress
+        self._visible = False
+        self._actions = []
+        self.actionTriggered = Signal()
+
+    def show(self):
+        self._visible = True
+
+    def hide(self, send_signal=True):
+        self._visible = False
+
+    def setText(self, text):
+        self._text = text
+
+    def getText(self):
+        return self._text
+
+    def setProgress(self, progress):
+        self._progress = progress
+
+    def getProgress(self):
+        return self._progress
+
+    def addAction(self, action_id, name, icon, description, **kwargs):
+        self._actions.append(action_id)
+
+
+class OutputDevice:
+    def __init__(self, device_id, **kwargs):
+        self._id = device_id
+        self._name = "Unknown Device"
+        self._short_description = ""
+        self._description = ""
+        self._priority = 0
+        self.writeStarted = Signal()
+        self.writeProgress = Signal()
+        self.writeFinished = Signal()
+        self.writeError = Signal()
+        self.writeSuccess = Signal()
+
+    def getId(self):
+        return self._id
+
+    def setShortDescription(self, description):
+        self._short_description = description
+
+    def setDescription(self, description):
+        self._description = description
+
+    def setPriority(self, priority):
+        self._priority = priority
+
+    def setIconName(self, name):
+        pass
+
+
+class Resources:
+    _cache = None
+
+    @classmethod
+    def getCacheStoragePath(cls):
+        # a fresh directory per benchmark run, like an empty Cura cache
+        if cls._cache is None:
+            cls._cache = tempfile.TemporaryDirectory(prefix="duetrrf-benchmark-")
+        return cls._cache.name
+
+
+class i18nCatalog:
+    def __init__(self, name=None):
+        pass
+
+    def i18nc(self, context, text, *args):
+        return text
+
+
+class MeshWriter:
+    class OutputMode:
+        TextMode = 1
+        BinaryMode = 2
+
+
+class GCodeWriter(MeshWriter):
+    """Writes the gcode_list of the active build plate like Cura's GCodeWriter."""
+
+    _setting_keyword = ";SETTING_"
+
+    def write(self, stream, nodes, mode=MeshWriter.OutputMode.TextMode):
+        application = CuraApplication.getInstance()
+        scene = application.getController().getScene()
+        gcode_list = getattr(scene, "gcode_dict", {}).get(application.getMultiBuildPlateModel().activeBuildPlate)
+        if gcode_list is None:
+            return False
+        has_settings = False
+        for gcode in gcode_list:
+            if gcode[:len(self._setting_keyword)] == self._setting_keyword:
+                has_settings = True
+            stream.write(gcode)
+        if not has_settings:
+            stream.write(";SETTING_3 {\"global_quality\": \"[general]\\nversion = 4\\nname = Benchmark\\n\"}\n")
+        return True
+
+
+class PluginRegistry:
+    _instance = None
+
+    def __init__(self):
+        self._plugins = {"GCodeWriter": GCodeWriter()}
+
+    @classmethod
+    def getInstance(cls):
+        if cls._instance is None:
+            cls._instance = PluginRegistry()
+        return cls._instance
+
+    def getPluginObject(self, plugin_id):
+        return self._plugins[plugin_id]
+
+
+class HttpRequestManager:
+    """Sends requests with a QNetworkAccessManager and counts them."""
+
+    def __init__(self):
+        self._manager = QNetworkAccessManager()
+        self._replies = set()
+        self.requests = 0
+
+    def get(self, url, headers_dict=None, callback=None, error_callback=None, download_progress_callback=None, upload_progress_callback=None, timeout=None, scope=None):
+        return self._request("GET", url, headers_dict, None, callback, error_callback, upload_progress_callback)
+
+    def post(self, url, headers_dict=None, data=None, callback=None, error_callback=None, download_progress_callback=None, upload_progress_callback=None, timeout=None, scope=None):
+        return self._request("POST", url, headers_dict, data, callback, error_callback, upload_progress_callback)
+
+    def put(self, url, headers_dict=None, data=None, callback=None, error_callback=None, download_progress_callback=None, upload_progress_callback=None, timeout=None, scope=None):
+        return self._request("PUT", url, headers_dict, data, callback, error_callback, upload_progress_callback)
+
+    def delete(self, url, headers_dict=None, callback=None, error_callback=None, download_progress_callback=None, timeout=None, scope=None):
+        return self._request("DELETE", url, headers_dict, None, callback, error_callback, None)
+
+    def _request(self, method, url, headers, data, callback, error_callback, upload_progress_callback):
+        self.requests += 1
+        request = QNetworkRequest(QUrl(url))
+        for name, value in (headers or {}).items():
+            request.setRawHeader(name.encode(), value.encode())
+
+        if method == "GET":
+            reply = self._manager.get(request)
+        elif method == "DELETE":
+            reply = self._manager.deleteResource(request)
+        elif method == "POST":
+            reply = self._manager.post(request, data if data is not None else b"")
+        else:
+            reply = self._manager.put(request, data if data is not None else b"")
+        self._replies.add(reply)
+
+        def finished():
+            self._replies.discard(reply)
+            if reply.error() == QNetworkReply.NetworkError.NoError:
+                if callback is not None:
+                    callback(reply)
+            elif error_callback is not None:
+                error_callback(reply, reply.error())
+            reply.deleteLater()
+
+        # the closures are kept alive by the Qt connection, like in Uranium
+        reply.finished.connect(finished)
+        if upload_progress_callback is not None:
+            reply.uploadProgress.connect(upload_progress_callback)
+        return reply
+
+    def abortRequest(self, reply):
+        if reply in self._replies:
+            reply.abort()
+
+
+class Preferences:
+    def __init__(self):
+        self._values = {}
+        self.preferenceChanged = Signal()
+
+    def addPreference(self, key, default_value):
+        self._values.setdefault(key, default_value)
+
+    def getValue(self, key):
+        return self._values.get(key)
+
+    def setValue(self, key, value):
+        if self._values.get(key) != value:
+            self._values[key] = value
+            self.preferenceChanged.emit(key)
+
+
+class Material:
+    def __init__(self, color_code):
+        self._metadata = {"color_code": color_code}
+
+    def getMetaDataEntry(self, key, default=None):
+        return self._metadata.get(key, default)
+
+
+class ExtruderStack:
+    def __init__(self, color_code):
+        self.material = Material(color_code)
+
+
+class GlobalStack:
+    def __init__(self, stack_id, name):
+        self._id = stack_id
+        self._name = name
+        self.extruderList = [ExtruderStack("#ffc924")]
+
+    def getId(self):
+        return self._id
+
+    def getName(self):
+        return self._name
+
+
+class MeshData:
+    def __init__(self, vertex_count):
+        self._vertex_count = vertex_count
+
+    def getVertexCount(self):
+        return self._vertex_count
+
+
+class Matrix:
+    def __init__(self, data):
+        self._data = data
+
+    def getData(self):
+        return self._data
+
+
+class SceneNode:
+    def __init__(self, mesh_data=None, position=(0.0, 0.0, 0.0)):
+        self._mesh_data = mesh_data
+        self._transformation = numpy.identity(4)
+        self._transformation[:3, 3] = position
+        self._children = []
+
+    def addChild(self, node):
+        self._children.append(node)
+
+    def getChildren(self):
+        return self._children
+
+    def getMeshData(self):
+        return self._mesh_data
+
+    def getWorldTransformation(self):
+        return Matrix(self._transformation)
+
+    def isVisible(self):
+        return True
+
+    def callDecoration(self, name, *args):
+        if self._mesh_data is None:
+            return None
+        return {"isSliceable": True, "getActiveExtruderPosition": "0"}.get(name)
+
+
+class DepthFirstIterator:
+    def __init__(self, node):
+        self._node = node
+
+    def __iter__(self):
+        stack = [self._node]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.getChildren()))
+
+
+class Scene:
+    def __init__(self):
+        self.gcode_dict = {}
+        self._root = SceneNode()
+        self._root.addChild(SceneNode(MeshData(36000), position=(10.0, 0.0, 20.0)))
+
+    def getRoot(self):
+        return self._root
+
+
+class Controller:
+    def __init__(self):
+        self._scene = Scene()
+
+    def getScene(self):
+        return self._scene
+
+
+class MultiBuildPlateModel:
+    activeBuildPlate = 0
+
+
+class PrintInformation:
+    jobName = "benchmark"
+
+
+class CuraApplication:
+    _instance = None
+
+    def __init__(self):
+        self._http = HttpRequestManager()
+        self._preferences = Preferences()
+        self._controller = Controller()
+        self._build_plates = MultiBuildPlateModel()
+        self._print_information = PrintInformation()
+        self._global_stack = GlobalStack("benchmark_printer", "Benchmark Printer")
+        self.globalContainerStackChanged = Signal()
+
+    @classmethod
+    def getInstance(cls):
+        return cls._instance
+
+    def getHttpRequestManager(self):
+        return self._http
+
+    def getPreferences(self):
+        return self._preferences
+
+    def getController(self):
+        return self._controller
+
+    def getMultiBuildPlateModel(self):
+        return self._build_plates
+
+    def getPrintInformation(self):
+        return self._print_information
+
+    def getGlobalContainerStack(self):
+        return self._global_stack
+
+    def callLater(self, function, *args, **kwargs):
+        call_later(function, *args, **kwargs)
+
+
+def call_on_qt_thread(function):
+    def wrapper(*args, **kwargs):
+        return function(*args, **kwargs)
+    return wrapper
+
+
+class Snapshot:
+    """Draws a synthetic model instead of rendering the scene with OpenGL."""
+
+    render_seconds = 0.0
+    renders = 0
+
+    @staticmethod
+    def snapshot(width=300, height=300):
+        start = time.perf_counter()
+        image = QImage(width, height, QImage.Format.Format_ARGB32)
+        image.fill(QColor(0, 0, 0, 0))
+        painter = QPainter(image)
+        gradient = QLinearGradient(0, 0, width, height)
+        gradient.setColorAt(0, QColor(40, 120, 220))
+        gradient.setColorAt(1, QColor(250, 180, 40))
+        painter.setBrush(gradient)
+        painter.drawEllipse(width // 6, height // 6, width * 2 // 3, height * 2 // 3)
+        painter.drawRect(width // 3, height // 8, width // 3, height * 3 // 4)
+        painter.end()
+        Snapshot.render_seconds += time.perf_counter() - start
+        Snapshot.renders += 1
+        return image
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def install(printer_config=None):
+    """Registers the stub modules and creates the application, returns it."""
+    global _dispatcher
+    _dispatcher = _Dispatcher()
+
+    for package in ["UM", "UM.Mesh", "UM.OutputDevice", "UM.Scene", "UM.Scene.Iterator", "cura", "cura.Utils"]:
+        _module(package).__path__ = []
+    _module("UM.Logger", Logger=Logger)
+    _module("UM.Signal", Signal=Signal)
+    _module("UM.Job", Job=Job)
+    _module("UM.Message", Message=Message)
+    _module("UM.Mesh.MeshWriter", MeshWriter=MeshWriter)
+    _module("UM.PluginRegistry", PluginRegistry=PluginRegistry)
+    _module("UM.OutputDevice.OutputDevice", OutputDevice=OutputDevice)
+    _module("UM.i18n", i18nCatalog=i18nCatalog)
+    _module("UM.Resources", Resources=Resources)
+    _module("UM.Scene.Iterator.DepthFirstIterator", DepthFirstIterator=DepthFirstIterator)
+    _module("UM.Application", Application=CuraApplication)
+    _module("cura.CuraApplication", CuraApplication=CuraApplication)
+    _module("cura.Utils.Threading", call_on_qt_thread=call_on_qt_thread)
+    _module("cura.Snapshot", Snapshot=Snapshot)
+
+    application = CuraApplication()
+    CuraApplication._instance = application
+    if printer_config is not None:
+        set_printer_config(printer_config)
+    return application
+
+
+def set_printer_config(config):
+    application = CuraApplication.getInstance()
+    printer_id = application.getGlobalContainerStack().getId()
+    application.getPreferences().setValue("duetrrf/instances", json.dumps({printer_id: config}))
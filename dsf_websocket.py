@@ -0,0 +1,134 @@
+import json
+import urllib.parse
+
+try: # Cura 5
+    from PyQt6.QtCore import QCoreApplication, QUrl
+    from PyQt6.QtNetwork import QNetworkRequest
+    try:
+        from PyQt6.QtWebSockets import QWebSocket
+    except ImportError:
+        QWebSocket = None
+except: # Cura 4
+    from PyQt5.QtCore import QCoreApplication, QUrl
+    from PyQt5.QtNetwork import QNetworkRequest
+    try:
+        from PyQt5.QtWebSockets import QWebSocket
+    except ImportError:
+        QWebSocket = None
+
+from UM.Logger import Logger
+
+from .helpers import duet_headers
+
+
+def websocket_available() -> bool:
+    return QWebSocket is not None
+
+
+def apply_patch(model, patch):
+    """Applies a DSF object model patch to `model` and returns the result.
+
+    Objects are merged key by key, arrays are patched element-wise and
+    resized to the length of the patch, everything else is replaced.
+    """
+    if isinstance(model, dict) and isinstance(patch, dict):
+        for key, value in patch.items():
+            model[key] = apply_patch(model.get(key), value)
+        return model
+    if isinstance(model, list) and isinstance(patch, list):
+        del model[len(patch):]
+        for i, value in enumerate(patch):
+            if i < len(model):
+                model[i] = apply_patch(model[i], value)
+            else:
+                model.append(value)
+        return model
+    return patch
+
+
+class DSFObjectModelSubscription:
+    """Subscribes to the DuetSoftwareFramework object model via the /machine WebSocket.
+
+    DSF first sends the full object model, then JSON patches whenever something
+    changes. Each message has to be acknowledged with "OK" to receive the next
+    one. `on_update(model)` is called with the local model copy after every
+    message, `on_unavailable()` if the WebSocket can't be used or is lost, so the
+    caller can fall back to HTTP polling.
+    """
+
+    def __init__(self, url, http_user, http_password, on_update, on_unavailable):
+        self._url = url
+        self._http_user = http_user
+        self._http_password = http_password
+        self._on_update = on_update
+        self._on_unavailable = on_unavailable
+        self._socket = None
+        self._closing = False
+
+        self.model = None
+        self.messages = 0
+
+    def start(self):
+        if not websocket_available():
+            Logger.log("d", "QtWebSockets not available, cannot subscribe to the DSF object model")
+            self._on_unavailable()
+            return
+
+        parsed = urllib.parse.urlsplit(self._url)
+        scheme = "wss" if parsed.scheme == "https" else "ws"
+        ws_url = urllib.parse.urlunsplit((scheme, parsed.netloc, parsed.path.rstrip('/') + '/machine', '', ''))
+
+        request = QNetworkRequest(QUrl(ws_url))
+        for name, value in duet_headers(self._http_user, self._http_password).items():
+            request.setRawHeader(name.encode(), value.encode())
+
+        # parented to the application, so the socket survives until deleteLater() even if
+        # the subscription is dropped from within one of its own signal handlers
+        self._socket = QWebSocket(parent=QCoreApplication.instance())
+        self._socket.textMessageReceived.connect(self._onMessage)
+        self._socket.disconnected.connect(self._onDisconnected)
+        if hasattr(self._socket, "errorOccurred"): # Qt 6.5+
+            self._socket.errorOccurred.connect(self._onError)
+        else:
+            self._socket.error.connect(self._onError)
+        Logger.log("d", "Subscribing to DSF object model at " + ws_url)
+        self._socket.open(request)
+
+    def close(self):
+        self._closing = True
+        if self._socket is not None:
+            self._socket.close()
+            self._socket.deleteLater()
+            self._socket = None
+
+    def _onMessage(self, message):
+        if message.strip() == "PONG":
+            return
+
+        try:
+            data = json.loads(message)
+        except ValueError as e:
+            Logger.log("e", "failed to decode DSF object model message: " + str(e))
+            return
+
+        self.messages += 1
+        if self.model is None:
+            self.model = data
+        else:
+            self.model = apply_patch(self.model, data)
+
+        # acknowledge to receive the next patch
+        if self._socket is not None:
+            self._socket.sendTextMessage("OK\n")
+        self._on_update(self.model)
+
+    def _onError(self, error):
+        Logger.log("d", f"DSF object model WebSocket error: {error}")
+        self._onDisconnected()
+
+    def _onDisconnected(self):
+        if self._closing:
+            return
+        Logger.log("d", f"DSF object model WebSocket closed after {self.messages} messages")
+        self.close()
+        self._on_unavailable()
@@ -1,20 +1,222 @@
-from io import StringIO
+import base64
+import time
+import urllib.parse
+import zlib
+from bisect import bisect_right
 from typing import cast
 
+try: # Cura 5
+    from PyQt6.QtCore import QIODevice
+except: # Cura 4
+    from PyQt5.QtCore import QIODevice
+
+from cura.CuraApplication import CuraApplication
+
+from UM.Job import Job
 from UM.Logger import Logger
 from UM.Mesh.MeshWriter import MeshWriter
 from UM.PluginRegistry import PluginRegistry
 
 
-def serializing_scene_to_gcode():
+def duet_url(base_url: str, command: str, query=None) -> str:
+    url = base_url + command
+    enc_query = urllib.parse.urlencode(query or [], quote_via=urllib.parse.quote)
+    if enc_query:
+        url += '?' + enc_query
+    return url
+
+
+def duet_headers(http_user: str, http_password: str) -> dict:
+    headers = {
+        'User-Agent': 'Cura Plugin DuetRRF',
+        'Accept': 'application/json, text/javascript',
+        'Connection': 'keep-alive',
+    }
+
+    if http_user and http_password:
+        auth = "{}:{}".format(http_user, http_password).encode()
+        headers['Authorization'] = 'Basic ' + base64.b64encode(auth).decode()
+
+    return headers
+
+
+class GCodeChunkStream:
+    """Write-only text stream that keeps references to the written gcode chunks.
+
+    GCodeWriter writes the scene's gcode_list chunk by chunk. Instead of copying
+    everything into one big StringIO buffer, only references to the (immutable)
+    strings are kept, together with their encoded sizes. The encoded bytes are
+    produced lazily, one chunk at a time, while uploading.
+
+    The CRC32 of the encoded gcode is updated chunk by chunk as it is written,
+    on the serializer thread, so the checksum is known as soon as
+    serialization is done. `checksum_seconds` is the time spent on it.
+    """
+
+    def __init__(self, on_write=None):
+        self._on_write = on_write
+        self._chunks = []
+        self._offsets = []
+        self._size = 0
+        self._crc32 = 0
+        self.closed = False
+        self.checksum_seconds = 0.0
+
+    def write(self, s: str) -> int:
+        if not s:
+            return 0
+        # the encoded chunk is only needed for the checksum and dropped right away
+        start = time.perf_counter()
+        encoded = s.encode()
+        self._crc32 = zlib.crc32(encoded, self._crc32)
+        self.checksum_seconds += time.perf_counter() - start
+        self._chunks.append(s)
+        self._offsets.append(self._size)
+        self._size += len(encoded)
+        if self._on_write is not None:
+            self._on_write(len(self._chunks))
+        return len(s)
+
+    def size(self) -> int:
+        return self._size
+
+    def crc32(self) -> int:
+        return self._crc32
+
+    def chunks(self) -> list:
+        """Returns the written chunks, still valid after the stream is closed."""
+        return list(self._chunks)
+
+    def chunk_offsets(self) -> list:
+        return self._offsets
+
+    def encoded_chunk(self, index: int) -> bytes:
+        return self._chunks[index].encode()
+
+    def close(self):
+        self._chunks = []
+        self._offsets = []
+        self._size = 0
+        self._crc32 = 0
+        self.closed = True
+
+
+class GCodeUploadDevice(QIODevice):
+    """Read-only QIODevice serving the encoded bytes of a GCodeChunkStream.
+
+    Only the chunk currently being read is kept in encoded form, so peak memory
+    is bounded by the largest chunk (usually a single layer) instead of the
+    size of the whole job. The device is seekable, so Qt can rewind it in case
+    a request needs to be re-sent.
+    """
+
+    def __init__(self, stream: GCodeChunkStream, parent=None):
+        super().__init__(parent)
+        self._stream = stream
+        self._pos = 0
+        self._chunk_index = -1
+        self._chunk = b""
+        self.open(QIODevice.OpenModeFlag.ReadOnly | QIODevice.OpenModeFlag.Unbuffered)
+
+    def isSequential(self) -> bool:
+        return False
+
+    def size(self) -> int:
+        return self._stream.size()
+
+    def seek(self, pos: int) -> bool:
+        if pos < 0 or pos > self.size() or not super().seek(pos):
+            return False
+        self._pos = pos
+        return True
+
+    def atEnd(self) -> bool:
+        return self._pos >= self.size()
+
+    def bytesAvailable(self) -> int:
+        return self.size() - self._pos + super().bytesAvailable()
+
+    def readData(self, maxlen: int) -> bytes:
+        if self._pos >= self.size():
+            return b""
+
+        index = bisect_right(self._stream.chunk_offsets(), self._pos) - 1
+        if index != self._chunk_index:
+            self._chunk = self._stream.encoded_chunk(index)
+            self._chunk_index = index
+
+        start = self._pos - self._stream.chunk_offsets()[index]
+        data = self._chunk[start:start + maxlen]
+        self._pos += len(data)
+        return data
+
+    def writeData(self, data) -> int:
+        return -1
+
+    def close(self):
+        self._chunk = b""
+        self._chunk_index = -1
+        super().close()
+
+
+def serializing_scene_to_gcode(gcode_stream=None):
     # get the gcode through the GCodeWrite plugin
     # this serializes the actual scene and should produce the same output as "Save to File"
 
     Logger.log("d", "Serializing gcode...")
     gcode_writer = cast(MeshWriter, PluginRegistry.getInstance().getPluginObject("GCodeWriter"))
-    gcode_stream = StringIO()
+    if gcode_stream is None:
+        gcode_stream = GCodeChunkStream()
     success = gcode_writer.write(gcode_stream, None)
     if not success:
         Logger.log("e", "GCodeWriter failed.")
         return None
     return gcode_stream
+
+
+class SerializationCancelled(Exception):
+    pass
+
+
+class GCodeSerializeJob(Job):
+    """Serializes the scene's gcode on a background thread, like Cura's own WriteFileJob.
+
+    `progress` is emitted with the percentage of gcode chunks written so far,
+    `finished` with the GCodeChunkStream as result, or None if serialization
+    failed or was cancelled.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._cancelled = False
+        self._progress = -1
+
+        # GCodeWriter writes the gcode_list of the active build plate chunk by chunk, plus the settings
+        application = CuraApplication.getInstance()
+        scene = application.getController().getScene()
+        active_build_plate = application.getMultiBuildPlateModel().activeBuildPlate
+        gcode_list = getattr(scene, "gcode_dict", {}).get(active_build_plate) or []
+        self._total_chunks = len(gcode_list) + 1
+
+    def cancel(self):
+        self._cancelled = True
+        super().cancel()
+
+    def isCancelled(self) -> bool:
+        return self._cancelled
+
+    def run(self):
+        try:
+            self.setResult(serializing_scene_to_gcode(GCodeChunkStream(on_write=self._onChunkWritten)))
+        except SerializationCancelled:
+            Logger.log("d", "Serializing gcode cancelled")
+            self.setResult(None)
+
+    def _onChunkWritten(self, chunks: int):
+        if self._cancelled:
+            raise SerializationCancelled()
+        progress = min(100, chunks * 100 // self._total_chunks)
+        if progress != self._progress:
+            self._progress = progress
+            self.progress.emit(self, progress)
+
@@ -0,0 +1,98 @@
+import json
+import time
+from collections import deque
+
+from UM.Logger import Logger
+
+
+# the last jobs of all printers, newest last
+_history = deque(maxlen=50)
+# accumulated stage durations per printer
+_totals = {}
+# thumbnail timings of the last writeStarted, picked up by the job that triggered it
+_thumbnail_timings = {}
+
+
+def record_thumbnail_timings(render: float, encode: float):
+    _thumbnail_timings.clear()
+    _thumbnail_timings.update({"thumbnail_render": render, "thumbnail_encode": encode})
+
+def take_thumbnail_timings() -> dict:
+    timings = dict(_thumbnail_timings)
+    _thumbnail_timings.clear()
+    return timings
+
+def recent_jobs() -> list:
+    return list(_history)
+
+def printer_totals() -> dict:
+    return {printer: dict(totals) for printer, totals in _totals.items()}
+
+
+class JobMetrics:
+    """Durations of the stages of one job on one printer.
+
+    Stages are either timed with start()/end() around asynchronous steps, or
+    recorded with a duration measured elsewhere. finish() writes everything
+    as a single JSON log line, prefixed with "DuetRRF job metrics:", and adds
+    it to the history and per-printer totals.
+    """
+
+    def __init__(self, printer: str, device_type: str, file_name: str):
+        self.printer = printer
+        self.device_type = device_type
+        self.file_name = file_name
+        self.created_at = time.monotonic()
+        self.stages = {}
+        self.details = {}
+        self.error = None
+        self._started = {}
+        self._finished = False
+
+    def start(self, stage: str):
+        self._started.setdefault(stage, time.monotonic())
+
+    def end(self, stage: str, **details) -> float:
+        started = self._started.pop(stage, None)
+        if started is None:
+            return 0.0
+        duration = time.monotonic() - started
+        self.record(stage, duration, **details)
+        return duration
+
+    def record(self, stage: str, duration: float, **details):
+        self.stages[stage] = self.stages.get(stage, 0.0) + duration
+        self.details.update(details)
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = str(error)
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+
+        record = {
+            "printer": self.printer,
+            "device": self.device_type,
+            "file": self.file_name,
+            "success": self.error is None,
+            "total": round(time.monotonic() - self.created_at, 3),
+            "stages": {stage: round(duration, 3) for stage, duration in self.stages.items()},
+        }
+        record.update(self.details)
+        if self.error is not None:
+            record["error"] = self.error
+            # stages still running when the job failed
+            record["unfinished"] = sorted(self._started)
+        _history.append(record)
+
+        totals = _totals.setdefault(self.printer, {"jobs": 0, "failed": 0, "bytes": 0})
+        totals["jobs"] += 1
+        totals["failed"] += 0 if self.error is None else 1
+        totals["bytes"] += self.details.get("bytes", 0)
+        for stage, duration in self.stages.items():
+            totals[stage] = totals.get(stage, 0.0) + duration
+
+        Logger.log("i", "DuetRRF job metrics: " + json.dumps(record, sort_keys=True))
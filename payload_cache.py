@@ -0,0 +1,72 @@
+from collections import OrderedDict
+
+from cura.CuraApplication import CuraApplication
+
+from UM.Logger import Logger
+
+
+# cached payloads reference the scene's gcode, but outdated ones would keep old slices alive
+PAYLOAD_CACHE_SIZE = 512 * 1024 * 1024
+
+# build plate -> (slice generation, gcode_list, GCodeChunkStream), least recently used first
+_payloads = OrderedDict()
+_generation = 0
+
+
+def _active_gcode():
+    application = CuraApplication.getInstance()
+    build_plate = application.getMultiBuildPlateModel().activeBuildPlate
+    scene = application.getController().getScene()
+    gcode_dict = getattr(scene, "gcode_dict", None) or {}
+    return build_plate, gcode_dict.get(build_plate)
+
+def payload_generation() -> tuple:
+    """Identifies the gcode of the active build plate in the current slice generation.
+
+    Taken before serializing, and handed to put_payload() afterwards, so a
+    re-slice during serialization doesn't get the outdated gcode cached.
+    """
+    build_plate, gcode_list = _active_gcode()
+    return build_plate, _generation, gcode_list
+
+def get_payload():
+    """Returns the serialized GCodeChunkStream of the active build plate, or None."""
+    build_plate, gcode_list = _active_gcode()
+    entry = _payloads.get(build_plate)
+    if entry is None:
+        return None
+    generation, cached_list, stream = entry
+    if generation != _generation or cached_list is not gcode_list or stream.closed:
+        del _payloads[build_plate]
+        return None
+    _payloads.move_to_end(build_plate)
+    return stream
+
+def put_payload(generation: tuple, stream) -> bool:
+    """Caches a serialized stream, returns False if it is outdated or too big.
+
+    Cached streams are shared between devices and must not be closed by them.
+    """
+    build_plate, slice_generation, gcode_list = generation
+    active_build_plate, active_list = _active_gcode()
+    if gcode_list is None or slice_generation != _generation or active_build_plate != build_plate or active_list is not gcode_list:
+        return False
+    if stream.size() > PAYLOAD_CACHE_SIZE:
+        Logger.log("d", "Not caching {} bytes of gcode, over the cache limit".format(stream.size()))
+        return False
+
+    _payloads[build_plate] = (slice_generation, gcode_list, stream)
+    _payloads.move_to_end(build_plate)
+    while sum(entry[2].size() for entry in _payloads.values()) > PAYLOAD_CACHE_SIZE:
+        evicted, _ = _payloads.popitem(last=False)
+        Logger.log("d", "Evicted cached gcode of build plate {}".format(evicted))
+    return True
+
+def invalidate_payloads():
+    """Starts a new slice generation, called whenever the scene is (re-)sliced."""
+    global _generation
+    _generation += 1
+    if _payloads:
+        Logger.log("d", "Dropping {} cached gcode payload(s)".format(len(_payloads)))
+        # jobs still uploading a stream keep their own reference to it
+        _payloads.clear()
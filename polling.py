@@ -0,0 +1,92 @@
+import time
+
+try: # Cura 5
+    from PyQt6.QtCore import QTimer
+except: # Cura 4
+    from PyQt5.QtCore import QTimer
+
+
+class AdaptivePollInterval:
+    """Derives the next status polling interval from the observed progress rate.
+
+    Long simulations are polled rarely, while the interval shrinks towards
+    the estimated completion time, so short jobs are not finished up to
+    a full fixed interval late.
+    """
+
+    INITIAL_INTERVAL = 2000
+    MIN_INTERVAL = 250
+    MAX_INTERVAL = 15000
+
+    def __init__(self):
+        self._first = None
+        self._last = None
+
+    def next_interval(self, progress: float) -> int:
+        """Returns the delay in ms until the next poll, given the current progress in percent."""
+        now = time.monotonic()
+        if self._first is None or progress < self._first[1]:
+            self._first = (now, progress)
+        self._last = (now, progress)
+
+        elapsed = self._last[0] - self._first[0]
+        advanced = self._last[1] - self._first[1]
+        if elapsed <= 0 or advanced <= 0:
+            # no progress observed yet, keep polling at the default rate
+            return self.INITIAL_INTERVAL
+
+        rate = advanced / elapsed
+        remaining_ms = max(0.0, 100.0 - progress) / rate * 1000
+        # poll a few times during the remaining time, finer when close to the end
+        interval = int(remaining_ms / 4)
+        return max(self.MIN_INTERVAL, min(self.MAX_INTERVAL, interval))
+
+
+class PollScheduler:
+    """A single timer shared by all polling devices.
+
+    Instead of every device arming its own QTimer, callbacks are registered with
+    a due time and the timer only wakes the event loop for the earliest one.
+    """
+
+    def __init__(self):
+        self._due = {}
+        self._timer = QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._onTimeout)
+
+    def schedule(self, owner, callback, delay_ms: int):
+        self._due[id(owner)] = (time.monotonic() + delay_ms / 1000, callback)
+        self._rearm()
+
+    def cancel(self, owner):
+        if self._due.pop(id(owner), None) is not None:
+            self._rearm()
+
+    def pending(self) -> int:
+        return len(self._due)
+
+    def _rearm(self):
+        if not self._due:
+            self._timer.stop()
+            return
+        next_due = min(due for due, _ in self._due.values())
+        self._timer.start(max(0, int((next_due - time.monotonic()) * 1000)))
+
+    def _onTimeout(self):
+        now = time.monotonic()
+        ready = [(key, callback) for key, (due, callback) in self._due.items() if due <= now]
+        for key, _ in ready:
+            del self._due[key]
+        for _, callback in ready:
+            callback()
+        self._rearm()
+
+
+_scheduler = None
+
+def poll_scheduler() -> PollScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = PollScheduler()
+    return _scheduler
@@ -0,0 +1,43 @@
+import array
+
+try: # Cura 5
+    from PyQt6.QtGui import QImage, QPixelFormat
+except: # Cura 4
+    from PyQt5.QtGui import QImage, QPixelFormat
+
+
+def argb32_pixels(image: QImage) -> array.array:
+    """Returns the pixels of `image` as signed 32-bit 0xAARRGGBB values, top-down, left-to-right.
+
+    The raw pixel buffer of an ARGB32 image is read directly, without calling
+    QImage.pixel() for every single pixel. ARGB32 stores each pixel as a native
+    endian 32-bit integer, which matches the native "i" typecode of array.array.
+
+    The values are the same QImage.pixel() returns: premultiplied images (like
+    the ones Snapshot renders) keep their premultiplied values, they are not
+    converted to straight alpha.
+    """
+    if image.format() not in (QImage.Format.Format_ARGB32, QImage.Format.Format_ARGB32_Premultiplied):
+        if image.pixelFormat().premultiplied() == QPixelFormat.AlphaPremultiplied.Premultiplied:
+            image = image.convertToFormat(QImage.Format.Format_ARGB32_Premultiplied)
+        else:
+            image = image.convertToFormat(QImage.Format.Format_ARGB32)
+
+    width = image.width()
+    height = image.height()
+    bytes_per_line = image.bytesPerLine()
+    row_size = width * 4
+
+    bits = image.constBits()
+    bits.setsize(bytes_per_line * height)
+    buffer = memoryview(bits)
+
+    pixels = array.array("i")
+    if bytes_per_line == row_size:
+        pixels.frombytes(buffer[:row_size * height])
+    else:
+        # skip the padding at the end of each scan line
+        for y in range(height):
+            offset = y * bytes_per_line
+            pixels.frombytes(buffer[offset:offset + row_size])
+    return pixels
@@ -0,0 +1,147 @@
+# Vectorized variant of the transpiled QOIEncoder in qoi.py, using NumPy.
+# Produces byte-identical output to qoi.QOIEncoder, but computes runs, index
+# hashes and diff classes for all pixels in bulk instead of per-pixel.
+# https://qoiformat.org/qoi-specification.pdf
+
+import numpy as np
+
+_QOI_OP_INDEX = 0x00
+_QOI_OP_DIFF = 0x40
+_QOI_OP_LUMA = 0x80
+_QOI_OP_RUN = 0xc0
+_QOI_OP_RGB = 0xfe
+_QOI_OP_RGBA = 0xff
+
+_MAX_RUN = 62
+_OPAQUE_BLACK = 0xff000000
+
+
+class NumpyQOIEncoder:
+    """Drop-in replacement for qoi.QOIEncoder with a vectorized encode()."""
+
+    def __init__(self):
+        self._encoded = None
+        self._encoded_size = 0
+
+    @staticmethod
+    def can_encode(width: int, height: int, alpha: bool) -> bool:
+        """Determines if an image of given size can be encoded, see qoi.QOIEncoder.can_encode."""
+        return width > 0 and height > 0 and height <= int(int(2147483625 / width) / (5 if alpha else 4))
+
+    def encode(self, width: int, height: int, pixels, alpha: bool, linear_colorspace: bool) -> bool:
+        """Encodes the given image, see qoi.QOIEncoder.encode.
+
+        `pixels` can be any sequence or buffer of 32-bit 0xAARRGGBB values, signed or unsigned.
+        """
+        if not NumpyQOIEncoder.can_encode(width, height, alpha):
+            return False
+        pixels_size = width * height
+
+        if isinstance(pixels, np.ndarray):
+            px = pixels.reshape(-1)[:pixels_size]
+        else:
+            try:
+                px = np.frombuffer(pixels, dtype=np.uint32, count=pixels_size)
+            except (TypeError, ValueError):
+                px = np.asarray(pixels, dtype=np.int64)[:pixels_size]
+        px = px.astype(np.uint32, copy=True) if px.dtype != np.uint32 else px.copy()
+        if not alpha:
+            px |= np.uint32(_OPAQUE_BLACK)
+
+        # a pixel is part of a run if it equals its predecessor, the first one is compared to opaque black
+        prev = np.empty_like(px)
+        prev[0] = _OPAQUE_BLACK
+        prev[1:] = px[:-1]
+        changed = np.flatnonzero(px != prev)
+
+        # run lengths preceding each changed pixel, plus the trailing run at the end of the image
+        starts = np.concatenate(([-1], changed))
+        run_lengths = np.diff(np.concatenate((starts, [pixels_size]))) - 1
+        run_bytes = run_lengths // _MAX_RUN + (run_lengths % _MAX_RUN > 0)
+
+        value = px[changed]
+        last = prev[changed]
+        r = (value >> 16 & 0xff).astype(np.int16)
+        g = (value >> 8 & 0xff).astype(np.int16)
+        b = (value & 0xff).astype(np.int16)
+        a = (value >> 24).astype(np.int16)
+
+        # the index holds the previous changed pixel with the same hash, or zero if there was none
+        hashes = (r * 3 + g * 5 + b * 7 + a * 11) & 63
+        order = np.argsort(hashes, kind="stable")
+        sorted_hashes = hashes[order]
+        sorted_values = value[order]
+        previous_in_index = np.zeros_like(sorted_values)
+        same_hash = sorted_hashes[1:] == sorted_hashes[:-1]
+        previous_in_index[1:][same_hash] = sorted_values[:-1][same_hash]
+        index_hit = np.empty(len(value), dtype=bool)
+        index_hit[order] = sorted_values == previous_in_index
+
+        alpha_changed = (value >> 24) != (last >> 24)
+        dr = ((r - (last >> 16 & 0xff).astype(np.int16) + 128) & 0xff) - 128
+        dg = ((g - (last >> 8 & 0xff).astype(np.int16) + 128) & 0xff) - 128
+        db = ((b - (last & 0xff).astype(np.int16) + 128) & 0xff) - 128
+        dr_dg = dr - dg
+        db_dg = db - dg
+
+        is_index = index_hit
+        rest = ~is_index
+        is_rgba = rest & alpha_changed
+        rest &= ~alpha_changed
+        is_diff = rest & (dr >= -2) & (dr <= 1) & (dg >= -2) & (dg <= 1) & (db >= -2) & (db <= 1)
+        rest &= ~is_diff
+        is_luma = rest & (dr_dg >= -8) & (dr_dg <= 7) & (dg >= -32) & (dg <= 31) & (db_dg >= -8) & (db_dg <= 7)
+        is_rgb = rest & ~is_luma
+
+        op_bytes = np.ones(len(value), dtype=np.int64)
+        op_bytes[is_luma] = 2
+        op_bytes[is_rgb] = 4
+        op_bytes[is_rgba] = 5
+
+        # every changed pixel emits its preceding run (if any) followed by its own op
+        record_bytes = np.append(run_bytes[:-1] + op_bytes, run_bytes[-1])
+        record_offsets = 14 + np.concatenate(([0], np.cumsum(record_bytes)))
+        data_size = int(record_offsets[-1])
+
+        encoded = np.zeros(data_size + 8, dtype=np.uint8)
+        encoded[0:4] = (113, 111, 105, 102)
+        encoded[4:8] = np.array([width], dtype=">u4").view(np.uint8)
+        encoded[8:12] = np.array([height], dtype=">u4").view(np.uint8)
+        encoded[12] = 4 if alpha else 3
+        encoded[13] = 1 if linear_colorspace else 0
+        encoded[-1] = 1
+
+        # runs: full runs of 62 pixels first, then the remainder
+        has_run = run_bytes > 0
+        run_starts = record_offsets[:-1][has_run]
+        run_counts = run_bytes[has_run]
+        run_positions = np.repeat(run_starts - np.cumsum(run_counts) + run_counts, run_counts) + np.arange(run_counts.sum())
+        encoded[run_positions] = _QOI_OP_RUN | (_MAX_RUN - 1)
+        remainder = run_lengths[has_run] % _MAX_RUN
+        partial = remainder > 0
+        encoded[(run_starts + run_counts - 1)[partial]] = _QOI_OP_RUN | (remainder[partial] - 1)
+
+        op = record_offsets[:-2] + run_bytes[:-1]
+        encoded[op[is_index]] = hashes[is_index]
+        encoded[op[is_diff]] = _QOI_OP_DIFF | (dr[is_diff] + 2) << 4 | (dg[is_diff] + 2) << 2 | (db[is_diff] + 2)
+        encoded[op[is_luma]] = _QOI_OP_LUMA | (dg[is_luma] + 32)
+        encoded[op[is_luma] + 1] = (dr_dg[is_luma] + 8) << 4 | (db_dg[is_luma] + 8)
+        for mask, tag in ((is_rgb, _QOI_OP_RGB), (is_rgba, _QOI_OP_RGBA)):
+            o = op[mask]
+            encoded[o] = tag
+            encoded[o + 1] = r[mask]
+            encoded[o + 2] = g[mask]
+            encoded[o + 3] = b[mask]
+        encoded[op[is_rgba] + 4] = a[is_rgba]
+
+        self._encoded = encoded.tobytes()
+        self._encoded_size = data_size + 8
+        return True
+
+    def get_encoded(self) -> bytes:
+        """Returns the encoded file contents, see qoi.QOIEncoder.get_encoded."""
+        return self._encoded
+
+    def get_encoded_size(self) -> int:
+        """Returns the encoded file length."""
+        return self._encoded_size
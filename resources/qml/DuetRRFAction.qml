@@ -107,6 +107,13 @@ Cura.MachineAction
             anchors.right: parent.right
         }
 
+        CheckBox {
+            id: fleet_memberField
+            text: catalog.i18nc("@label", "Include in fleet uploads to all printers of this type")
+            checked: manager.printerSettingFleetMember
+            anchors.left: parent.left
+        }
+
         Item {
             width: errorMsgLabel.implicitWidth
             height: errorMsgLabel.implicitHeight
@@ -128,7 +135,7 @@ Cura.MachineAction
                 id: saveButton
                 text: catalog.i18nc("@action:button", "Save Config")
                 onClicked: {
-                    manager.saveConfig(urlField.text, duet_passwordField.text, http_userField.text, http_passwordField.text, embed_thumbnailsField.checked, thumbnail_sizesField.text)
+                    manager.saveConfig(urlField.text, duet_passwordField.text, http_userField.text, http_passwordField.text, embed_thumbnailsField.checked, thumbnail_sizesField.text, fleet_memberField.checked)
                     actionDialog.reject()
                 }
                 enabled: base.validUrl
@@ -0,0 +1,131 @@
+from cura.CuraApplication import CuraApplication
+
+from UM.Logger import Logger
+
+from .helpers import GCodeSerializeJob
+from .payload_cache import payload_generation, put_payload
+
+
+# the file in 0:/gcodes/ a sliced job is uploaded to before the user confirms it
+SPECULATIVE_FILE_NAME = ".duetrrf-speculative.gcode"
+
+# printer URL -> SpeculativeUpload of the current slice
+_uploads = {}
+# outdated uploads still serializing, kept alive until their serialize job is done
+_stale = set()
+
+
+def is_speculative_file(file_name: str) -> bool:
+    return file_name == SPECULATIVE_FILE_NAME
+
+def start_speculative_upload(config: dict):
+    """Serializes the current slice and uploads it to the printer before the user asks for it."""
+    discard_speculative_uploads()
+    upload = SpeculativeUpload(config)
+    _uploads[upload.url] = upload
+    upload.start()
+
+def take_speculative_upload(url: str, stream) -> bool:
+    """Returns True if the gcode of stream is waiting on the printer as SPECULATIVE_FILE_NAME.
+
+    The upload is handed over to the caller, who moves the file into place.
+    """
+    upload = _uploads.get(url)
+    if upload is None or not upload.done or upload.stream is not stream:
+        return False
+    del _uploads[url]
+    return True
+
+def discard_speculative_uploads():
+    """Deletes the speculative uploads of an outdated slice, called when the scene is re-sliced."""
+    for upload in list(_uploads.values()):
+        upload.discard()
+    _uploads.clear()
+
+
+class SpeculativeUpload:
+    """Uploads the current slice to one printer in the background.
+
+    The gcode is serialized into the shared payload cache, so the job the
+    user confirms later gets the very same stream and can take over the
+    uploaded file. The upload runs through a headless upload device and the
+    printer's job queue, a job confirmed in the meantime waits for it.
+    """
+
+    def __init__(self, config: dict):
+        self.url = config["url"]
+        self._config = config
+        self._generation = payload_generation()
+        self._serializeJob = None
+        self._device = None
+        self._uploadJob = None
+        self.stream = None
+        self.done = False
+        self._discarded = False
+
+    def start(self):
+        Logger.log("d", "Speculatively serializing the sliced gcode for {}...".format(self.url))
+        self._serializeJob = GCodeSerializeJob()
+        self._serializeJob.finished.connect(self._onSerialized)
+        self._serializeJob.start()
+
+    def _onSerialized(self, job):
+        self._serializeJob = None
+        _stale.discard(self)
+        stream = job.getResult()
+        if stream is None:
+            return
+        if self._discarded:
+            # re-sliced while serializing, nobody else got hold of the stream
+            stream.close()
+            return
+        if not put_payload(self._generation, stream):
+            # without the shared payload a confirmed job would serialize and upload it again anyway
+            Logger.log("d", "Not uploading speculatively, the sliced gcode can't be cached")
+            stream.close()
+            return
+
+        # imported here, DuetRRFOutputDevice imports this module
+        from .DuetRRFOutputDevice import DuetRRFOutputDevice, DuetRRFDeviceType
+        global_container_stack = CuraApplication.getInstance().getGlobalContainerStack()
+        self.stream = stream
+        self._device = DuetRRFOutputDevice(
+            self._config,
+            DuetRRFDeviceType.upload,
+            printer_id=global_container_stack.getId(),
+            printer_name=global_container_stack.getName(),
+            headless=True,
+        )
+        self._device.writeSuccess.connect(self._onUploaded)
+        self._device.writeError.connect(self._onUploadFailed)
+        Logger.log("d", "Speculatively uploading {} bytes to {}...".format(stream.size(), self.url))
+        self._uploadJob = self._device.startUpload(SPECULATIVE_FILE_NAME, stream)
+
+    def _onUploaded(self, device):
+        Logger.log("d", "Speculative upload to {} done".format(self.url))
+        self._uploadJob = None
+        self.done = True
+
+    def _onUploadFailed(self, device):
+        self._uploadJob = None
+        if _uploads.get(self.url) is self:
+            del _uploads[self.url]
+
+    def discard(self):
+        self._discarded = True
+        if self._serializeJob is not None:
+            # a queued serialize job is dropped by Uranium without finishing, a running
+            # one finishes without a result once it notices the cancellation, or with a
+            # stream to close if it was faster
+            if self._serializeJob.isRunning() or self._serializeJob.isFinished():
+                _stale.add(self)
+            self._serializeJob.cancel()
+            self._serializeJob = None
+        elif self.done:
+            Logger.log("d", "Deleting outdated speculative upload on {}".format(self.url))
+            self._device.deleteFile(SPECULATIVE_FILE_NAME)
+        elif self._uploadJob is not None:
+            # don't let a confirmed job wait for an outdated upload
+            self._device.cancelUpload(self._uploadJob)
+            self._uploadJob = None
+        self.stream = None
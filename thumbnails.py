@@ -1,43 +1,105 @@
 import base64
+import hashlib
+import math
+import os
+import time
 import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import StringIO
 
 try: # Cura 5
     from PyQt6 import QtCore
-    from PyQt6.QtCore import QCoreApplication, QBuffer
-    from PyQt6.QtGui import QImage
+    from PyQt6.QtCore import QBuffer
 except: # Cura 4
     from PyQt5 import QtCore
-    from PyQt5.QtCore import QCoreApplication, QBuffer
-    from PyQt5.QtGui import QImage
+    from PyQt5.QtCore import QBuffer
 
 from UM.Logger import Logger
+from UM.Scene.Iterator.DepthFirstIterator import DepthFirstIterator
 
+from cura.CuraApplication import CuraApplication
 from cura.Snapshot import Snapshot
 
+from .qimage_pixels import argb32_pixels
 from .qoi import QOIEncoder
+try:
+    # Cura ships NumPy, but stay usable without it
+    from .qoi_numpy import NumpyQOIEncoder
+except ImportError:
+    NumpyQOIEncoder = None
 from . import DuetRRFSettings
+from .metrics import record_thumbnail_timings
 
+_encoder_pool = None
+# thumbnail block rendered when the last slice finished: (gcode_list, sizes, block)
+_precomputed = None
+# identifies the precomputation still being encoded
+_precomputing = None
 
-def encode_as_qoi(thumbnail):
+# thumbnail blocks of recently rendered scenes, keyed by scene fingerprint and render settings
+THUMBNAIL_CACHE_SIZE = 16
+_thumbnail_cache = OrderedDict()
+_thumbnail_cache_hits = 0
+_thumbnail_cache_misses = 0
+
+def _get_encoder_pool():
+    # threads instead of processes: spawning processes from a frozen Cura build is not safe,
+    # and the NumPy encoder releases the GIL for most of its work
+    # a single worker for the pure-Python encoder, more of them would only contend for the GIL
+    global _encoder_pool
+    if _encoder_pool is None:
+        workers = min(4, os.cpu_count() or 1) if NumpyQOIEncoder else 1
+        _encoder_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="DuetRRF-thumbnail")
+    return _encoder_pool
+
+def _encode_now(*args):
+    # same interface as a pool future, for encoding on the calling thread
+    future = Future()
+    try:
+        future.set_result(encode_thumbnail_block(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def encode_pixels_as_qoi(width, height, pixels, alpha):
     # https://qoiformat.org/qoi-specification.pdf
-    pixels = [thumbnail.pixel(x, y) for y in range(thumbnail.height()) for x in range(thumbnail.width())]
-    pixels = [(unsigned_p ^ (1 << 31)) - (1 << 31) for unsigned_p in pixels]
-    encoder = QOIEncoder()
+    encoder = NumpyQOIEncoder() if NumpyQOIEncoder else QOIEncoder()
     r = encoder.encode(
-        width=thumbnail.width(),
-        height=thumbnail.height(),
+        width=width,
+        height=height,
         pixels=pixels,
-        alpha=thumbnail.hasAlphaChannel(),
+        alpha=alpha,
         linear_colorspace=False
     )
     if not r:
         raise ValueError("image size unsupported")
-    Logger.log("d", f"Successfully encoded {thumbnail.width()}x{thumbnail.height()} thumbnail in QOI format.")
+    Logger.log("d", f"Successfully encoded {width}x{height} thumbnail in QOI format.")
 
     size = encoder.get_encoded_size()
     return encoder.get_encoded()[:size]
 
+def encode_as_qoi(thumbnail):
+    return encode_pixels_as_qoi(thumbnail.width(), thumbnail.height(), argb32_pixels(thumbnail), thumbnail.hasAlphaChannel())
+
+def encode_thumbnail_block(width, height, image_width, image_height, pixels, alpha):
+    # QOI encode, base64 and wrap into gcode comments - runs on the encoder pool
+    start = time.perf_counter()
+    qoi_data = encode_pixels_as_qoi(image_width, image_height, pixels, alpha)
+    b64_data = base64.b64encode(qoi_data).decode('ascii')
+    b64_encoded_size = len(b64_data)
+
+    block = StringIO()
+    block.write(f"; thumbnail_QOI begin {width}x{height} {b64_encoded_size}\n")
+    max_row_length = 78
+    for i in range(0, b64_encoded_size, max_row_length):
+        s = b64_data[i:i+max_row_length]
+        block.write(f"; {s}\n")
+    block.write("; thumbnail_QOI end\n")
+
+    Logger.log("d", f"Encoded {width}x{height} thumbnail block in {(time.perf_counter() - start) * 1000:.1f} ms.")
+    return block.getvalue()
+
 def encode_as_png(thumbnail):
     buffer = QBuffer()
     buffer.open(QBuffer.ReadWrite)
@@ -45,16 +107,16 @@ def encode_as_png(thumbnail):
     buffer.close()
     return buffer.data()
 
-def generate_thumbnail():
+def configured_thumbnail_sizes():
     config: dict = DuetRRFSettings.get_config()
-    if not config.get("embed_thumbnails", True):
+    if not DuetRRFSettings.embed_thumbnails_enabled(config):
         Logger.log("d", "Skipping thumbnail embedding because its not enabled for this printer.")
-        return
+        return None
     raw_sizes: str = config.get("thumbnail_sizes", "").lower().strip()
     sizes = DuetRRFSettings.DEFAULT_THUMBNAIL_SIZES
     if raw_sizes == "none" or raw_sizes == "no" or raw_sizes == "false":
         Logger.log("d", f"Skipping thumbnail embedding because no valid sizes defined for this printer. Found value: {raw_sizes}")
-        return
+        return None
     elif raw_sizes == "":
         Logger.log("d", f"Using default thumbnail sizes.")
     else:
@@ -63,34 +125,258 @@ def generate_thumbnail():
             sizes = [(int(w), int(h)) for w, h in sizes]
         except:
             Logger.log("d", f"Using default thumbnail sizes. Failed to parse config value: {raw_sizes}")
+            sizes = DuetRRFSettings.DEFAULT_THUMBNAIL_SIZES
+    return sizes
+
+def precompute_thumbnails(gcode_list, on_done):
+    # called when slicing is done, so writing the gcode only has to splice in the block,
+    # on_done is called once the block is ready, or right away if there is nothing to precompute
+    global _precomputed, _precomputing
+    _precomputed = None
+    sizes = configured_thumbnail_sizes()
+    if sizes is None or not gcode_list:
+        on_done()
+        return
+    token = object()
+    _precomputing = token
+
+    def on_thumbnails(thumbnail_stream):
+        global _precomputed
+        if _precomputing is not token:
+            # re-sliced while encoding
+            return
+        _precomputed = (gcode_list, sizes, thumbnail_stream.getvalue())
+        Logger.log("d", f"Precomputed {len(_precomputed[2])} bytes of thumbnails for the finished slice.")
+        on_done()
+
+    generate_thumbnail_async(on_thumbnails, sizes)
+
+def precomputed_thumbnails(gcode_list):
+    # the block is only valid for the slice and the sizes it was rendered for
+    if _precomputed is None:
+        return None
+    precomputed_list, sizes, block = _precomputed
+    if precomputed_list is not gcode_list or sizes != configured_thumbnail_sizes():
+        return None
+    return block
+
+def discard_precomputed_thumbnails():
+    global _precomputed, _precomputing
+    _precomputed = None
+    _precomputing = None
+
+def scene_fingerprint():
+    # cheap identity of what Snapshot.snapshot renders: the visible sliceable nodes,
+    # their placement, meshes and extruders, and the extruder colours
+    try:
+        application = CuraApplication.getInstance()
+        fingerprint = hashlib.sha1()
+        for node in DepthFirstIterator(application.getController().getScene().getRoot()):
+            mesh_data = node.getMeshData()
+            if not node.callDecoration("isSliceable") or not mesh_data or not node.isVisible():
+                continue
+            fingerprint.update(node.getWorldTransformation().getData().tobytes())
+            # mesh data is immutable, changing a mesh replaces the object
+            fingerprint.update(f"{id(mesh_data)}:{mesh_data.getVertexCount()}:{node.callDecoration('getActiveExtruderPosition')};".encode())
+        for extruder in application.getGlobalContainerStack().extruderList:
+            fingerprint.update(f"{extruder.material.getMetaDataEntry('color_code')};".encode())
+        return fingerprint.hexdigest()
+    except Exception as e:
+        Logger.log("d", f"Not caching thumbnails, failed to fingerprint the scene: {e}")
+        return None
+
+def thumbnail_cache_stats() -> dict:
+    return {
+        "entries": len(_thumbnail_cache),
+        "hits": _thumbnail_cache_hits,
+        "misses": _thumbnail_cache_misses,
+    }
+
+def generate_thumbnail(sizes=None):
+    # waits for the encoders, for writes which are serialized right after writeStarted
+    pending = _start_thumbnails(sizes, pool=_get_encoder_pool() if NumpyQOIEncoder else None)
+    if pending is None:
+        return None
+    return pending.wait()
+
+def generate_thumbnail_async(callback, sizes=None) -> bool:
+    """Renders the thumbnails and encodes them in the background.
+
+    Rendering needs the Qt thread, but encoding doesn't block it anymore.
+    The callback gets the StringIO of the thumbnail block on the Qt thread,
+    right away if the block is cached. Returns False without calling it if
+    thumbnails are disabled for the active printer.
+    """
+    pending = _start_thumbnails(sizes, pool=_get_encoder_pool())
+    if pending is None:
+        return False
+    pending.then(callback)
+    return True
 
+def _start_thumbnails(sizes, pool):
+    global _thumbnail_cache_hits, _thumbnail_cache_misses
+    if sizes is None:
+        sizes = configured_thumbnail_sizes()
+        if sizes is None:
+            return None
+
+    # re-slicing with changed print settings doesn't change how the scene looks
+    fingerprint = scene_fingerprint()
+    cache_key = None
+    if fingerprint is not None:
+        cache_key = (
+            fingerprint,
+            tuple(sizes),
+            bool(DuetRRFSettings.get_preference(DuetRRFSettings.DUETRRF_THUMBNAIL_RENDER_ONCE)),
+            str(DuetRRFSettings.get_preference(DuetRRFSettings.DUETRRF_THUMBNAIL_SUPERSAMPLE)),
+        )
+        block = _thumbnail_cache.get(cache_key)
+        if block is not None:
+            _thumbnail_cache.move_to_end(cache_key)
+            _thumbnail_cache_hits += 1
+            Logger.log("d", f"Reusing thumbnails of an unchanged scene | {thumbnail_cache_stats()}")
+            return _PendingThumbnails(sizes, None, [], block=block)
+        _thumbnail_cache_misses += 1
 
-    thumbnail_stream = StringIO()
     Logger.log("d", f"Rendering thumbnail image in sizes: {sizes}")
 
+    render_start = time.perf_counter()
+    if DuetRRFSettings.get_preference(DuetRRFSettings.DUETRRF_THUMBNAIL_RENDER_ONCE):
+        snapshots = render_once(sizes)
+    else:
+        snapshots = render_each(sizes)
+    render_seconds = time.perf_counter() - render_start
+
+    futures = []
+    for (width, height), thumbnail in zip(sizes, snapshots):
+        if thumbnail is None:
+            Logger.log("d", f"Skipping failed {width}x{height} thumbnail.")
+            continue
+        # QImage is not touched by the workers, they only get a copy of the raw pixels
+        args = (
+            width, height,
+            thumbnail.width(), thumbnail.height(),
+            argb32_pixels(thumbnail),
+            thumbnail.hasAlphaChannel(),
+        )
+        futures.append(((width, height), pool.submit(encode_thumbnail_block, *args) if pool else _encode_now(*args)))
+    return _PendingThumbnails(sizes, cache_key, futures, render_seconds=render_seconds)
+
+
+class _PendingThumbnails:
+    """Thumbnail blocks being encoded, merged into one block once all of them are done."""
+
+    def __init__(self, sizes, cache_key, futures, render_seconds=0.0, block=None):
+        self._sizes = sizes
+        self._cache_key = cache_key
+        self._futures = futures
+        self._render_seconds = render_seconds
+        self._encode_start = time.perf_counter()
+        self._block = block
+        self._callback = None
+        self._remaining = len(futures)
+
+    def wait(self):
+        for _, future in self._futures:
+            future.exception()
+        return self._finish()
+
+    def then(self, callback):
+        if self._remaining == 0:
+            callback(self._finish())
+            return
+        self._callback = callback
+        for _, future in self._futures:
+            # done callbacks run on the worker thread, the result is merged on the Qt thread
+            future.add_done_callback(lambda future: CuraApplication.getInstance().callLater(self._onEncoded))
+
+    def _onEncoded(self):
+        self._remaining -= 1
+        if self._remaining == 0:
+            self._callback(self._finish())
+
+    def _finish(self):
+        if self._block is not None:
+            return StringIO(self._block)
+
+        # merge in the order of the configured sizes, independent of which worker finished first
+        thumbnail_stream = StringIO()
+        complete = len(self._futures) == len(self._sizes)
+        for (width, height), future in self._futures:
+            try:
+                thumbnail_stream.write(future.result())
+                Logger.log("d", f"Successfully embedded {width}x{height} thumbnail as base64 into gcode comments.")
+            except Exception as e:
+                Logger.log("e", "failed to create snapshot: " + str(e))
+                Logger.log("e", "".join(traceback.format_exception(e)))
+                # continue without this QOI snapshot
+                complete = False
+                continue
+
+        # incomplete blocks are not cached, the next job tries again
+        if self._cache_key is not None and complete:
+            _thumbnail_cache[self._cache_key] = thumbnail_stream.getvalue()
+            while len(_thumbnail_cache) > THUMBNAIL_CACHE_SIZE:
+                _thumbnail_cache.popitem(last=False)
+
+        record_thumbnail_timings(self._render_seconds, time.perf_counter() - self._encode_start)
+        return thumbnail_stream
+
+def render_each(sizes):
+    # one full offscreen render of the scene per requested size
+    snapshots = []
     for width, height in sizes:
+        start = time.perf_counter()
         try:
-            thumbnail = Snapshot.snapshot(width=width, height=height)
-            if thumbnail is None:
-                Logger.log("d", f"Skipping failed {width}x{height} thumbnail.")
-                continue
+            snapshots.append(Snapshot.snapshot(width=width, height=height))
+        except Exception as e:
+            Logger.log("e", f"failed to render {width}x{height} snapshot: {e}")
+            snapshots.append(None)
+        Logger.log("d", f"Rendered {width}x{height} snapshot in {(time.perf_counter() - start) * 1000:.1f} ms.")
+    return snapshots
 
-            qoi_data = encode_as_qoi(thumbnail)
-            b64_data = base64.b64encode(qoi_data).decode('ascii')
-            b64_encoded_size = len(b64_data)
+def render_once(sizes):
+    # a single offscreen render per aspect ratio at the largest requested size (optionally supersampled),
+    # all requested sizes of that aspect ratio are then derived from it by smooth downscaling
+    if not sizes:
+        return []
+    try:
+        supersample = max(1.0, float(DuetRRFSettings.get_preference(DuetRRFSettings.DUETRRF_THUMBNAIL_SUPERSAMPLE)))
+    except (TypeError, ValueError):
+        supersample = 1.0
 
-            thumbnail_stream.write(f"; thumbnail_QOI begin {width}x{height} {b64_encoded_size}\n")
-            max_row_length = 78
-            for i in range(0, b64_encoded_size, max_row_length):
-                s = b64_data[i:i+max_row_length]
-                thumbnail_stream.write(f"; {s}\n")
-            thumbnail_stream.write(f"; thumbnail_QOI end\n")
+    # e.g. 48x48 and 480x272 need two renders, downscaling across aspect ratios would distort or shrink them
+    aspects = {}
+    for width, height in sizes:
+        divisor = math.gcd(width, height)
+        aspects.setdefault((width // divisor, height // divisor), []).append((width, height))
 
-            Logger.log("d", f"Successfully embedded {width}x{height} thumbnail as base64 into gcode comments.")
+    renders = {}
+    for aspect, aspect_sizes in aspects.items():
+        render_width, render_height = max(aspect_sizes)
+        render_width = int(render_width * supersample)
+        render_height = int(render_height * supersample)
+        start = time.perf_counter()
+        try:
+            renders[aspect] = Snapshot.snapshot(width=render_width, height=render_height)
         except Exception as e:
-            Logger.log("e", "failed to create snapshot: " + str(e))
-            Logger.log("e", traceback.format_stack())
-            # continue without this QOI snapshot
-            continue
+            Logger.log("e", f"failed to render {render_width}x{render_height} snapshot: {e}")
+            renders[aspect] = None
+        Logger.log("d", f"Rendered {render_width}x{render_height} snapshot in {(time.perf_counter() - start) * 1000:.1f} ms.")
 
-    return thumbnail_stream
+    snapshots = []
+    for width, height in sizes:
+        divisor = math.gcd(width, height)
+        snapshot = renders[(width // divisor, height // divisor)]
+        if snapshot is None:
+            snapshots.append(None)
+            continue
+        start = time.perf_counter()
+        if snapshot.width() == width and snapshot.height() == height:
+            thumbnail = snapshot
+        else:
+            # same aspect ratio, scaling to the exact size doesn't distort it
+            thumbnail = snapshot.scaled(width, height, QtCore.Qt.AspectRatioMode.IgnoreAspectRatio, QtCore.Qt.TransformationMode.SmoothTransformation)
+        snapshots.append(thumbnail)
+        Logger.log("d", f"Scaled {width}x{height} thumbnail in {(time.perf_counter() - start) * 1000:.1f} ms.")
+    return snapshots